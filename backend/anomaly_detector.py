@@ -0,0 +1,304 @@
+import datetime
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from .db.writer import db_writer
+from .utils.timer_wheel import TimerWheel
+
+# Anomaly detector settings
+ANOMALY_TICK_S = float(os.environ.get("ANOMALY_TICK_S", 1.0)) # Timer wheel resolution and alert flush interval
+ANOMALY_WARMUP_PACKETS = int(os.environ.get("ANOMALY_WARMUP_PACKETS", 10)) # Baselines need this many packets before they alert
+ANOMALY_SILENCE_FACTOR = float(os.environ.get("ANOMALY_SILENCE_FACTOR", 4.0)) # Silent after this many usual inter-arrival times
+ANOMALY_SILENCE_MIN_S = float(os.environ.get("ANOMALY_SILENCE_MIN_S", 120))
+ANOMALY_SILENCE_MAX_S = float(os.environ.get("ANOMALY_SILENCE_MAX_S", 3600)) # Also the timeout before a node's interval is known
+ANOMALY_SNR_DROP_DB = float(os.environ.get("ANOMALY_SNR_DROP_DB", 6.0))
+ANOMALY_RSSI_DROP_DB = float(os.environ.get("ANOMALY_RSSI_DROP_DB", 10.0))
+ANOMALY_TRAFFIC_FACTOR = float(os.environ.get("ANOMALY_TRAFFIC_FACTOR", 5.0)) # Packets arriving this many times faster than usual
+ANOMALY_ALERT_BURST = float(os.environ.get("ANOMALY_ALERT_BURST", 3)) # Per node token bucket
+ANOMALY_ALERT_REFILL_S = float(os.environ.get("ANOMALY_ALERT_REFILL_S", 600))
+ANOMALY_ALERTS_PER_MIN = float(os.environ.get("ANOMALY_ALERTS_PER_MIN", 30)) # Fleet-wide; the rest is summarized
+
+FAST_ALPHA = 0.25 # Follows the last few packets
+SLOW_ALPHA = 0.02 # Baseline over the last ~50 packets
+
+SILENCE, LINK_DEGRADED, TRAFFIC = "silence", "link_degraded", "abnormal_traffic"
+ALERT_LEVELS = {SILENCE: "critical", LINK_DEGRADED: "warning", TRAFFIC: "warning"}
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+class ActiveAlert:
+    __slots__ = ("id", "resolved", "suppressed")
+
+    def __init__(self, suppressed: bool = False):
+        self.id = None # Set once the row is written
+        self.resolved = False
+        self.suppressed = suppressed # Rate-limited: deduplicates, but has no row to resolve
+
+class NodeStats:
+    # Constant-size running state per node; nothing here grows with traffic
+    __slots__ = ("packets", "last_seen", "interval_fast", "interval_slow", "snr_fast", "snr_slow", "rssi_fast", "rssi_slow",
+                 "tokens", "tokens_at", "active")
+
+    def __init__(self, now: float):
+        self.packets = 0
+        self.last_seen = now
+        self.interval_fast = self.interval_slow = None
+        self.snr_fast = self.snr_slow = None
+        self.rssi_fast = self.rssi_slow = None
+        self.tokens = ANOMALY_ALERT_BURST
+        self.tokens_at = time.monotonic()
+        self.active: Dict[str, ActiveAlert] = {} # At most one per alert kind
+
+def _ewma(current: Optional[float], value: float, alpha: float) -> float:
+    return value if current is None else current + alpha * (value - current)
+
+class AnomalyDetector:
+    """Streaming per-node anomaly detection for the ingest path.
+
+    Each packet updates fast/slow EWMAs of SNR, RSSI and inter-arrival time
+    (the slow ones are the node's baseline and freeze while it is alerting)
+    and re-arms the node's silence timer on a timer wheel. Alerts are
+    deduplicated per node and kind until the condition clears, which resolves
+    them, and rate-limited per node and fleet-wide; a gateway outage that
+    silences every node produces a handful of alerts plus one summary. Rows
+    are written in batches through the DB writer; nothing here reads the DB.
+    """
+
+    def __init__(self, tick: float = ANOMALY_TICK_S):
+        self.tick = tick
+        self.wheel = TimerWheel(tick=tick, slots=max(64, int(ANOMALY_SILENCE_MAX_S / tick) + 1))
+        self._nodes: Dict[str, NodeStats] = {}
+        self._pending: List[tuple] = [] # (node_id, kind, ActiveAlert, row) waiting for the next flush
+        self._resolve: List[int] = []
+        self._global_tokens = ANOMALY_ALERTS_PER_MIN
+        self._global_at = time.monotonic()
+        self._suppressed: Dict[str, int] = {} # kind -> alerts dropped by the fleet-wide limit since the last summary
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {"packets": 0, "raised": 0, "suppressed": 0, "resolved": 0, "flushes": 0, "last_batch_us": 0.0}
+        self.stats.update({f"raised_{kind}": 0 for kind in ALERT_LEVELS})
+
+    def load(self, last_seen: Dict[str, datetime.datetime]):
+        # Startup: arm a silence timer for every known node, so one that never reports again still alerts
+        with self._lock:
+            for node_id, seen in last_seen.items():
+                if node_id in self._nodes or seen is None:
+                    continue
+                node = self._nodes[node_id] = NodeStats((seen - _EPOCH).total_seconds())
+                self.wheel.schedule(node_id, node.last_seen + ANOMALY_SILENCE_MAX_S)
+
+    def observe_batch(self, records: List[dict]):
+        # Ingest thread, after the batch is written: one lock for the whole batch
+        started = time.perf_counter()
+        wall = time.time()
+        with self._lock:
+            for record in records:
+                received_at = record.get("received_at")
+                now = (received_at - _EPOCH).total_seconds() if received_at else wall # utcnow() -> epoch seconds
+                self._observe(record["node_uuid"], record["data"], now)
+            self.stats["packets"] += len(records)
+            self.stats["last_batch_us"] = round((time.perf_counter() - started) * 1e6, 1)
+
+    def _observe(self, node_id: str, data: dict, now: float):
+        node = self._nodes.get(node_id)
+        if node is None:
+            node = self._nodes[node_id] = NodeStats(now)
+        elif node.packets: # Loaded at startup and not heard since: no interval yet
+            interval = max(now - node.last_seen, 0.0)
+            node.interval_fast = _ewma(node.interval_fast, interval, FAST_ALPHA)
+            if TRAFFIC not in node.active:
+                node.interval_slow = _ewma(node.interval_slow, interval, SLOW_ALPHA)
+        node.packets += 1
+        node.last_seen = max(node.last_seen, now)
+        snr, rssi = data.get("snr"), data.get("rssi")
+        if snr is not None:
+            node.snr_fast = _ewma(node.snr_fast, snr, FAST_ALPHA)
+        if rssi is not None:
+            node.rssi_fast = _ewma(node.rssi_fast, rssi, FAST_ALPHA)
+        if LINK_DEGRADED not in node.active:
+            if snr is not None:
+                node.snr_slow = _ewma(node.snr_slow, snr, SLOW_ALPHA)
+            if rssi is not None:
+                node.rssi_slow = _ewma(node.rssi_slow, rssi, SLOW_ALPHA)
+
+        if SILENCE in node.active:
+            self._clear(node, SILENCE)
+        usual = node.interval_slow if node.packets > ANOMALY_WARMUP_PACKETS else None
+        timeout = min(max(ANOMALY_SILENCE_FACTOR * usual, ANOMALY_SILENCE_MIN_S), ANOMALY_SILENCE_MAX_S) if usual else ANOMALY_SILENCE_MAX_S
+        self.wheel.schedule(node_id, node.last_seen + timeout)
+        if node.packets <= ANOMALY_WARMUP_PACKETS:
+            return
+
+        snr_drop = node.snr_slow - node.snr_fast if node.snr_fast is not None else 0.0
+        rssi_drop = node.rssi_slow - node.rssi_fast if node.rssi_fast is not None else 0.0
+        if snr_drop > ANOMALY_SNR_DROP_DB or rssi_drop > ANOMALY_RSSI_DROP_DB:
+            metrics = [f"{name} {fast:.1f} (baseline {slow:.1f})" for name, fast, slow in
+                       (("SNR", node.snr_fast, node.snr_slow), ("RSSI", node.rssi_fast, node.rssi_slow)) if fast is not None]
+            self._raise(node_id, node, LINK_DEGRADED, f"Link degraded: {', '.join(metrics)}")
+        elif snr_drop < ANOMALY_SNR_DROP_DB / 2 and rssi_drop < ANOMALY_RSSI_DROP_DB / 2: # Hysteresis
+            self._clear(node, LINK_DEGRADED)
+
+        if node.interval_fast * ANOMALY_TRAFFIC_FACTOR < node.interval_slow:
+            self._raise(node_id, node, TRAFFIC,
+                        f"Abnormal traffic: a packet every {node.interval_fast:.1f}s (usually every {node.interval_slow:.1f}s)")
+        elif node.interval_fast * ANOMALY_TRAFFIC_FACTOR / 2 >= node.interval_slow:
+            self._clear(node, TRAFFIC)
+
+    def _take_token(self, node: NodeStats, now: float) -> bool:
+        node.tokens = min(ANOMALY_ALERT_BURST, node.tokens + (now - node.tokens_at) / ANOMALY_ALERT_REFILL_S)
+        node.tokens_at = now
+        self._global_tokens = min(ANOMALY_ALERTS_PER_MIN, self._global_tokens + (now - self._global_at) * ANOMALY_ALERTS_PER_MIN / 60)
+        self._global_at = now
+        if node.tokens < 1 or self._global_tokens < 1:
+            return False
+        node.tokens -= 1
+        self._global_tokens -= 1
+        return True
+
+    def _raise(self, node_id: str, node: NodeStats, kind: str, message: str):
+        if kind in node.active:
+            return # Already raised and not cleared since
+        if not self._take_token(node, time.monotonic()): # Rate limits run on real time, not packet timestamps
+            node.active[kind] = ActiveAlert(suppressed=True)
+            self._suppressed[kind] = self._suppressed.get(kind, 0) + 1
+            self.stats["suppressed"] += 1
+            return
+        alert = node.active[kind] = ActiveAlert()
+        self._pending.append((node_id, kind, alert, {"node_id": node_id, "level": ALERT_LEVELS[kind], "message": message}))
+        self.stats["raised"] += 1
+        self.stats[f"raised_{kind}"] += 1
+
+    def _clear(self, node: NodeStats, kind: str):
+        alert = node.active.pop(kind, None)
+        if alert is None or alert.suppressed:
+            return
+        alert.resolved = True
+        if alert.id is not None:
+            self._resolve.append(alert.id)
+        # Otherwise still pending: _on_created resolves it once it has an id
+
+    def check_silence(self, now: float = None) -> int:
+        now = now or time.time()
+        with self._lock:
+            expired = self.wheel.advance(now)
+            for node_id, deadline in expired:
+                node = self._nodes[node_id]
+                self._raise(node_id, node, SILENCE,
+                            f"Node silent for {now - node.last_seen:.0f}s"
+                            + (f" (usually every {node.interval_slow:.0f}s)" if node.interval_slow and node.packets > ANOMALY_WARMUP_PACKETS else ""))
+            return len(expired)
+
+    def forget(self, node_id: str):
+        # Deleted node: drop its timer and baselines, and resolve whatever it still has open
+        with self._lock:
+            self.wheel.cancel(node_id)
+            node = self._nodes.pop(node_id, None)
+            if node is not None:
+                for kind in list(node.active):
+                    self._clear(node, kind)
+
+    def _on_created(self, alerts: List[ActiveAlert], future):
+        try:
+            ids = future.result()
+        except Exception as e:
+            print(f"Error writing {len(alerts)} alerts: {e}")
+            return
+        with self._lock:
+            for alert, alert_id in zip(alerts, ids):
+                alert.id = alert_id
+                if alert.resolved:
+                    self._resolve.append(alert_id)
+
+    def flush(self) -> int:
+        from .db import crud # crud imports this module to forget deleted nodes
+        now = time.monotonic()
+        with self._lock:
+            pending, self._pending = self._pending, []
+            resolve, self._resolve = self._resolve, []
+            if self._suppressed and self._global_tokens + (now - self._global_at) * ANOMALY_ALERTS_PER_MIN / 60 >= 1:
+                # One line for everything the fleet-wide limit held back, once it allows a row again
+                counts = ", ".join(f"{count} {kind.replace('_', ' ')}" for kind, count in sorted(self._suppressed.items()))
+                pending.append((None, None, ActiveAlert(), {"node_id": None, "level": "warning",
+                                                            "message": f"Alert rate limit reached; suppressed {counts} alerts"}))
+                self._suppressed = {}
+                self._global_tokens -= 1
+            self.stats["flushes"] += 1
+        try:
+            if pending:
+                future = db_writer.submit(crud.create_alerts, [row for _, _, _, row in pending])
+                future.add_done_callback(lambda f, alerts=[alert for _, _, alert, _ in pending]: self._on_created(alerts, f))
+            if resolve:
+                db_writer.submit(crud.resolve_alerts, resolve)
+                with self._lock:
+                    self.stats["resolved"] += len(resolve)
+        except Exception as e:
+            print(f"Error queueing {len(pending)} alerts: {e}")
+        return len(pending)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="anomaly-detector", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.tick):
+            try:
+                self.check_silence()
+                self.flush()
+            except Exception as e:
+                print(f"Anomaly detector tick failed: {e}")
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["nodes"] = len(self._nodes)
+            stats["timers"] = len(self.wheel)
+            active = {}
+            for node in self._nodes.values():
+                for kind, alert in node.active.items():
+                    active[kind] = active.get(kind, 0) + 1
+            stats["active"] = active
+            stats["pending"] = len(self._pending)
+        return stats
+
+anomaly_detector = AnomalyDetector()
+
+def run_benchmark(nodes: int = 2000, packets: int = 200_000, batch: int = 500):
+    import random
+    detector = AnomalyDetector()
+    detector.flush = lambda: 0 # Measure detection only
+    rng = random.Random(5)
+    period = {f"node_{i}": rng.uniform(30, 300) for i in range(nodes)}
+    clock = {node_id: rng.uniform(0, p) for node_id, p in period.items()}
+    records = []
+    for _ in range(packets):
+        node_id = f"node_{rng.randrange(nodes)}"
+        clock[node_id] += period[node_id] * rng.uniform(0.8, 1.2)
+        records.append({"node_uuid": node_id, "data": {"snr": rng.gauss(5, 1.5), "rssi": rng.gauss(-95, 3)},
+                        "received_at": _EPOCH + datetime.timedelta(seconds=clock[node_id])})
+    records.sort(key=lambda record: record["received_at"])
+    started = time.perf_counter()
+    for i in range(0, len(records), batch):
+        detector.observe_batch(records[i:i + batch])
+    elapsed = time.perf_counter() - started
+    print(f"observe: {packets / elapsed:,.0f} packets/s over {nodes} nodes ({elapsed * 1e6 / packets:.2f} us/packet)")
+    end = max(clock.values())
+    started = time.perf_counter()
+    fired = detector.check_silence(end + ANOMALY_SILENCE_MAX_S + 1)
+    print(f"silence sweep: {fired} timers fired in {(time.perf_counter() - started) * 1000:.1f} ms")
+    print({key: value for key, value in detector.get_stats().items() if key != "last_batch_us"})
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,24 @@
+from fastapi import APIRouter, Depends, Query, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime
+
+from ..db import crud, schemas
+from .deps import get_async_db, get_current_user
+from ..utils.pagination import decode_cursor, set_next_cursor
+
+router = APIRouter()
+
+@router.get("/", response_model=list[schemas.AILog])
+async def read_ai_logs(
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: str | None = Query(None, description="Opaque cursor from the X-Next-Cursor header of the previous page"),
+    node_uuid: str | None = Query(None, description="Filter by node UUID"),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: schemas.User = Depends(get_current_user)
+):
+    seek = decode_cursor(cursor, datetime, int) if cursor else None
+    ai_logs = await crud.get_ai_logs_async(db, skip=skip, limit=limit, node_id=node_uuid, cursor=seek)
+    set_next_cursor(response, ai_logs, limit, key=lambda ai_log: (ai_log.timestamp, ai_log.id))
+    return ai_logs
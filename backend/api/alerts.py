@@ -0,0 +1,24 @@
+from fastapi import APIRouter, Depends, Query, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime
+
+from ..db import crud, schemas
+from .deps import get_async_db, get_current_user
+from ..utils.pagination import decode_cursor, set_next_cursor
+
+router = APIRouter()
+
+@router.get("/", response_model=list[schemas.Alert])
+async def read_alerts(
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: str | None = Query(None, description="Opaque cursor from the X-Next-Cursor header of the previous page"),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: schemas.User = Depends(get_current_user)
+):
+    seek = decode_cursor(cursor, datetime, int) if cursor else None
+    alerts = await crud.get_alerts_async(db, skip=skip, limit=limit, cursor=seek)
+    set_next_cursor(response, alerts, limit, key=lambda alert: (alert.timestamp, alert.id))
+    return alerts
+
@@ -1,31 +1,52 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+import math
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from ..db import crud, schemas
-from ..db.database import SessionLocal
-from ..utils.token import create_access_token, verify_password
-from ..main import get_current_user # Import get_current_user from main
+from ..db import crud, models, schemas
+from ..db.writer import db_writer
+from ..utils.hashing import PasswordHasherBusy, get_password_hash, verify_password_async
+from ..utils.login_throttle import login_throttle
+from ..utils.token import create_access_token
+from .deps import get_async_db, get_current_user, get_db
 
 router = APIRouter()
 
-# Dependency to get the DB session
-def get_db():
-    db = SessionLocal()
+async def authenticate_user(db: AsyncSession, username: str, password: str, client_ip: Optional[str] = None) -> models.User:
+    # Locked-out callers are turned away before any DB or bcrypt work
+    retry_after = login_throttle.check(username, client_ip)
+    if retry_after:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many failed login attempts",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+    user = await crud.get_user_by_username_async(db, username=username)
     try:
-        yield db
-    finally:
-        db.close()
-
-@router.post("/login", response_model=schemas.Token)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = crud.get_user_by_username(db, username=form_data.username)
-    if not user or not verify_password(form_data.password, user.hashed_password):
+        valid = user is not None and await verify_password_async(password, user.hashed_password)
+    except PasswordHasherBusy:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Login service busy, retry shortly",
+            headers={"Retry-After": "1"},
+        )
+    if not valid:
+        login_throttle.record_failure(username, client_ip)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    login_throttle.record_success(username, client_ip)
+    return user
+
+@router.post("/login", response_model=schemas.Token)
+async def login_for_access_token(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    client_ip = request.client.host if request.client else None
+    user = await authenticate_user(db, form_data.username, form_data.password, client_ip)
     access_token = create_access_token(data={"sub": user.username})
     return {"access_token": access_token, "token_type": "bearer"}
 
@@ -37,7 +58,8 @@ def register_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
     db_user = crud.get_user_by_email(db, email=user.email)
     if db_user:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Email already registered")
-    return crud.create_user(db=db, user=user)
+    hashed_password = get_password_hash(user.password) # On this request thread, not the DB writer
+    return db_writer.run(crud.create_user, user=user, hashed_password=hashed_password)
 
 @router.get("/me", response_model=schemas.User)
 async def read_users_me(current_user: schemas.User = Depends(get_current_user)):
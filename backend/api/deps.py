@@ -0,0 +1,56 @@
+from fastapi import Depends, HTTPException, status
+from fastapi.security import OAuth2PasswordBearer
+from jose import JWTError, jwt
+from sqlalchemy.orm import Session
+
+from ..auth_cache import auth_cache
+from ..db import crud, schemas
+from ..db.database import ReadSessionLocal
+from ..db.async_database import AsyncSessionLocal
+from ..utils.token import ALGORITHM, SECRET_KEY
+
+# Shared request dependencies. FastAPI caches a dependency per request, so every
+# router and get_current_user below end up sharing the one session from get_db.
+# These sessions are read-only; endpoints that write go through db_writer.
+
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
+
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+def get_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def get_async_db():
+    # For async endpoints: queries are awaited on the pooled async engine instead of blocking the loop
+    async with AsyncSessionLocal() as db:
+        yield db
+
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> schemas.User:
+    # Cached path: one hash and two dict lookups, no signature check and no SQL
+    key = auth_cache.token_key(token)
+    username = auth_cache.get_username(key)
+    if username is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except JWTError:
+            raise _credentials_exception()
+        username = payload.get("sub")
+        if username is None:
+            raise _credentials_exception()
+        auth_cache.put_token(key, username, payload.get("exp"))
+    user = auth_cache.get_user(username)
+    if user is None:
+        db_user = crud.get_user_by_username(db, username=username)
+        if db_user is None:
+            raise _credentials_exception()
+        user = auth_cache.put_user(db_user)
+    return user
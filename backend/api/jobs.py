@@ -1,29 +1,25 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from datetime import datetime
 
 from ..db import crud, schemas
-from ..db.database import SessionLocal
-from ..main import get_current_user
+from ..db.writer import db_writer
+from .deps import get_async_db, get_current_user, get_db
+from ..utils.pagination import decode_cursor, set_next_cursor
 
 router = APIRouter(prefix="/jobs")
 
-# Dependency
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 @router.get("/", response_model=list[schemas.Job])
-async def get_scheduled_jobs(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
+async def get_scheduled_jobs(response: Response, skip: int = 0, limit: int = 100, cursor: str | None = Query(None, description="Opaque cursor from the X-Next-Cursor header of the previous page"), db: AsyncSession = Depends(get_async_db), current_user: schemas.User = Depends(get_current_user)):
     # Anyone can view jobs for now, but could be restricted by role
-    jobs = crud.get_jobs(db, skip=skip, limit=limit)
+    seek = decode_cursor(cursor, datetime, int) if cursor else None
+    jobs = await crud.get_jobs_async(db, skip=skip, limit=limit, cursor=seek)
+    set_next_cursor(response, jobs, limit, key=lambda job: (job.schedule_time, job.id))
     return jobs
 
 @router.post("/create", response_model=schemas.Job)
-async def create_job(job_details: schemas.JobCreate, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
+def create_job(job_details: schemas.JobCreate, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
     if not current_user.role == "admin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to create jobs")
     
@@ -34,14 +30,14 @@ async def create_job(job_details: schemas.JobCreate, db: Session = Depends(get_d
         except ValueError:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid schedule_time format. Use ISO 8601.")
 
-    job = crud.create_job(db, job_details)
+    job = db_writer.run(crud.create_job, job_details)
     return job
 
 @router.delete("/{job_id}", response_model=dict)
-async def delete_job(job_id: int, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
+def delete_job(job_id: int, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
     if not current_user.role == "admin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to delete jobs")
-    success = crud.delete_job(db, job_id)
+    success = db_writer.run(crud.delete_job, job_id)
     if not success:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
     return {"message": f"Job {job_id} deleted successfully"}
\ No newline at end of file
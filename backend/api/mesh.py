@@ -1,46 +1,69 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+import asyncio
+from typing import Optional
 
-from ..db import crud, schemas
-from ..db.database import SessionLocal
-from ..main import get_current_user
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+
+from ..db import schemas
+from .deps import get_current_user
+from ..inference import InferenceQueueFull
+from ..mesh_logic.route_planner import route_planner
 from ..mesh_logic.routing_ai import optimize_route
+from ..mesh_logic.topology import mesh_topology
+from ..node_registry import node_registry
 
 router = APIRouter(prefix="/mesh")
 
-# Dependency
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 @router.get("/health", response_model=dict)
 async def get_mesh_health(current_user: schemas.User = Depends(get_current_user)):
-    # Simulate mesh health metrics
-    return {"status": "healthy", "latency_avg_ms": 120, "packet_loss_rate": 0.05, "active_routes": 5}
+    health = mesh_topology.health()
+    counts = node_registry.status_counts()
+    health["online_nodes"] = counts.get("online", 0)
+    health["offline_nodes"] = sum(counts.values()) - health["online_nodes"]
+    health["status"] = "healthy" if health["active_links"] else "no_links"
+    return health
 
 @router.get("/topology", response_model=dict)
-async def get_mesh_topology(current_user: schemas.User = Depends(get_current_user)):
-    # Simulate mesh topology data for D3.js visualization
-    return {
-        "nodes": [
-            {"id": "gateway", "group": 0, "x": 0, "y": 0},
-            {"id": "node_alpha", "group": 1, "x": 100, "y": 50},
-            {"id": "node_beta", "group": 1, "x": -50, "y": 120},
-            {"id": "node_gamma", "group": 1, "x": 150, "y": -80}
-        ],
-        "links": [
-            {"source": "gateway", "target": "node_alpha", "value": 1},
-            {"source": "gateway", "target": "node_beta", "value": 1},
-            {"source": "node_alpha", "target": "node_gamma", "value": 1}
-        ]
-    }
+async def get_mesh_topology(request: Request, response: Response, since: Optional[int] = None,
+                            current_user: schemas.User = Depends(get_current_user)):
+    # Weak ETag on the graph version; `since` returns only nodes/links changed after that version
+    mesh_topology.expire() # Stale links bump the version, so a quiet mesh does not keep answering 304
+    etag = f'W/"topology-{mesh_topology.version}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    snapshot = mesh_topology.snapshot(since)
+    response.headers["ETag"] = f'W/"topology-{snapshot["version"]}"'
+    return snapshot
 
 @router.post("/optimize-route/{node_uuid}", response_model=dict)
 async def optimize_node_route(node_uuid: str, current_route: list, current_user: schemas.User = Depends(get_current_user)):
     if not current_user.role == "admin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to optimize routes")
-    optimized_route = await optimize_route(node_uuid, current_route)
-    return {"node_uuid": node_uuid, "optimized_route": optimized_route}
\ No newline at end of file
+    try:
+        optimized_route = await optimize_route(node_uuid, current_route)
+    except InferenceQueueFull:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Route optimizer busy, retry shortly",
+                            headers={"Retry-After": "1"})
+    return {"node_uuid": node_uuid, "optimized_route": optimized_route}
+
+@router.get("/route-tables", response_model=dict)
+async def get_route_tables(current_user: schemas.User = Depends(get_current_user)):
+    # Every node's nearest gateway and next hop towards it, from the last bulk optimization
+    plan = route_planner.plan # One plan for the stats and the routes
+    return {**route_planner.get_stats(plan), "routes": route_planner.gateway_routes(plan)}
+
+@router.get("/route-tables/{node_uuid}", response_model=dict)
+async def get_node_route_table(node_uuid: str, destination: Optional[str] = None, current_user: schemas.User = Depends(get_current_user)):
+    plan = route_planner.plan
+    table = route_planner.table(node_uuid, plan)
+    if table is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Node not in the last route plan")
+    if destination is not None:
+        return {"node_uuid": node_uuid, "destination": destination, "path": route_planner.path(node_uuid, destination, plan)}
+    return {"node_uuid": node_uuid, "version": plan.version, "routes": table}
+
+@router.post("/route-tables/recompute", response_model=dict)
+async def recompute_route_tables(full: bool = False, current_user: schemas.User = Depends(get_current_user)):
+    if not current_user.role == "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to optimize routes")
+    # Incremental by default: only the shortest-path trees touched by links changed since the last plan
+    return await asyncio.to_thread(route_planner.recompute, full)
@@ -1,21 +1,15 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
 from sqlalchemy.orm import Session
 
 from ..db import crud, schemas
-from ..db.database import SessionLocal
-from ..main import get_current_user
+from ..db.writer import DatabaseWriterBusy, db_writer
+from .deps import get_current_user, get_db
 from ..mesh_logic.mode_switcher import switch_node_mode
+from ..node_registry import node_registry
+from ..utils.pagination import decode_cursor, set_next_cursor
 
 router = APIRouter(prefix="/nodes")
 
-# Dependency
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 @router.post("/", response_model=schemas.Node)
 def create_node(node: schemas.NodeCreate, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
     if not current_user.role == "admin": # Check for admin role
@@ -23,16 +17,19 @@ def create_node(node: schemas.NodeCreate, db: Session = Depends(get_db), current
     db_node = crud.get_node_by_uuid(db, uuid=node.uuid)
     if db_node:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Node already registered")
-    return crud.create_node(db=db, node=node)
+    return db_writer.run(crud.create_node, node=node)
 
 @router.get("/", response_model=list[schemas.Node])
-def read_nodes(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
-    nodes = crud.get_nodes(db, skip=skip, limit=limit)
+def read_nodes(response: Response, skip: int = 0, limit: int = 100, cursor: str | None = Query(None, description="Opaque cursor from the X-Next-Cursor header of the previous page"), db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
+    # Served from the in-memory node registry, ordered by id
+    after_id = decode_cursor(cursor, int)[0] if cursor else None
+    nodes = node_registry.list(db, skip=skip, limit=limit, after_id=after_id)
+    set_next_cursor(response, nodes, limit, key=lambda node: (node["id"],))
     return nodes
 
 @router.get("/{node_uuid}", response_model=schemas.Node)
 def read_node(node_uuid: str, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
-    db_node = crud.get_node_by_uuid(db, uuid=node_uuid)
+    db_node = node_registry.get(db, node_uuid)
     if db_node is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Node not found")
     return db_node
@@ -48,7 +45,7 @@ def send_node_command(node_uuid: str, command: dict, current_user: schemas.User
 def configure_node(node_uuid: str, config: dict, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
     if not current_user.role == "admin": # Check for admin role
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to configure nodes")
-    db_node = crud.update_node(db, node_uuid, {"configuration": config})
+    db_node = db_writer.run(crud.update_node, node_uuid, {"configuration": config})
     if db_node is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Node not found")
     print(f"Received configuration for node {node_uuid}: {config}")
@@ -56,10 +53,10 @@ def configure_node(node_uuid: str, config: dict, db: Session = Depends(get_db),
 
 @router.get("/{node_uuid}/configuration", response_model=dict)
 def get_node_configuration(node_uuid: str, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
-    db_node = crud.get_node_by_uuid(db, uuid=node_uuid)
-    if db_node is None:
+    node = node_registry.get(db, node_uuid)
+    if node is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Node not found")
-    return db_node.configuration or {}
+    return node["configuration"] or {}
 
 @router.post("/{node_uuid}/reboot")
 def reboot_node(node_uuid: str, current_user: schemas.User = Depends(get_current_user)):
@@ -82,7 +79,7 @@ def delete_node(node_uuid: str, db: Session = Depends(get_db), current_user: sch
     db_node = crud.get_node_by_uuid(db, uuid=node_uuid)
     if db_node is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Node not found")
-    crud.delete_node(db=db, uuid=node_uuid)
+    db_writer.run(crud.delete_node, uuid=node_uuid)
     return {"message": f"Node {node_uuid} deleted successfully"}
 
 @router.post("/{node_uuid}/mode")
@@ -93,5 +90,9 @@ async def set_node_mode(node_uuid: str, mode: dict, current_user: schemas.User =
     if not success:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to switch node mode")
     # Update node's mode in DB
-    crud.update_node(db, node_uuid, {"mode": mode.get("mode")})
+    try:
+        await db_writer.run_async(crud.update_node, node_uuid, {"mode": mode.get("mode")})
+    except DatabaseWriterBusy:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Database busy, retry shortly",
+                            headers={"Retry-After": "1"})
     return {"message": f"Node {node_uuid} mode switched to {mode.get("mode")} (simulated)"}
\ No newline at end of file
@@ -1,70 +1,99 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, status
+import os
+
+from fastapi import APIRouter, Depends, HTTPException, Request, UploadFile, File, status
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 from ..db import crud, schemas
-from ..db.database import SessionLocal
-from ..main import get_current_user
+from ..db.writer import DatabaseWriterBusy, db_writer
+from .deps import get_async_db, get_current_user, get_db
 from ..ota_manager import ota_manager
+from ..utils.file_response import RangedFileResponse
 
 router = APIRouter(prefix="/ota")
 
-# Dependency
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 @router.post("/upload", response_model=schemas.Firmware)
 async def upload_firmware(
     version: str,
     file: UploadFile = File(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: schemas.User = Depends(get_current_user)
 ):
     if not current_user.role == "admin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to upload firmware")
     
-    db_firmware = crud.get_firmware_by_version(db, version=version)
+    db_firmware = await crud.get_firmware_by_version_async(db, version=version)
     if db_firmware:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Firmware version already exists")
 
-    file_content = await file.read()
-    file_location = await ota_manager.upload_firmware(file.filename, file_content)
+    # The multipart parser has spooled the body to a temp file; copy it from there in chunks rather than reading it into memory
+    try:
+        stored = await ota_manager.upload_firmware(file.file)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
 
     firmware_create = schemas.FirmwareCreate(version=version, filename=file.filename)
-    return crud.create_firmware_version(db=db, firmware=firmware_create)
+    try:
+        return await db_writer.run_async(crud.create_firmware_version, firmware=firmware_create, file_path=stored.path, size=stored.size, sha256=stored.sha256)
+    except DatabaseWriterBusy:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Database busy, retry shortly",
+                            headers={"Retry-After": "1"})
+
+@router.api_route("/firmware/{version}", methods=["GET", "HEAD"])
+def download_firmware(version: str, request: Request, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
+    # Resumable download: Range requests and the image's SHA-256 as ETag
+    db_firmware = crud.get_firmware_by_version(db, version=version)
+    if db_firmware is None or not db_firmware.file_path or not os.path.exists(db_firmware.file_path):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Firmware not found")
+    return RangedFileResponse(db_firmware.file_path, request.headers, filename=db_firmware.filename, etag=db_firmware.sha256, method=request.method)
 
 @router.post("/deploy", response_model=dict)
 async def deploy_firmware(
     node_uuid: str,
     firmware_version: str,
-    db: Session = Depends(get_db),
     current_user: schemas.User = Depends(get_current_user)
 ):
     if not current_user.role == "admin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to deploy firmware")
     
-    # Create an OTA task in the database
-    ota_task_create = schemas.OTATaskCreate(
-        node_id=node_uuid,
-        firmware_version=firmware_version,
-        status="pending",
-        file_url=f"/ota/{firmware_version}" # Simulate URL to firmware
-    )
-    ota_task = crud.create_ota_task(db, ota_task_create)
+    # A one-node rollout: the transfer runs in the background and reports progress on the OTA task
+    try:
+        db_rollout, tasks = await ota_manager.create_rollout(firmware_version, [node_uuid])
+    except LookupError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    except DatabaseWriterBusy:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Database busy, retry shortly",
+                            headers={"Retry-After": "1"})
 
-    success = await ota_manager.deploy_firmware(node_uuid, firmware_version)
-    if not success:
-        # Update OTA task status to failed
-        crud.update_ota_task_progress(db, ota_task.id, 0.0, "failed")
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Firmware deployment failed")
-    
-    # Update OTA task status to in_progress (simulated)
-    crud.update_ota_task_progress(db, ota_task.id, 10.0, "in_progress")
+    return {"message": f"Firmware {firmware_version} deployment initiated for node {node_uuid}", "ota_task_id": tasks[0][0]}
+
+@router.post("/rollouts", response_model=schemas.OTARollout)
+async def create_rollout(
+    rollout: schemas.OTARolloutCreate,
+    current_user: schemas.User = Depends(get_current_user)
+):
+    if not current_user.role == "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to deploy firmware")
+    try:
+        db_rollout, _ = await ota_manager.create_rollout(rollout.firmware_version, rollout.node_ids)
+    except LookupError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    except DatabaseWriterBusy:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Database busy, retry shortly",
+                            headers={"Retry-After": "1"})
+    return db_rollout
+
+@router.get("/rollouts/{rollout_id}", response_model=schemas.OTARolloutStatus)
+def get_rollout(rollout_id: int, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
+    rollout_status = crud.get_ota_rollout_status(db, rollout_id)
+    if rollout_status is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Rollout not found")
+    return rollout_status
 
-    return {"message": f"Firmware {firmware_version} deployment initiated for node {node_uuid}", "ota_task_id": ota_task.id}
+@router.get("/stats", response_model=dict)
+def get_ota_stats(current_user: schemas.User = Depends(get_current_user)):
+    # Active transfers, chunk/ack counters and per-gateway slot usage
+    return ota_manager.get_stats()
 
 @router.get("/status/{node_uuid}", response_model=dict)
 async def get_ota_status(node_uuid: str, current_user: schemas.User = Depends(get_current_user)):
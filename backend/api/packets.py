@@ -1,37 +1,86 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from datetime import datetime
 
-from ..db import crud, schemas
-from ..db.database import SessionLocal
-from ..main import get_current_user
+from ..db import crud, models, schemas
+from ..db.writer import db_writer
+from ..db.database import ReadSessionLocal
+from .deps import get_async_db, get_current_user, get_db
+from ..utils.pagination import decode_cursor, set_next_cursor
+from ..utils import export
 
-router = APIRouter(prefix="/packets")
+EXPORT_BATCH_SIZE = 5000
 
-# Dependency
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+router = APIRouter(prefix="/packets")
 
 @router.post("/", response_model=schemas.Packet)
 def create_packet(packet: schemas.PacketCreate, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
     # Packets are typically created by the MQTT bridge, but an API endpoint can be useful for testing/manual injection
     if not current_user.role == "admin": # Only admins can manually create packets
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to create packets")
-    return crud.create_packet(db=db, packet=packet)
+    return db_writer.run(crud.create_packet, packet=packet)
 
 @router.get("/", response_model=list[schemas.Packet])
-def read_packets(
+async def read_packets(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
+    cursor: str | None = Query(None, description="Opaque cursor from the X-Next-Cursor header of the previous page"),
     node_uuid: str | None = Query(None, description="Filter by node UUID"),
     start_time: datetime | None = Query(None, description="Filter by start time (ISO 8601)"),
     end_time: datetime | None = Query(None, description="Filter by end time (ISO 8601)"),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: schemas.User = Depends(get_current_user)
 ):
     # Anyone can view packets for now, but could be restricted by role
-    return crud.get_packets(db, skip=skip, limit=limit, node_id=node_uuid, start_time=start_time, end_time=end_time)
+    seek = decode_cursor(cursor, datetime, int) if cursor else None
+    packets = await crud.get_packets_async(db, skip=skip, limit=limit, node_id=node_uuid, start_time=start_time, end_time=end_time, cursor=seek)
+    set_next_cursor(response, packets, limit, key=lambda packet: (packet.timestamp, packet.id))
+    return packets
+
+@router.get("/stats", response_model=dict)
+async def get_packet_stats(
+    node_uuid: str | None = Query(None, description="Node UUID; omit for fleet-wide stats"),
+    start_time: datetime | None = Query(None, description="Start time (ISO 8601), defaults to 24h before end_time"),
+    end_time: datetime | None = Query(None, description="End time (ISO 8601), defaults to now"),
+    interval_seconds: int | None = Query(None, description="Desired spacing between points"),
+    max_points: int = Query(300, ge=1, le=5000),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: schemas.User = Depends(get_current_user)
+):
+    # SNR/RSSI min/max/mean/count and quantiles served from the pre-aggregated rollups
+    return await crud.get_packet_stats_async(db, node_id=node_uuid, start_time=start_time, end_time=end_time,
+                                             interval_seconds=interval_seconds, max_points=max_points)
+
+@router.get("/export")
+def export_packets(
+    format: str = Query("ndjson", description="ndjson, csv, parquet or arrow"),
+    node_uuid: str | None = Query(None, description="Filter by node UUID"),
+    start_time: datetime | None = Query(None, description="Filter by start time (ISO 8601)"),
+    end_time: datetime | None = Query(None, description="Filter by end time (ISO 8601)"),
+    current_user: schemas.User = Depends(get_current_user)
+):
+    if format not in export.EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unsupported export format: {format}")
+    if format in export.COLUMNAR_FORMATS and not export.columnar_available():
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail="pyarrow is required for parquet/arrow exports")
+
+    def stream():
+        # The session lives as long as the response body, not the request handler
+        db = ReadSessionLocal()
+        try:
+            batches = crud.iter_packets(db, node_id=node_uuid, start_time=start_time, end_time=end_time, batch_size=EXPORT_BATCH_SIZE)
+            if format == "ndjson":
+                yield from export.encode_ndjson(batches)
+            elif format == "csv":
+                yield from export.encode_csv(batches, [column.name for column in models.Packet.__table__.columns])
+            else:
+                yield from export.encode_columnar(batches, export.packet_arrow_schema(), format)
+        finally:
+            db.close()
+
+    filename = f"packets.{format}"
+    return StreamingResponse(stream(), media_type=export.EXPORT_MEDIA_TYPES[format],
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
@@ -4,6 +4,7 @@ from sqlalchemy.orm import Session
 from ..db import crud, schemas
 from ..db.database import SessionLocal
 from ..main import get_current_user
+from ..utils.hashing import get_password_hash
 
 router = APIRouter()
 
@@ -23,7 +24,7 @@ def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
     db_user = crud.get_user_by_email(db, email=user.email)
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
-    return crud.create_user(db=db, user=user)
+    return crud.create_user(db=db, user=user, hashed_password=get_password_hash(user.password))
 
 @router.get("/users/", response_model=list[schemas.User])
 def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
@@ -61,7 +62,7 @@ def request_password_reset(request: schemas.PasswordResetRequest, db: Session =
 
 @router.post("/users/reset-password")
 def reset_password(reset: schemas.PasswordReset, db: Session = Depends(get_db)):
-    user = crud.reset_password_with_token(db, reset.token, reset.new_password)
+    user = crud.reset_password_with_token(db, reset.token, get_password_hash(reset.new_password))
     if not user:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid or expired token")
     return {"message": "Password reset successfully"}
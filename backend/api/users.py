@@ -2,19 +2,12 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 
 from ..db import crud, schemas
-from ..db.database import SessionLocal
-from ..main import get_current_user
+from ..db.writer import db_writer
+from ..utils.hashing import get_password_hash
+from .deps import get_current_user, get_db
 
 router = APIRouter(prefix="/users")
 
-# Dependency
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 @router.post("/", response_model=schemas.User)
 def create_user(user: schemas.UserCreate, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
     if not current_user.role == "admin":
@@ -25,7 +18,8 @@ def create_user(user: schemas.UserCreate, db: Session = Depends(get_db), current
     db_user = crud.get_user_by_email(db, email=user.email)
     if db_user:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Email already registered")
-    return crud.create_user(db=db, user=user)
+    hashed_password = get_password_hash(user.password) # On this request thread, not the DB writer
+    return db_writer.run(crud.create_user, user=user, hashed_password=hashed_password)
 
 @router.get("/", response_model=list[schemas.User])
 def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
@@ -47,14 +41,14 @@ def read_user(user_id: int, db: Session = Depends(get_db), current_user: schemas
 def update_user_role(user_id: int, role: str, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
     if not current_user.role == "admin":
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to change user roles")
-    db_user = crud.update_user_role(db, user_id, role)
+    db_user = db_writer.run(crud.update_user_role, user_id, role)
     if db_user is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
     return db_user
 
 @router.post("/request-password-reset")
 def request_password_reset(request: schemas.PasswordResetRequest, db: Session = Depends(get_db)):
-    token = crud.generate_password_reset_token(db, request.email)
+    token = db_writer.run(crud.generate_password_reset_token, request.email)
     if not token:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User with that email not found")
     print(f"Password reset token for {request.email}: {token}")
@@ -62,7 +56,7 @@ def request_password_reset(request: schemas.PasswordResetRequest, db: Session =
 
 @router.post("/reset-password")
 def reset_password(reset: schemas.PasswordReset, db: Session = Depends(get_db)):
-    user = crud.reset_password_with_token(db, reset.token, reset.new_password)
+    user = db_writer.run(crud.reset_password_with_token, reset.token, get_password_hash(reset.new_password))
     if not user:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid or expired token")
     return {"message": "Password reset successfully"}
\ No newline at end of file
@@ -0,0 +1,89 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from .db import schemas
+
+# Authentication cache settings
+AUTH_TOKEN_CACHE_TTL_S = float(os.environ.get("AUTH_TOKEN_CACHE_TTL_S", 60)) # Re-verify a token's signature at most this often
+AUTH_USER_CACHE_TTL_S = float(os.environ.get("AUTH_USER_CACHE_TTL_S", 300))
+AUTH_CACHE_MAX_ENTRIES = int(os.environ.get("AUTH_CACHE_MAX_ENTRIES", 10000))
+
+class AuthCache:
+    """Verified-token and user-principal caches for get_current_user.
+
+    Tokens are keyed by their SHA-256 so raw bearer tokens are never kept in
+    memory, and never outlive their own exp claim. Principals are immutable
+    schemas.User snapshots; crud drops them when a role or password changes.
+    """
+
+    def __init__(self, token_ttl: float = AUTH_TOKEN_CACHE_TTL_S, user_ttl: float = AUTH_USER_CACHE_TTL_S,
+                 max_entries: int = AUTH_CACHE_MAX_ENTRIES):
+        self.token_ttl = token_ttl
+        self.user_ttl = user_ttl
+        self.max_entries = max_entries
+        self._tokens: "OrderedDict[bytes, tuple]" = OrderedDict() # token hash -> (username, expires at)
+        self._users: "OrderedDict[str, tuple]" = OrderedDict() # username -> (schemas.User, expires at)
+        self._lock = threading.Lock()
+        self.stats = {"token_hits": 0, "token_misses": 0, "user_hits": 0, "user_misses": 0, "invalidations": 0}
+
+    @staticmethod
+    def token_key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def _put(self, cache: OrderedDict, key, value):
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > self.max_entries:
+            cache.popitem(last=False)
+
+    def get_username(self, key: bytes) -> Optional[str]:
+        with self._lock:
+            entry = self._tokens.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                self.stats["token_misses"] += 1
+                return None
+            self.stats["token_hits"] += 1
+            return entry[0]
+
+    def put_token(self, key: bytes, username: str, exp: float = None):
+        # exp is the token's own expiry (epoch seconds); the cache entry never outlives it
+        ttl = self.token_ttl if exp is None else min(self.token_ttl, exp - time.time())
+        if ttl > 0:
+            with self._lock:
+                self._put(self._tokens, key, (username, time.monotonic() + ttl))
+
+    def get_user(self, username: str) -> Optional[schemas.User]:
+        with self._lock:
+            entry = self._users.get(username)
+            if entry is None or entry[1] <= time.monotonic():
+                self.stats["user_misses"] += 1
+                return None
+            self.stats["user_hits"] += 1
+            return entry[0]
+
+    def put_user(self, db_user) -> schemas.User:
+        user = schemas.User.from_orm(db_user)
+        with self._lock:
+            self._put(self._users, user.username, (user, time.monotonic() + self.user_ttl))
+        return user
+
+    def invalidate_user(self, username: str):
+        # Role change or password reset: drop the principal and every token verified for it
+        with self._lock:
+            self._users.pop(username, None)
+            for key in [key for key, (owner, _) in self._tokens.items() if owner == username]:
+                del self._tokens[key]
+            self.stats["invalidations"] += 1
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["tokens"] = len(self._tokens)
+            stats["users"] = len(self._users)
+        return stats
+
+auth_cache = AuthCache()
@@ -0,0 +1,32 @@
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from .database import (DB_MAX_OVERFLOW, DB_POOL_RECYCLE_S, DB_POOL_SIZE, DB_POOL_TIMEOUT_S, SQLALCHEMY_DATABASE_URL,
+                       install_sqlite_profile)
+
+# Same database as the sync engine, through an asyncio driver
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+def async_url(url: str) -> str:
+    scheme, rest = url.split("://", 1)
+    dialect = scheme.split("+", 1)[0]
+    if dialect not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for {dialect} databases")
+    return f"{ASYNC_DRIVERS[dialect]}://{rest}"
+
+ASYNC_DATABASE_URL = async_url(SQLALCHEMY_DATABASE_URL)
+
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT_S,
+    pool_recycle=DB_POOL_RECYCLE_S,
+    pool_pre_ping=not ASYNC_DATABASE_URL.startswith("sqlite"),
+)
+# Async sessions only serve reads; writes go through the DB writer thread
+install_sqlite_profile(async_engine.sync_engine, read_only=True)
+# expire_on_commit=False: ORM rows stay readable after commit without an implicit (blocking) refresh
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
@@ -1,20 +1,22 @@
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from . import models, schemas
 import datetime
-from passlib.context import CryptContext
 import secrets # For generating secure tokens
-
-# Import broadcast_update from websocket_handler
-from ..websocket_handler import broadcast_update
-import asyncio
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-def get_password_hash(password):
-    return pwd_context.hash(password)
-
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+from typing import List, Optional
+
+# Import publish_update from websocket_handler (thread-safe, no event loop needed)
+from ..websocket_handler import publish_update
+from ..node_registry import node_registry
+from ..liveness import liveness_tracker
+from ..anomaly_detector import anomaly_detector
+from .partitions import packet_partitioner
+from ..utils.pagination import seek_after
+from ..rollups import link_rollups
+from ..mesh_logic.topology import mesh_topology
+from ..auth_cache import auth_cache
+from ..job_scheduler import job_scheduler
 
 # Node CRUD
 def get_node(db: Session, node_id: int):
@@ -43,7 +45,7 @@ def create_node(db: Session, node: schemas.NodeCreate):
     db.add(db_node)
     db.commit()
     db.refresh(db_node)
-    asyncio.run(broadcast_update("new_node", schemas.Node.from_orm(db_node).dict()))
+    publish_update("new_node", node_registry.put(db_node))
     return db_node
 
 def update_node(db: Session, node_uuid: str, node_update: dict):
@@ -53,7 +55,8 @@ def update_node(db: Session, node_uuid: str, node_update: dict):
             setattr(db_node, key, value)
         db.commit()
         db.refresh(db_node)
-        asyncio.run(broadcast_update("node_update", schemas.Node.from_orm(db_node).dict()))
+        # Replace the cached entry with the committed row
+        publish_update("node_update", node_registry.put(db_node))
         return db_node
     return None
 
@@ -62,37 +65,138 @@ def delete_node(db: Session, uuid: str):
     if db_node:
         db.delete(db_node)
         db.commit()
-        asyncio.run(broadcast_update("node_deleted", {"uuid": uuid}))
+        node_registry.remove(uuid)
+        liveness_tracker.forget(uuid)
+        anomaly_detector.forget(uuid)
+        publish_update("node_deleted", {"uuid": uuid})
         return True
     return False
 
 # Packet CRUD
-def get_packets(db: Session, skip: int = 0, limit: int = 100, node_id: str = None, start_time: datetime.datetime = None, end_time: datetime.datetime = None):
-    query = db.query(models.Packet)
-    if node_id:
-        query = query.filter(models.Packet.node_id == node_id)
-    if start_time:
-        query = query.filter(models.Packet.timestamp >= start_time)
-    if end_time:
-        query = query.filter(models.Packet.timestamp <= end_time)
-    return query.offset(skip).limit(limit).all()
+def get_packets(db: Session, skip: int = 0, limit: int = 100, node_id: str = None, start_time: datetime.datetime = None, end_time: datetime.datetime = None, cursor: tuple = None):
+    # Newest first by (timestamp, id), only touching the partitions that overlap [start_time, end_time].
+    # cursor is the (timestamp, id) of the last packet already returned; skip is ignored when it is set.
+    return packet_partitioner.query(db, skip=skip, limit=limit, node_id=node_id, start_time=start_time, end_time=end_time, cursor=cursor)
+
+async def get_packets_async(db: AsyncSession, skip: int = 0, limit: int = 100, node_id: str = None, start_time: datetime.datetime = None, end_time: datetime.datetime = None, cursor: tuple = None):
+    # The partition walk is sync code; run_sync drives it over the async connection without blocking the loop
+    return await db.run_sync(packet_partitioner.query, skip=skip, limit=limit, node_id=node_id, start_time=start_time, end_time=end_time, cursor=cursor)
+
+async def get_packet_stats_async(db: AsyncSession, node_id: str = None, start_time: datetime.datetime = None, end_time: datetime.datetime = None, interval_seconds: float = None, max_points: int = 300):
+    return await db.run_sync(link_rollups.query, node_id=node_id, start_time=start_time, end_time=end_time, interval_seconds=interval_seconds, max_points=max_points)
+
+def iter_packets(db: Session, node_id: str = None, start_time: datetime.datetime = None, end_time: datetime.datetime = None, batch_size: int = 1000):
+    # Yields lists of row mappings, oldest first, without materializing the result set
+    return packet_partitioner.iter_rows(db, node_id=node_id, start_time=start_time, end_time=end_time, batch_size=batch_size)
 
 def create_packet(db: Session, packet: schemas.PacketCreate):
-    db_packet = models.Packet(**packet.dict())
-    db.add(db_packet)
+    row = packet.dict()
+    row["timestamp"] = datetime.datetime.utcnow()
+    packet_partitioner.insert(db, [row])
     db.commit()
-    db.refresh(db_packet)
-    # Update the associated node's last_seen and status
-    db_node = get_node_by_uuid(db, packet.node_id) # Assuming node_id in packet is actually uuid
-    if db_node:
-        db_node.last_seen = datetime.datetime.utcnow()
-        db_node.status = "online"
-        db.commit()
-        db.refresh(db_node)
-        asyncio.run(broadcast_update("node_update", schemas.Node.from_orm(db_node).dict()))
-    asyncio.run(broadcast_update("new_packet", schemas.Packet.from_orm(db_packet).dict()))
+    link_rollups.add(db, [row])
+    db_packet = models.Packet(**row)
+    # last_seen is written back by the node registry; status only changes on liveness transitions
+    if not node_registry.contains(packet.node_id): # Assuming node_id in packet is actually uuid
+        node_registry.get(db, packet.node_id)
+    if node_registry.touch(packet.node_id, db_packet.timestamp):
+        liveness_tracker.heard_batch({packet.node_id: db_packet.timestamp})
+    anomaly_detector.observe_batch([{"node_uuid": packet.node_id, "data": row, "received_at": row["timestamp"]}])
+    publish_update("new_packet", row)
     return db_packet
 
+# Node fields a packet may carry that overwrite the stored node state
+NODE_DYNAMIC_FIELDS = ("name", "lat", "lng", "mode", "tx_power", "freq", "bandwidth", "ai_model", "firmware", "configuration")
+
+def ingest_packet_batch(db: Session, records: list):
+    # Persist a batch of ingested packets in a single transaction.
+    # Each record is {"node_uuid": str, "data": dict, "received_at": datetime} as queued by the MQTT bridge.
+    # Known nodes are resolved from the node registry; only never-seen uuids hit the DB.
+    unknown = {record["node_uuid"] for record in records if not node_registry.contains(record["node_uuid"])}
+    new_nodes = {}
+    if unknown:
+        for db_node in db.query(models.Node).filter(models.Node.uuid.in_(unknown)).all():
+            node_registry.put(db_node)
+            unknown.discard(db_node.uuid)
+        for node_uuid in unknown:
+            new_nodes[node_uuid] = models.Node(uuid=node_uuid, name=f"Node {node_uuid}", configuration={})
+            db.add(new_nodes[node_uuid])
+
+    field_updates = {} # uuid -> changed node fields for existing nodes
+    last_seen = {}
+    packets = []
+    ai_logs = []
+    for record in records:
+        node_uuid = record["node_uuid"]
+        data = record["data"]
+        received_at = record["received_at"]
+        last_seen[node_uuid] = max(received_at, last_seen.get(node_uuid, received_at))
+        new_node = new_nodes.get(node_uuid)
+        if new_node is not None:
+            for field in NODE_DYNAMIC_FIELDS:
+                if field in data:
+                    setattr(new_node, field, data[field])
+            new_node.last_seen = received_at
+            new_node.status = "online"
+        else:
+            cached = node_registry.peek(node_uuid)
+            pending = field_updates.get(node_uuid, {})
+            for field in NODE_DYNAMIC_FIELDS:
+                if field in data and data[field] != pending.get(field, cached.get(field)):
+                    field_updates.setdefault(node_uuid, {})[field] = data[field]
+        packets.append({
+            "node_id": node_uuid, # Use uuid here as node_id in Packet model
+            "timestamp": received_at,
+            "payload": data.get("payload", ""),
+            "snr": data.get("snr", 0.0),
+            "rssi": data.get("rssi", 0.0),
+            "source_addr": data.get("source_addr") or node_uuid,
+            "packet_id": data.get("packet_id"),
+            "gateways": record.get("gateways") or None,
+        })
+        if "ai_prediction" in data:
+            ai_logs.append(models.AILog(
+                node_id=node_uuid,
+                model_name=data.get("ai_model_name", "unknown"),
+                prediction=data["ai_prediction"],
+                accuracy=data.get("ai_accuracy"),
+                timestamp=received_at
+            ))
+    if field_updates:
+        db.bulk_update_mappings(models.Node, [
+            {"id": node_registry.peek(node_uuid)["id"], **fields} for node_uuid, fields in field_updates.items()
+        ])
+    packet_partitioner.insert(db, packets)
+    db.add_all(ai_logs)
+    # Flush (multi-row INSERTs) and serialize before commit so nothing is reloaded afterwards
+    db.flush()
+    messages = [("new_packet", packet) for packet in packets]
+    messages += [("new_ai_log", schemas.AILog.from_orm(ai_log).dict()) for ai_log in ai_logs]
+    db.commit()
+    # Fold the durable batch into the SNR/RSSI rollups (flushed by the ingest writer) and the live topology
+    link_rollups.add(db, packets)
+    mesh_topology.observe_batch(records)
+
+    # Only mirror into the registry once the batch is durable
+    updates = [("new_node", node_registry.put(db_node)) for db_node in new_nodes.values()]
+    for node_uuid, seen in last_seen.items():
+        node_registry.touch(node_uuid, seen)
+    for node_uuid, fields in field_updates.items():
+        node_registry.update_fields(node_uuid, fields)
+        updates.append(("node_update", dict(node_registry.peek(node_uuid))))
+    # Online/offline and last_seen reach clients as one node_status message per liveness tick
+    liveness_tracker.heard_batch(last_seen)
+    for message_type, data in updates + messages:
+        publish_update(message_type, data)
+    return packets
+
+def merge_duplicate_packets(db: Session, updates: list):
+    # Late copies of already stored packets: rewrite the merged SNR/RSSI and gateway list in place
+    packet_partitioner.update(db, updates)
+    db.commit()
+    for update in updates:
+        publish_update("packet_update", update)
+
 # User CRUD
 def get_user(db: Session, user_id: int):
     return db.query(models.User).filter(models.User.id == user_id).first()
@@ -100,14 +204,17 @@ def get_user(db: Session, user_id: int):
 def get_user_by_username(db: Session, username: str):
     return db.query(models.User).filter(models.User.username == username).first()
 
+async def get_user_by_username_async(db: AsyncSession, username: str):
+    return (await db.execute(select(models.User).where(models.User.username == username))).scalars().first()
+
 def get_user_by_email(db: Session, email: str):
     return db.query(models.User).filter(models.User.email == email).first()
 
 def get_users(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.User).offset(skip).limit(limit).all()
 
-def create_user(db: Session, user: schemas.UserCreate):
-    hashed_password = get_password_hash(user.password)
+def create_user(db: Session, user: schemas.UserCreate, hashed_password: str):
+    # Hash in the caller: bcrypt on the DB writer thread would stall every other write
     db_user = models.User(username=user.username, email=user.email, hashed_password=hashed_password, role="viewer") # Default role
     db.add(db_user)
     db.commit()
@@ -120,6 +227,7 @@ def update_user_role(db: Session, user_id: int, role: str):
         db_user.role = role
         db.commit()
         db.refresh(db_user)
+        auth_cache.invalidate_user(db_user.username)
         return db_user
     return None
 
@@ -135,66 +243,138 @@ def generate_password_reset_token(db: Session, email: str):
     db.refresh(user)
     return token
 
-def reset_password_with_token(db: Session, token: str, new_password: str):
+def reset_password_with_token(db: Session, token: str, hashed_password: str):
     user = db.query(models.User).filter(models.User.password_reset_token == token).first()
     if not user or user.password_reset_expires < datetime.datetime.utcnow():
         return None # Invalid or expired token
     
-    user.hashed_password = get_password_hash(new_password)
+    user.hashed_password = hashed_password
     user.password_reset_token = None
     user.password_reset_expires = None
     db.commit()
     db.refresh(user)
+    auth_cache.invalidate_user(user.username)
     return user
 
-# Firmware CRUD (renamed to OTATask for consistency with blueprint)
+# Firmware CRUD
 def get_firmware_versions(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.OTATask).offset(skip).limit(limit).all()
+    return db.query(models.Firmware).order_by(models.Firmware.id).offset(skip).limit(limit).all()
 
-def create_firmware_version(db: Session, firmware: schemas.FirmwareCreate):
-    db_firmware = models.OTATask(version=firmware.version, filename=firmware.filename) # This needs adjustment
+def create_firmware_version(db: Session, firmware: schemas.FirmwareCreate, file_path: str = None, size: int = None, sha256: str = None):
+    db_firmware = models.Firmware(version=firmware.version, filename=firmware.filename, file_path=file_path, size=size, sha256=sha256)
     db.add(db_firmware)
     db.commit()
     db.refresh(db_firmware)
     return db_firmware
 
 def get_firmware_by_version(db: Session, version: str):
-    return db.query(models.OTATask).filter(models.OTATask.version == version).first()
+    return db.query(models.Firmware).filter(models.Firmware.version == version).first()
+
+async def get_firmware_by_version_async(db: AsyncSession, version: str):
+    return (await db.execute(select(models.Firmware).where(models.Firmware.version == version))).scalars().first()
 
 # OTA Task CRUD
 def get_ota_tasks(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.OTATask).offset(skip).limit(limit).all()
 
+def get_latest_ota_task(db: Session, node_id: str):
+    return db.query(models.OTATask).filter(models.OTATask.node_id == node_id).order_by(models.OTATask.id.desc()).first()
+
+def get_unfinished_ota_tasks(db: Session):
+    return db.query(models.OTATask).filter(models.OTATask.status.in_(("pending", "in_progress"))).all()
+
 def create_ota_task(db: Session, ota_task: schemas.OTATaskCreate):
     db_ota_task = models.OTATask(**ota_task.dict())
     db.add(db_ota_task)
     db.commit()
     db.refresh(db_ota_task)
-    asyncio.run(broadcast_update("new_ota_task", schemas.OTATask.from_orm(db_ota_task).dict()))
+    publish_update("new_ota_task", schemas.OTATask.from_orm(db_ota_task).dict())
     return db_ota_task
 
 def update_ota_task_progress(db: Session, task_id: int, progress: float, status: str = None):
-    db_task = db.query(models.OTATask).filter(models.OTATask.id == task_id).first()
-    if db_task:
-        db_task.progress = progress
+    updated = update_ota_tasks_progress(db, [{"id": task_id, "progress": progress, "status": status}])
+    if not updated:
+        return None
+    db.refresh(updated[0])
+    return updated[0]
+
+def update_ota_tasks_progress(db: Session, updates: List[dict]):
+    # One transaction for a batch of transfer progress: [{"id", "progress", "status"?, "chunks_acked"?, "chunks_total"?}, ...]
+    db_tasks = {task.id: task for task in db.query(models.OTATask).filter(models.OTATask.id.in_([update["id"] for update in updates]))}
+    updated = []
+    for update in updates:
+        db_task = db_tasks.get(update["id"])
+        if db_task is None:
+            continue
+        status = update.get("status")
+        db_task.progress = update["progress"]
         if status: db_task.status = status
-        if progress >= 100.0 and status != "failed": db_task.status = "completed"; db_task.end_time = datetime.datetime.utcnow()
-        db.commit()
-        db.refresh(db_task)
-        asyncio.run(broadcast_update("ota_task_update", schemas.OTATask.from_orm(db_task).dict()))
-        return db_task
-    return None
+        for field in ("chunks_acked", "chunks_total"):
+            if field in update: setattr(db_task, field, update[field])
+        if db_task.progress >= 100.0 and status != "failed": db_task.status = "completed"
+        if db_task.status in ("completed", "failed") and db_task.end_time is None: db_task.end_time = datetime.datetime.utcnow()
+        updated.append(db_task)
+    completed = {db_task.node_id: db_task.firmware_version for db_task in updated if db_task.status == "completed"}
+    for node_uuid, version in completed.items():
+        db.query(models.Node).filter(models.Node.uuid == node_uuid).update({"firmware": version}, synchronize_session=False)
+    messages = [schemas.OTATask.from_orm(db_task).dict() for db_task in updated] # Before commit expires the rows
+    db.commit()
+    for node_uuid, version in completed.items():
+        node_registry.update_fields(node_uuid, {"firmware": version})
+    for message in messages:
+        publish_update("ota_task_update", message)
+    return updated
+
+# OTA rollout CRUD
+def create_ota_rollout(db: Session, firmware_version: str, node_ids: Optional[List[str]] = None, file_url: str = None):
+    if node_ids is None:
+        node_ids = [uuid for (uuid,) in db.query(models.Node.uuid).order_by(models.Node.id)]
+    node_ids = list(dict.fromkeys(node_ids)) # One transfer per node
+    db_rollout = models.OTARollout(firmware_version=firmware_version, node_count=len(node_ids))
+    db.add(db_rollout)
+    db.flush()
+    db_tasks = [models.OTATask(node_id=node_id, firmware_version=firmware_version, status="pending", progress=0.0,
+                               file_url=file_url, rollout_id=db_rollout.id, chunks_acked=0) for node_id in node_ids]
+    db.add_all(db_tasks)
+    db.flush()
+    tasks = [(db_task.id, db_task.node_id) for db_task in db_tasks] # Ids without refreshing every row after commit
+    db.commit()
+    db.refresh(db_rollout)
+    publish_update("new_ota_rollout", schemas.OTARollout.from_orm(db_rollout).dict())
+    return db_rollout, tasks
+
+def get_ota_rollout_status(db: Session, rollout_id: int):
+    db_rollout = db.query(models.OTARollout).filter(models.OTARollout.id == rollout_id).first()
+    if db_rollout is None:
+        return None
+    rows = (db.query(models.OTATask.status, func.count(models.OTATask.id), func.avg(models.OTATask.progress))
+            .filter(models.OTATask.rollout_id == rollout_id).group_by(models.OTATask.status).all())
+    total = sum(count for _, count, _ in rows)
+    progress = sum((avg or 0.0) * count for _, count, avg in rows) / total if total else 0.0
+    return schemas.OTARolloutStatus(**schemas.OTARollout.from_orm(db_rollout).dict(),
+                                    status_counts={status: count for status, count, _ in rows}, progress=round(progress, 1))
 
 # Job CRUD
-def get_jobs(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Job).offset(skip).limit(limit).all()
+def _jobs_query(skip: int, limit: int, cursor: tuple):
+    # Ordered by (schedule_time, id); cursor is the key of the last job already returned
+    stmt = select(models.Job)
+    if cursor:
+        stmt = stmt.where(seek_after([models.Job.schedule_time, models.Job.id], cursor))
+    return stmt.order_by(models.Job.schedule_time, models.Job.id).offset(0 if cursor else skip).limit(limit)
+
+def get_jobs(db: Session, skip: int = 0, limit: int = 100, cursor: tuple = None):
+    return db.execute(_jobs_query(skip, limit, cursor)).scalars().all()
+
+async def get_jobs_async(db: AsyncSession, skip: int = 0, limit: int = 100, cursor: tuple = None):
+    return (await db.execute(_jobs_query(skip, limit, cursor))).scalars().all()
 
 def create_job(db: Session, job: schemas.JobCreate):
     db_job = models.Job(**job.dict())
     db.add(db_job)
     db.commit()
     db.refresh(db_job)
-    asyncio.run(broadcast_update("new_job", schemas.Job.from_orm(db_job).dict()))
+    job_scheduler.add(db_job)
+    publish_update("new_job", schemas.Job.from_orm(db_job).dict())
     return db_job
 
 def delete_job(db: Session, job_id: int):
@@ -202,20 +382,31 @@ def delete_job(db: Session, job_id: int):
     if db_job:
         db.delete(db_job)
         db.commit()
-        asyncio.run(broadcast_update("job_deleted", {"id": job_id}))
+        job_scheduler.cancel(job_id)
+        publish_update("job_deleted", {"id": job_id})
         return True
     return False
 
 # Alert CRUD
-def get_alerts(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Alert).offset(skip).limit(limit).all()
+def _alerts_query(skip: int, limit: int, cursor: tuple):
+    # Newest first by (timestamp, id); cursor is the key of the last alert already returned
+    stmt = select(models.Alert)
+    if cursor:
+        stmt = stmt.where(seek_after([models.Alert.timestamp, models.Alert.id], cursor, descending=True))
+    return stmt.order_by(models.Alert.timestamp.desc(), models.Alert.id.desc()).offset(0 if cursor else skip).limit(limit)
+
+def get_alerts(db: Session, skip: int = 0, limit: int = 100, cursor: tuple = None):
+    return db.execute(_alerts_query(skip, limit, cursor)).scalars().all()
+
+async def get_alerts_async(db: AsyncSession, skip: int = 0, limit: int = 100, cursor: tuple = None):
+    return (await db.execute(_alerts_query(skip, limit, cursor))).scalars().all()
 
 def create_alert(db: Session, alert: schemas.AlertCreate):
     db_alert = models.Alert(**alert.dict())
     db.add(db_alert)
     db.commit()
     db.refresh(db_alert)
-    asyncio.run(broadcast_update("new_alert", schemas.Alert.from_orm(db_alert).dict()))
+    publish_update("new_alert", schemas.Alert.from_orm(db_alert).dict())
     return db_alert
 
 def resolve_alert(db: Session, alert_id: int):
@@ -224,18 +415,62 @@ def resolve_alert(db: Session, alert_id: int):
         db_alert.is_resolved = True
         db.commit()
         db.refresh(db_alert)
-        asyncio.run(broadcast_update("alert_updated", schemas.Alert.from_orm(db_alert).dict()))
+        publish_update("alert_updated", schemas.Alert.from_orm(db_alert).dict())
         return db_alert
     return None
 
+def create_alerts(db: Session, rows: List[dict]) -> List[int]:
+    # Batched alerts from the anomaly detector: one transaction, ids in row order
+    db_alerts = [models.Alert(**row) for row in rows]
+    db.add_all(db_alerts)
+    db.flush()
+    messages = [schemas.Alert.from_orm(db_alert).dict() for db_alert in db_alerts]
+    db.commit()
+    for message in messages:
+        publish_update("new_alert", message)
+    return [message["id"] for message in messages]
+
+def resolve_alerts(db: Session, alert_ids: List[int]) -> int:
+    db_alerts = db.query(models.Alert).filter(models.Alert.id.in_(alert_ids), models.Alert.is_resolved.is_(False)).all()
+    for db_alert in db_alerts:
+        db_alert.is_resolved = True
+    messages = [schemas.Alert.from_orm(db_alert).dict() for db_alert in db_alerts]
+    db.commit()
+    for message in messages:
+        publish_update("alert_updated", message)
+    return len(db_alerts)
+
 # AI Log CRUD
-def get_ai_logs(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.AILog).offset(skip).limit(limit).all()
+def _ai_logs_query(skip: int, limit: int, node_id: str, cursor: tuple):
+    # Newest first by (timestamp, id); cursor is the key of the last log already returned
+    stmt = select(models.AILog)
+    if node_id:
+        stmt = stmt.where(models.AILog.node_id == node_id)
+    if cursor:
+        stmt = stmt.where(seek_after([models.AILog.timestamp, models.AILog.id], cursor, descending=True))
+    return stmt.order_by(models.AILog.timestamp.desc(), models.AILog.id.desc()).offset(0 if cursor else skip).limit(limit)
+
+def get_ai_logs(db: Session, skip: int = 0, limit: int = 100, node_id: str = None, cursor: tuple = None):
+    return db.execute(_ai_logs_query(skip, limit, node_id, cursor)).scalars().all()
+
+async def get_ai_logs_async(db: AsyncSession, skip: int = 0, limit: int = 100, node_id: str = None, cursor: tuple = None):
+    return (await db.execute(_ai_logs_query(skip, limit, node_id, cursor))).scalars().all()
 
 def create_ai_log(db: Session, ai_log: schemas.AILogCreate):
     db_ai_log = models.AILog(**ai_log.dict())
     db.add(db_ai_log)
     db.commit()
     db.refresh(db_ai_log)
-    asyncio.run(broadcast_update("new_ai_log", schemas.AILog.from_orm(db_ai_log).dict()))
-    return db_ai_log
\ No newline at end of file
+    publish_update("new_ai_log", schemas.AILog.from_orm(db_ai_log).dict())
+    return db_ai_log
+
+def create_ai_logs(db: Session, rows: List[dict]):
+    # Batched predictions from the inference service: one transaction per flush
+    db_ai_logs = [models.AILog(**row) for row in rows]
+    db.add_all(db_ai_logs)
+    db.flush()
+    messages = [schemas.AILog.from_orm(db_ai_log).dict() for db_ai_log in db_ai_logs]
+    db.commit()
+    for message in messages:
+        publish_update("new_ai_log", message)
+    return len(db_ai_logs)
\ No newline at end of file
@@ -1,12 +1,73 @@
-from sqlalchemy import create_engine
+import os
+
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./novacomm.db"
+# Any SQLAlchemy URL; e.g. postgresql+psycopg2://novacomm:secret@db:5432/novacomm for a central deployment
+SQLALCHEMY_DATABASE_URL = os.environ.get("NOVACOMM_DATABASE_URL", "sqlite:///./novacomm.db")
+
+# Connection pool settings for server databases (SQLite uses the writer/reader split below instead)
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT_S = float(os.environ.get("DB_POOL_TIMEOUT_S", 30))
+DB_POOL_RECYCLE_S = int(os.environ.get("DB_POOL_RECYCLE_S", 1800))
+
+# SQLite storage profile: "wal" (default) or "default" for SQLite's own rollback-journal settings
+SQLITE_PROFILE = os.environ.get("SQLITE_PROFILE", "wal")
+SQLITE_SYNCHRONOUS = os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL") # NORMAL is durable across crashes in WAL mode, only a power cut can lose the last commits
+SQLITE_MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+SQLITE_CACHE_SIZE_KB = int(os.environ.get("SQLITE_CACHE_SIZE_KB", 64 * 1024)) # Per connection
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", 5000))
+SQLITE_WAL_AUTOCHECKPOINT = int(os.environ.get("SQLITE_WAL_AUTOCHECKPOINT", 1000)) # Pages
+SQLITE_READ_POOL_SIZE = int(os.environ.get("SQLITE_READ_POOL_SIZE", 8))
+
+IS_SQLITE = SQLALCHEMY_DATABASE_URL.startswith("sqlite")
+
+def sqlite_pragmas(read_only: bool = False, profile: str = SQLITE_PROFILE) -> list:
+    pragmas = [f"busy_timeout={SQLITE_BUSY_TIMEOUT_MS}"]
+    if profile == "wal":
+        pragmas += [
+            "journal_mode=WAL", # Readers never block the writer and the writer never blocks readers
+            f"synchronous={SQLITE_SYNCHRONOUS}",
+            f"mmap_size={SQLITE_MMAP_SIZE}",
+            f"cache_size=-{SQLITE_CACHE_SIZE_KB}", # Negative means KiB rather than pages
+            "temp_store=MEMORY",
+            f"wal_autocheckpoint={SQLITE_WAL_AUTOCHECKPOINT}",
+        ]
+    if read_only:
+        pragmas.append("query_only=ON") # A stray write on a reader fails fast instead of competing for the lock
+    return pragmas
+
+def apply_sqlite_pragmas(dbapi_connection, read_only: bool = False, profile: str = SQLITE_PROFILE):
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in sqlite_pragmas(read_only, profile):
+            cursor.execute(f"PRAGMA {pragma}")
+    finally:
+        cursor.close()
+
+def install_sqlite_profile(engine, read_only: bool = False, profile: str = SQLITE_PROFILE):
+    if engine.dialect.name == "sqlite":
+        event.listen(engine, "connect", lambda dbapi_connection, _: apply_sqlite_pragmas(dbapi_connection, read_only, profile))
+
+# Write engine: only the single DB writer thread (db/writer.py) should use it at runtime
+if IS_SQLITE:
+    engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+    install_sqlite_profile(engine)
+else:
+    engine = create_engine(SQLALCHEMY_DATABASE_URL, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW,
+                           pool_timeout=DB_POOL_TIMEOUT_S, pool_recycle=DB_POOL_RECYCLE_S, pool_pre_ping=True)
+
+# Read-only pool for API queries; with WAL they read a consistent snapshot while the writer commits
+if IS_SQLITE:
+    read_engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False},
+                                pool_size=SQLITE_READ_POOL_SIZE, max_overflow=SQLITE_READ_POOL_SIZE)
+    install_sqlite_profile(read_engine, read_only=True)
+else:
+    read_engine = engine
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
 
 Base = declarative_base()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, JSON, LargeBinary, Text
+from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, JSON, LargeBinary, Text, Index
 from .database import Base
 import datetime
 
@@ -27,8 +27,36 @@ class Packet(Base):
     node_id = Column(String, index=True)
     timestamp = Column(DateTime, default=datetime.datetime.utcnow)
     payload = Column(String)
-    snr = Column(Float)
+    snr = Column(Float) # Best SNR among the gateways that heard the packet
     rssi = Column(Float)
+    source_addr = Column(String, nullable=True) # Radio source address, with packet_id the dedup key
+    packet_id = Column(Integer, nullable=True)
+    gateways = Column(JSON, nullable=True) # Gateways that received a copy
+
+    __table_args__ = (
+        Index("ix_packets_node_id_timestamp", "node_id", "timestamp"), # Per-node time range scans
+    )
+
+class PacketRollup(Base):
+    __tablename__ = "packet_rollups"
+
+    id = Column(Integer, primary_key=True, index=True)
+    node_id = Column(String) # Node uuid, or "*" for the fleet-wide aggregate
+    resolution = Column(Integer) # Bucket width in seconds (60, 300, 3600)
+    bucket_start = Column(DateTime)
+    count = Column(Integer, default=0)
+    snr_min = Column(Float)
+    snr_max = Column(Float)
+    snr_sum = Column(Float)
+    rssi_min = Column(Float)
+    rssi_max = Column(Float)
+    rssi_sum = Column(Float)
+    snr_sketch = Column(JSON) # Sparse fixed-width histogram {bin: count} for quantiles
+    rssi_sketch = Column(JSON)
+
+    __table_args__ = (
+        Index("ux_packet_rollups_key", "resolution", "node_id", "bucket_start", unique=True),
+    )
 
 class User(Base):
     __tablename__ = "users"
@@ -42,6 +70,25 @@ class User(Base):
     password_reset_token = Column(String, nullable=True)
     password_reset_expires = Column(DateTime, nullable=True)
 
+class Firmware(Base):
+    __tablename__ = "firmware"
+
+    id = Column(Integer, primary_key=True, index=True)
+    version = Column(String, unique=True, index=True)
+    filename = Column(String)
+    file_path = Column(String) # Where the image is stored on the server
+    size = Column(Integer, nullable=True) # Bytes
+    sha256 = Column(String(64), index=True, nullable=True) # Content address; versions with identical images share one file
+    upload_date = Column(DateTime, default=datetime.datetime.utcnow)
+
+class OTARollout(Base):
+    __tablename__ = "ota_rollouts"
+
+    id = Column(Integer, primary_key=True, index=True)
+    firmware_version = Column(String)
+    node_count = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
 class OTATask(Base):
     __tablename__ = "ota_tasks"
 
@@ -53,16 +100,27 @@ class OTATask(Base):
     file_url = Column(String) # Path or URL to the firmware file
     start_time = Column(DateTime, default=datetime.datetime.utcnow)
     end_time = Column(DateTime, nullable=True)
+    rollout_id = Column(Integer, index=True, nullable=True) # Fleet rollout this transfer belongs to
+    chunks_acked = Column(Integer, default=0) # Transfers resume from here
+    chunks_total = Column(Integer, nullable=True)
 
 class Job(Base):
     __tablename__ = "jobs"
 
     id = Column(Integer, primary_key=True, index=True)
     node_id = Column(String, nullable=True) # Optional, for node-specific jobs
-    job_type = Column(String) # e.g., "OTA", "Mode Switch", "Broadcast"
+    job_type = Column(String) # e.g., "OTA", "Mode Switch", "Broadcast", "Route Optimization"
     schedule_time = Column(DateTime) # When the job is scheduled to run
     status = Column(String, default="scheduled") # scheduled, in_progress, completed, failed
     payload = Column(JSON, nullable=True) # Job-specific data (e.g., new mode, firmware version)
+    attempts = Column(Integer, default=0) # Executions started so far, retries included
+    last_error = Column(Text, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_jobs_schedule_time_id", "schedule_time", "id"), # Keyset pagination
+        Index("ix_jobs_status_schedule_time", "status", "schedule_time"), # Scheduler startup load of pending jobs
+    )
 
 class Alert(Base):
     __tablename__ = "alerts"
@@ -74,6 +132,10 @@ class Alert(Base):
     timestamp = Column(DateTime, default=datetime.datetime.utcnow)
     is_resolved = Column(Boolean, default=False)
 
+    __table_args__ = (
+        Index("ix_alerts_timestamp_id", "timestamp", "id"), # Keyset pagination
+    )
+
 class AILog(Base):
     __tablename__ = "ai_logs"
 
@@ -82,4 +144,8 @@ class AILog(Base):
     model_name = Column(String)
     prediction = Column(JSON) # Store prediction output as JSON
     accuracy = Column(Float, nullable=True)
-    timestamp = Column(DateTime, default=datetime.datetime.utcnow)
\ No newline at end of file
+    timestamp = Column(DateTime, default=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_ai_logs_timestamp_id", "timestamp", "id"), # Keyset pagination
+    )
@@ -0,0 +1,289 @@
+import datetime
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+from sqlalchemy import Column, Index, MetaData, Table, bindparam, event, func, inspect, select, text
+from sqlalchemy.orm import Session
+
+from . import models
+from .storage import bulk_insert, drop_chunks
+from .writer import db_writer
+from ..utils.pagination import seek_after
+
+# Packet storage layout
+PACKET_PARTITIONING = os.environ.get("PACKET_PARTITIONING", "daily") # "none", "daily" or "weekly"; "hypertable" is set by init_db
+PACKET_RETENTION_DAYS = int(os.environ.get("PACKET_RETENTION_DAYS", 0)) # 0 keeps every partition
+PARTITION_PREFIX = "packets_p"
+PARTITION_CACHE_TTL_S = 60
+
+class PacketPartitioner:
+    """Routes packet rows into per-day or per-week tables (packets_pYYYYMMDD).
+
+    Every partition has the same columns as models.Packet plus a composite
+    (node_id, timestamp) index. Reads only visit the partitions overlapping the
+    requested window and retention drops whole tables instead of DELETEing rows.
+    Packet ids are allocated here so they stay unique across partitions. On
+    Postgres they come from the packets id sequence, which stays unique across
+    several instances or workers; SQLite has a single writing process, so an
+    in-process counter is enough there.
+    """
+
+    def __init__(self, scheme: str = PACKET_PARTITIONING, retention_days: int = PACKET_RETENTION_DAYS):
+        self.scheme = scheme
+        self.retention_days = retention_days
+        self.metadata = MetaData()
+        self._tables: Dict[str, Table] = {}
+        self._known: Optional[List[str]] = None
+        self._known_at = 0.0
+        self._next_id = None
+        self._sequence = None # Postgres sequence behind packets.id, looked up on first use
+        self._upgraded = set() # Tables already checked for columns added to models.Packet
+        self._lock = threading.RLock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.scheme in ("daily", "weekly")
+
+    def use_hypertable(self):
+        # TimescaleDB chunks the packets table itself: rows stay in one table and retention drops chunks
+        self.scheme = "hypertable"
+
+    def partition_start(self, timestamp: datetime.datetime) -> datetime.datetime:
+        start = datetime.datetime(timestamp.year, timestamp.month, timestamp.day)
+        if self.scheme == "weekly":
+            start -= datetime.timedelta(days=start.weekday()) # Weeks start on Monday
+        return start
+
+    def partition_span(self) -> datetime.timedelta:
+        return datetime.timedelta(days=7 if self.scheme == "weekly" else 1)
+
+    def table_name(self, timestamp: datetime.datetime) -> str:
+        return f"{PARTITION_PREFIX}{self.partition_start(timestamp):%Y%m%d}"
+
+    def _define(self, name: str) -> Table:
+        table = self._tables.get(name)
+        if table is None:
+            # Plain copies of the packet columns; per-column indexes are replaced by the composite one
+            columns = [Column(column.name, column.type, primary_key=column.primary_key, nullable=column.nullable)
+                       for column in models.Packet.__table__.columns]
+            table = Table(name, self.metadata, *columns, Index(f"ix_{name}_node_id_timestamp", "node_id", "timestamp"))
+            self._tables[name] = table
+        return table
+
+    def _upgrade(self, db: Session, table: Table) -> Table:
+        # Tables created before a column was added to models.Packet get it through ALTER TABLE
+        if table.name in self._upgraded:
+            return table
+        connection = db.connection()
+        existing = {column["name"] for column in inspect(connection).get_columns(table.name)}
+        missing = [column for column in table.columns if existing and column.name not in existing]
+        if missing:
+            if db_writer.in_writer():
+                self._add_columns(db, table.name, missing)
+            else:
+                # Reached from a read-only session: the writer applies it and commits
+                db_writer.run(self._add_columns, table.name, missing, commit=True)
+        with self._lock:
+            self._upgraded.add(table.name)
+        return table
+
+    def _add_columns(self, db: Session, name: str, columns: list, commit: bool = False):
+        dialect = db.get_bind().dialect
+        for column in columns:
+            db.execute(text(f"ALTER TABLE {name} ADD COLUMN {column.name} {column.type.compile(dialect=dialect)}"))
+        if commit:
+            db.commit()
+
+    def _start_of(self, name: str) -> datetime.datetime:
+        return datetime.datetime.strptime(name[len(PARTITION_PREFIX):], "%Y%m%d")
+
+    def partitions(self, db: Session, refresh: bool = False) -> List[str]:
+        # Partition names, oldest first; cached because the inspector hits sqlite_master
+        with self._lock:
+            if refresh or self._known is None or time.monotonic() - self._known_at > PARTITION_CACHE_TTL_S:
+                names = inspect(db.connection()).get_table_names()
+                self._known = sorted(name for name in names if name.startswith(PARTITION_PREFIX))
+                self._known_at = time.monotonic()
+            return list(self._known)
+
+    def table_for(self, db: Session, timestamp: datetime.datetime) -> Table:
+        name = self.table_name(timestamp)
+        table = self._define(name)
+        created = self._created_in(db)
+        if name in created:
+            return table
+        if name not in self.partitions(db):
+            table.create(bind=db.connection(), checkfirst=True)
+            created.add(name)
+            return table
+        return self._upgrade(db, table)
+
+    def _created_in(self, db: Session) -> set:
+        # Partitions this session created in its open transaction. They only reach the shared cache once
+        # the CREATE TABLE commits; a rollback undoes it, and a cached name would then fail inserts
+        created = db.info.get("created_partitions")
+        if created is None:
+            created = db.info["created_partitions"] = set()
+            event.listen(db, "after_commit", lambda session: self._committed(created))
+            event.listen(db, "after_rollback", lambda session: self._rolled_back(created))
+        return created
+
+    def _committed(self, names: set):
+        with self._lock:
+            self._known = sorted(set(self._known or []) | names)
+            self._upgraded |= names
+        names.clear()
+
+    def _rolled_back(self, names: set):
+        # A cache refresh inside the transaction may have listed them already
+        with self._lock:
+            if self._known is not None:
+                self._known = [name for name in self._known if name not in names]
+            self._upgraded -= names
+        names.clear()
+
+    def overlapping(self, db: Session, start_time: datetime.datetime = None, end_time: datetime.datetime = None) -> List[Table]:
+        # Partitions whose [start, start + span) range intersects [start_time, end_time], newest first
+        span = self.partition_span()
+        tables = []
+        for name in reversed(self.partitions(db)):
+            start = self._start_of(name)
+            if end_time and start > end_time:
+                continue
+            if start_time and start + span <= start_time:
+                continue
+            tables.append(self._define(name))
+        return tables
+
+    def allocate_ids(self, db: Session, count: int) -> Sequence[int]:
+        if db.get_bind().dialect.name == "postgresql":
+            return self._sequence_ids(db, count)
+        with self._lock:
+            if self._next_id is None:
+                self._next_id = self._max_id(db) + 1
+            first = self._next_id
+            self._next_id += count
+        return range(first, first + count)
+
+    def _sequence_ids(self, db: Session, count: int) -> List[int]:
+        # nextval is atomic across connections, so concurrent writers never get the same id; one round trip per batch
+        with self._lock:
+            if self._sequence is None:
+                sequence = db.execute(text("SELECT pg_get_serial_sequence('packets', 'id')")).scalar()
+                if sequence is None: # id without a default (e.g. a table created by hand)
+                    db.execute(text("CREATE SEQUENCE IF NOT EXISTS packets_id_seq"))
+                    sequence = "packets_id_seq"
+                # Ids handed out by the in-process counter before this moved past the sequence: skip over them
+                db.execute(text("SELECT setval(CAST(:sequence AS regclass), :max_id) "
+                                "WHERE :max_id > COALESCE(pg_sequence_last_value(CAST(:sequence AS regclass)), 0)"),
+                           {"sequence": sequence, "max_id": self._max_id(db)})
+                self._sequence = sequence
+        return list(db.execute(text("SELECT nextval(CAST(:sequence AS regclass)) FROM generate_series(1, :count)"),
+                               {"sequence": self._sequence, "count": count}).scalars())
+
+    def _max_id(self, db: Session) -> int:
+        tables = [models.Packet.__table__]
+        if self.enabled:
+            tables += [self._define(name) for name in self.partitions(db, refresh=True)]
+        return max((db.execute(select(func.max(table.c.id))).scalar() or 0) for table in tables)
+
+    def insert(self, db: Session, rows: List[dict]) -> List[dict]:
+        # Assigns ids and writes each row to the partition covering its timestamp
+        for row, packet_id in zip(rows, self.allocate_ids(db, len(rows))):
+            row["id"] = packet_id
+        if not self.enabled:
+            bulk_insert(db, self._upgrade(db, models.Packet.__table__), rows)
+            return rows
+        by_table: Dict[str, List[dict]] = {}
+        for row in rows:
+            by_table.setdefault(self.table_name(row["timestamp"]), []).append(row)
+        for group in by_table.values():
+            bulk_insert(db, self.table_for(db, group[0]["timestamp"]), group)
+        return rows
+
+    def update(self, db: Session, rows: List[dict]):
+        # rows hold id and timestamp (to find the partition) plus the columns to overwrite
+        by_table: Dict[str, List[dict]] = {}
+        for row in rows:
+            by_table.setdefault(self.table_name(row["timestamp"]) if self.enabled else "", []).append(row)
+        for name, group in by_table.items():
+            if name and name not in self.partitions(db):
+                continue # Dropped by retention meanwhile
+            table = self._upgrade(db, self._define(name) if name else models.Packet.__table__)
+            fields = [key for key in group[0] if key not in ("id", "timestamp")]
+            stmt = table.update().where(table.c.id == bindparam("row_id")).values({field: bindparam(f"new_{field}") for field in fields})
+            db.execute(stmt, [{"row_id": row["id"], **{f"new_{field}": row[field] for field in fields}} for row in group])
+
+    def query(self, db: Session, skip: int = 0, limit: int = 100, node_id: str = None,
+              start_time: datetime.datetime = None, end_time: datetime.datetime = None, cursor: tuple = None) -> List[models.Packet]:
+        # Newest first; walks partitions newest to oldest and stops once skip + limit rows are found.
+        # With a (timestamp, id) cursor the scan seeks past it instead of skipping rows.
+        if cursor:
+            skip = 0
+            end_time = min(end_time, cursor[0]) if end_time else cursor[0]
+        sources = [models.Packet.__table__]
+        if self.enabled:
+            sources = self.overlapping(db, start_time, end_time) + sources
+        wanted = skip + limit
+        results = []
+        for table in sources:
+            stmt = select(self._upgrade(db, table))
+            if node_id:
+                stmt = stmt.where(table.c.node_id == node_id)
+            if start_time:
+                stmt = stmt.where(table.c.timestamp >= start_time)
+            if end_time:
+                stmt = stmt.where(table.c.timestamp <= end_time)
+            if cursor:
+                stmt = stmt.where(seek_after([table.c.timestamp, table.c.id], cursor, descending=True))
+            stmt = stmt.order_by(table.c.timestamp.desc(), table.c.id.desc()).limit(wanted - len(results))
+            results += db.query(models.Packet).from_statement(stmt).all()
+            if len(results) >= wanted:
+                break
+        return results[skip:skip + limit]
+
+    def iter_rows(self, db: Session, node_id: str = None, start_time: datetime.datetime = None,
+                  end_time: datetime.datetime = None, batch_size: int = 1000):
+        # Oldest first, streamed from a server-side cursor batch_size rows at a time
+        sources = [models.Packet.__table__]
+        if self.enabled:
+            sources += list(reversed(self.overlapping(db, start_time, end_time)))
+        for table in sources:
+            stmt = select(self._upgrade(db, table))
+            if node_id:
+                stmt = stmt.where(table.c.node_id == node_id)
+            if start_time:
+                stmt = stmt.where(table.c.timestamp >= start_time)
+            if end_time:
+                stmt = stmt.where(table.c.timestamp <= end_time)
+            stmt = stmt.order_by(table.c.timestamp, table.c.id).execution_options(yield_per=batch_size)
+            for partition in db.execute(stmt).mappings().partitions():
+                yield partition
+
+    def drop_expired(self, db: Session, now: datetime.datetime = None) -> List[str]:
+        # Drops partitions that end before now - retention_days
+        if self.retention_days <= 0:
+            return []
+        cutoff = (now or datetime.datetime.utcnow()) - datetime.timedelta(days=self.retention_days)
+        if self.scheme == "hypertable":
+            dropped = drop_chunks(db, models.Packet.__tablename__, cutoff)
+            db.commit()
+            return dropped
+        if not self.enabled:
+            return []
+        dropped = []
+        for name in self.partitions(db, refresh=True):
+            if self._start_of(name) + self.partition_span() <= cutoff:
+                self._define(name).drop(bind=db.connection(), checkfirst=True)
+                dropped.append(name)
+        if dropped:
+            db.commit()
+            with self._lock:
+                self._known = [name for name in self._known if name not in dropped]
+                for name in dropped:
+                    self.metadata.remove(self._tables.pop(name))
+        return dropped
+
+packet_partitioner = PacketPartitioner()
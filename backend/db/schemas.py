@@ -1,6 +1,6 @@
 from pydantic import BaseModel, EmailStr
 import datetime
-from typing import Optional
+from typing import Dict, List, Optional
 
 class NodeBase(BaseModel):
     uuid: str
@@ -38,6 +38,9 @@ class PacketCreate(PacketBase):
 class Packet(PacketBase):
     id: int
     timestamp: datetime.datetime
+    source_addr: Optional[str] = None
+    packet_id: Optional[int] = None
+    gateways: Optional[list] = None
 
     class Config:
         orm_mode = True
@@ -80,6 +83,8 @@ class FirmwareCreate(FirmwareBase):
 
 class Firmware(FirmwareBase):
     id: int
+    size: Optional[int] = None
+    sha256: Optional[str] = None
     upload_date: datetime.datetime
 
     class Config:
@@ -99,10 +104,30 @@ class OTATask(OTATaskBase):
     id: int
     start_time: datetime.datetime
     end_time: Optional[datetime.datetime] = None
+    rollout_id: Optional[int] = None
+    chunks_acked: Optional[int] = 0
+    chunks_total: Optional[int] = None
 
     class Config:
         orm_mode = True
 
+class OTARolloutCreate(BaseModel):
+    firmware_version: str
+    node_ids: Optional[List[str]] = None # None rolls out to every node
+
+class OTARollout(BaseModel):
+    id: int
+    firmware_version: str
+    node_count: int
+    created_at: datetime.datetime
+
+    class Config:
+        orm_mode = True
+
+class OTARolloutStatus(OTARollout):
+    status_counts: Dict[str, int] = {}
+    progress: float = 0.0 # Mean over the rollout's transfers
+
 class JobBase(BaseModel):
     job_type: str
     schedule_time: datetime.datetime
@@ -115,6 +140,9 @@ class JobCreate(JobBase):
 class Job(JobBase):
     id: int
     status: str
+    attempts: Optional[int] = 0
+    last_error: Optional[str] = None
+    finished_at: Optional[datetime.datetime] = None
 
     class Config:
         orm_mode = True
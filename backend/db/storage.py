@@ -0,0 +1,146 @@
+import datetime
+import io
+import json
+import os
+from typing import List
+
+from sqlalchemy import Table, inspect, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+
+from .database import Base, engine
+from . import models # Registers every table on Base.metadata
+
+# Time-series layout: "auto" uses TimescaleDB hypertables when the extension is available on Postgres,
+# "timescale" requires it, "off" keeps plain tables (and PACKET_PARTITIONING for packets)
+TIMESERIES_LAYOUT = os.environ.get("NOVACOMM_TIMESERIES", "auto")
+TIMESCALE_CHUNK_INTERVAL = os.environ.get("TIMESCALE_CHUNK_INTERVAL", "1 day")
+
+# Tables stored as hypertables, chunked on their time column
+HYPERTABLES = {"packets": "timestamp", "ai_logs": "timestamp"}
+
+def timescale_available(connection: Connection) -> bool:
+    if connection.dialect.name != "postgresql":
+        return False
+    return connection.execute(text("SELECT 1 FROM pg_available_extensions WHERE name = 'timescaledb'")).first() is not None
+
+def is_hypertable(connection: Connection, table: str) -> bool:
+    return connection.execute(text("SELECT 1 FROM timescaledb_information.hypertables WHERE hypertable_name = :table"),
+                              {"table": table}).first() is not None
+
+def merge_partitions(connection: Connection) -> int:
+    # Rows written under PACKET_PARTITIONING live in packets_pYYYYMMDD tables the hypertable layout never reads:
+    # copy them into packets (ids are already unique across partitions) and drop the partition tables
+    from .partitions import PARTITION_PREFIX
+    inspector = inspect(connection)
+    columns = {column["name"] for column in inspector.get_columns("packets")}
+    moved = 0
+    for name in sorted(name for name in inspector.get_table_names() if name.startswith(PARTITION_PREFIX)):
+        # Partitions created before a column was added to packets lack it; it stays NULL
+        shared = ", ".join(column["name"] for column in inspector.get_columns(name) if column["name"] in columns)
+        moved += connection.execute(text(f"INSERT INTO packets ({shared}) SELECT {shared} FROM {name}")).rowcount
+        connection.execute(text(f"DROP TABLE {name}"))
+        print(f"Moved partition {name} into packets")
+    return moved
+
+def create_hypertables(connection: Connection):
+    connection.execute(text("CREATE EXTENSION IF NOT EXISTS timescaledb"))
+    for table, time_column in HYPERTABLES.items():
+        if table == "packets":
+            merge_partitions(connection) # Before create_hypertable, so migrate_data chunks them with the rest
+        if is_hypertable(connection, table):
+            continue
+        # Every unique index of a hypertable must include the time column, so the key becomes (id, time)
+        connection.execute(text(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {table}_pkey"))
+        connection.execute(text(f"ALTER TABLE {table} ADD PRIMARY KEY (id, {time_column})"))
+        connection.execute(text(
+            "SELECT create_hypertable(CAST(:table AS regclass), :column, chunk_time_interval => CAST(:interval AS INTERVAL), "
+            "if_not_exists => TRUE, migrate_data => TRUE)"
+        ), {"table": table, "column": time_column, "interval": TIMESCALE_CHUNK_INTERVAL})
+        print(f"Converted {table} to a hypertable ({TIMESCALE_CHUNK_INTERVAL} chunks on {time_column})")
+
+def resolve_layout(connection: Connection) -> str:
+    if TIMESERIES_LAYOUT == "off":
+        return "tables"
+    if timescale_available(connection):
+        return "timescale"
+    if TIMESERIES_LAYOUT == "timescale":
+        raise RuntimeError("NOVACOMM_TIMESERIES=timescale but the timescaledb extension is not available")
+    return "tables"
+
+def upgrade_schema(connection: Connection):
+    # create_all only creates missing tables: add columns and indexes introduced since a table was created
+    inspector = inspect(connection)
+    for table in Base.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=connection.dialect)}"))
+                print(f"Added column {table.name}.{column.name}")
+        for index in table.indexes:
+            index.create(bind=connection, checkfirst=True)
+
+def init_db(bind: Engine = engine) -> str:
+    # Called once at startup instead of at import time, so tools can import the app without a database
+    from .partitions import packet_partitioner
+    with bind.begin() as connection:
+        Base.metadata.create_all(bind=connection)
+        upgrade_schema(connection)
+        layout = resolve_layout(connection)
+        if layout == "timescale":
+            create_hypertables(connection)
+    if layout == "timescale":
+        packet_partitioner.use_hypertable()
+    print(f"Storage: {bind.dialect.name}, {layout} layout")
+    return layout
+
+def drop_chunks(db: Session, table: str, older_than: datetime.datetime) -> List[str]:
+    # Retention on a hypertable drops whole chunks, the same as dropping a daily partition table
+    return [row[0] for row in db.execute(text("SELECT drop_chunks(CAST(:table AS regclass), older_than => :cutoff)"),
+                                         {"table": table, "cutoff": older_than})]
+
+def _copy_value(value) -> str:
+    # Postgres COPY text format: \N is NULL; backslash, tab and newlines are escaped
+    if value is None:
+        return "\\N"
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value)
+    elif isinstance(value, datetime.datetime):
+        value = value.isoformat()
+    elif isinstance(value, bool):
+        value = "t" if value else "f"
+    else:
+        value = str(value)
+    return value.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+# Postgres drivers whose raw cursors take COPY ... FROM STDIN
+COPY_DRIVERS = ("psycopg2", "psycopg")
+
+def copy_supported(db: Session) -> bool:
+    dialect = db.get_bind().dialect
+    return dialect.name == "postgresql" and dialect.driver in COPY_DRIVERS
+
+def bulk_insert(db: Session, table: Table, rows: List[dict]):
+    # COPY on Postgres (several times faster than executemany for ingest batches), a plain INSERT elsewhere.
+    # Rows must already carry every key they want written; ids are assigned by the caller.
+    if not rows:
+        return
+    if not copy_supported(db):
+        db.execute(table.insert(), rows)
+        return
+    columns = [column.name for column in table.columns if column.name in rows[0]]
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(_copy_value(row.get(column)) for column in columns))
+        buffer.write("\n")
+    statement = f"COPY {table.name} ({', '.join(columns)}) FROM STDIN"
+    cursor = db.connection().connection.cursor() # Raw driver cursor inside the session's transaction
+    try:
+        if db.get_bind().dialect.driver == "psycopg2":
+            buffer.seek(0)
+            cursor.copy_expert(statement, buffer)
+        else:
+            with cursor.copy(statement) as copy:
+                copy.write(buffer.getvalue())
+    finally:
+        cursor.close()
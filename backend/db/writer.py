@@ -0,0 +1,245 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from .database import SessionLocal
+
+# DB writer settings
+DB_WRITE_QUEUE_SIZE = int(os.environ.get("DB_WRITE_QUEUE_SIZE", 1000))
+
+class DatabaseWriterBusy(RuntimeError):
+    pass
+
+class DatabaseWriter:
+    """The one thread allowed to write to the database.
+
+    SQLite takes a single write lock for the whole file, so writers on several
+    threads only queue up inside busy_timeout and eventually fail with
+    "database is locked". Every write (ingest batches, registry flushes, API
+    mutations) is instead submitted here as fn(db, *args) and runs on a fresh
+    session in submission order. Readers use ReadSessionLocal and are never blocked.
+    """
+
+    def __init__(self, maxsize: int = DB_WRITE_QUEUE_SIZE, session_factory=SessionLocal):
+        self.session_factory = session_factory
+        self.queue = queue.Queue(maxsize=maxsize)
+        self._thread = None
+        self._stop = threading.Event()
+        self._start_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0, "max_queue_depth": 0,
+                      "wait_ms_total": 0.0, "max_wait_ms": 0.0, "run_ms_total": 0.0, "max_run_ms": 0.0}
+
+    def start(self):
+        with self._start_lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        # Jobs already queued are still executed before the thread exits
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def in_writer(self) -> bool:
+        return threading.current_thread() is self._thread
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        return self._submit(fn, args, kwargs, block=True)
+
+    def _submit(self, fn, args: tuple, kwargs: dict, block: bool) -> Future:
+        future = Future()
+        if self.in_writer():
+            # Nested write from a job: run inline, queueing it would deadlock on ourselves
+            self._execute(fn, args, kwargs, future, time.perf_counter())
+            return future
+        self.start()
+        try:
+            self.queue.put((fn, args, kwargs, future, time.perf_counter()), block=block)
+        except queue.Full:
+            raise DatabaseWriterBusy(f"DB write queue full ({self.queue.maxsize} jobs)")
+        with self._lock:
+            self.stats["submitted"] += 1
+            self.stats["max_queue_depth"] = max(self.stats["max_queue_depth"], self.queue.qsize())
+        return future
+
+    def run(self, fn, *args, **kwargs):
+        # Blocking: for threadpool endpoints and background threads
+        return self.submit(fn, *args, **kwargs).result()
+
+    async def run_async(self, fn, *args, **kwargs):
+        # Event loop: never waits for queue space, raises DatabaseWriterBusy instead (a 503 for API callers)
+        return await asyncio.wrap_future(self._submit(fn, args, kwargs, block=False))
+
+    def _run(self):
+        while not self._stop.is_set() or not self.queue.empty():
+            try:
+                job = self.queue.get(timeout=0.25)
+            except queue.Empty:
+                continue
+            self._execute(*job)
+
+    def _execute(self, fn, args, kwargs, future: Future, submitted_at: float):
+        if not future.set_running_or_notify_cancel():
+            return
+        started = time.perf_counter()
+        db = self.session_factory()
+        try:
+            result = fn(db, *args, **kwargs)
+        except BaseException as e:
+            db.rollback()
+            future.set_exception(e)
+            failed = 1
+        else:
+            future.set_result(result)
+            failed = 0
+        finally:
+            # close() detaches returned rows with their loaded attributes intact
+            db.close()
+        finished = time.perf_counter()
+        wait_ms = (started - submitted_at) * 1000
+        run_ms = (finished - started) * 1000
+        with self._lock:
+            self.stats["completed"] += 1
+            self.stats["failed"] += failed
+            self.stats["wait_ms_total"] += wait_ms
+            self.stats["max_wait_ms"] = max(self.stats["max_wait_ms"], wait_ms)
+            self.stats["run_ms_total"] += run_ms
+            self.stats["max_run_ms"] = max(self.stats["max_run_ms"], run_ms)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+        completed = stats["completed"]
+        stats["avg_wait_ms"] = round(stats["wait_ms_total"] / completed, 3) if completed else 0.0
+        stats["avg_run_ms"] = round(stats["run_ms_total"] / completed, 3) if completed else 0.0
+        stats["queue_depth"] = self.queue.qsize()
+        stats["queue_capacity"] = self.queue.maxsize
+        return stats
+
+db_writer = DatabaseWriter()
+
+# Benchmark: read latency from the read-only pool while the writer sustains a steady insert rate
+BENCHMARK_INSERT_RATE = 2000 # Rows per second
+BENCHMARK_ROWS_PER_COMMIT = 100 # Ingest batches rather than one transaction per row
+BENCHMARK_READ_RATE = 100 # Queries per second per reader thread
+BENCHMARK_READ_P99_TARGET_MS = 10.0
+
+def run_benchmark(profile: str = "wal", insert_rate: int = BENCHMARK_INSERT_RATE, rows_per_commit: int = BENCHMARK_ROWS_PER_COMMIT,
+                  duration_s: float = 10.0, readers: int = 4, read_rate: int = BENCHMARK_READ_RATE, path: str = None) -> dict:
+    import os.path
+    import random
+    import tempfile
+
+    from sqlalchemy import Column, Float, Index, Integer, MetaData, String, Table, create_engine, func, select
+    from sqlalchemy.orm import sessionmaker
+
+    from .database import install_sqlite_profile
+
+    workdir = None
+    if path is None:
+        workdir = tempfile.TemporaryDirectory()
+        path = os.path.join(workdir.name, "benchmark.db")
+    url = f"sqlite:///{path}"
+    write_engine = create_engine(url, connect_args={"check_same_thread": False})
+    install_sqlite_profile(write_engine, profile=profile)
+    read_engine = create_engine(url, connect_args={"check_same_thread": False}, pool_size=readers, max_overflow=0)
+    install_sqlite_profile(read_engine, read_only=True, profile=profile)
+
+    metadata = MetaData()
+    packets = Table("benchmark_packets", metadata,
+                    Column("id", Integer, primary_key=True), Column("node_id", String), Column("timestamp", Float),
+                    Column("rssi", Integer), Column("payload", String),
+                    Index("ix_benchmark_packets_node_id_timestamp", "node_id", "timestamp"))
+    metadata.create_all(write_engine)
+    nodes = [f"node-{i:03d}" for i in range(200)]
+
+    writer = DatabaseWriter(session_factory=sessionmaker(bind=write_engine))
+    ReadSession = sessionmaker(bind=read_engine)
+    stop = threading.Event()
+    latencies, errors = [], []
+    inserted = [0]
+
+    def insert(db, rows):
+        db.execute(packets.insert(), rows)
+        db.commit()
+        inserted[0] += len(rows)
+
+    def produce():
+        # Paced to insert_rate; submit() blocks once the write queue is full, like ingest would
+        interval = rows_per_commit / insert_rate
+        next_at = time.perf_counter()
+        while not stop.is_set():
+            now = time.time()
+            writer.submit(insert, [{"node_id": random.choice(nodes), "timestamp": now, "rssi": random.randint(-120, -40),
+                                    "payload": "x" * 48} for _ in range(rows_per_commit)])
+            next_at += interval
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+    def read():
+        samples = []
+        next_at = time.perf_counter()
+        while not stop.is_set():
+            next_at += 1 / read_rate
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            stmt = (select(func.count(), func.avg(packets.c.rssi), func.max(packets.c.timestamp))
+                    .where(packets.c.node_id == random.choice(nodes), packets.c.timestamp >= time.time() - 5))
+            started = time.perf_counter()
+            try:
+                with ReadSession() as db:
+                    db.execute(stmt).one()
+                samples.append((time.perf_counter() - started) * 1000)
+            except Exception as e:
+                errors.append(str(e))
+        latencies.extend(samples)
+
+    threads = [threading.Thread(target=produce)] + [threading.Thread(target=read) for _ in range(readers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(duration_s)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    writer.stop()
+    elapsed = time.perf_counter() - started
+    write_engine.dispose()
+    read_engine.dispose()
+    if workdir is not None:
+        workdir.cleanup()
+
+    latencies.sort()
+    def percentile(q):
+        return round(latencies[min(len(latencies) - 1, int(q * len(latencies)))], 3) if latencies else None
+    return {
+        "profile": profile,
+        "inserts_per_s": round(inserted[0] / elapsed),
+        "reads": len(latencies),
+        "read_errors": len(errors),
+        "read_p50_ms": percentile(0.50),
+        "read_p99_ms": percentile(0.99),
+        "read_max_ms": round(latencies[-1], 3) if latencies else None,
+        "writer": writer.get_stats(),
+    }
+
+if __name__ == "__main__":
+    import sys
+
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 10.0
+    for profile in ("default", "wal"):
+        result = run_benchmark(profile=profile, duration_s=duration)
+        writer_stats = result.pop("writer")
+        target = result["read_p99_ms"] is not None and result["read_p99_ms"] <= BENCHMARK_READ_P99_TARGET_MS
+        print(f"{profile:>8}: {result} writer_avg_wait_ms={writer_stats['avg_wait_ms']} "
+              f"p99 target {BENCHMARK_READ_P99_TARGET_MS} ms {'met' if target else 'MISSED'}")
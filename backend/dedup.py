@@ -0,0 +1,176 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+# Duplicate suppression settings
+DEDUP_WINDOW_S = float(os.environ.get("DEDUP_WINDOW_S", 30)) # Copies heard by other gateways arrive within this window
+DEDUP_MAX_ENTRIES = int(os.environ.get("DEDUP_MAX_ENTRIES", 200000))
+REPLAY_WINDOW_S = float(os.environ.get("REPLAY_WINDOW_S", 120)) # Accepted skew between a packet's timestamp and ours
+DEDUP_MAX_NONCES = int(os.environ.get("DEDUP_MAX_NONCES", 500000))
+
+class DedupEntry:
+    __slots__ = ("first_seen", "record", "row", "snr", "rssi", "gateways")
+
+    def __init__(self, first_seen: float, record: dict):
+        self.first_seen = first_seen
+        self.record = record # Canonical record until it is written, then None
+        self.row = None # (packet id, timestamp) once written
+        data = record["data"]
+        self.snr = data.get("snr")
+        self.rssi = data.get("rssi")
+        self.gateways = record["gateways"]
+
+    def merge(self, data: dict, gateway: Optional[str]) -> bool:
+        # Keeps the best SNR/RSSI seen by any gateway; returns True if anything changed
+        changed = False
+        if gateway and gateway not in self.gateways:
+            self.gateways.append(gateway)
+            changed = True
+        snr, rssi = data.get("snr"), data.get("rssi")
+        if snr is not None and (self.snr is None or snr > self.snr):
+            self.snr = snr
+            changed = True
+        if rssi is not None and (self.rssi is None or rssi > self.rssi):
+            self.rssi = rssi
+            changed = True
+        if changed and self.record is not None:
+            self.record["data"] = {**self.record["data"], "snr": self.snr, "rssi": self.rssi}
+        return changed
+
+class PacketDeduplicator:
+    """Time-windowed LRU of recently seen (source, packet_id) keys.
+
+    Copies of the same frame relayed by several gateways are folded into the
+    first one: within a batch the pending record is updated in place, and for
+    a copy arriving after the original was written the stored row is updated
+    (best SNR/RSSI, list of receiving gateways). Packets carrying a nonce and
+    timestamp (docs/encryption_stack.md) are also checked against replays.
+    Only the ingest writer thread calls into this.
+    """
+
+    def __init__(self, window_s: float = DEDUP_WINDOW_S, max_entries: int = DEDUP_MAX_ENTRIES,
+                 replay_window_s: float = REPLAY_WINDOW_S, max_nonces: int = DEDUP_MAX_NONCES):
+        self.window_s = window_s
+        self.max_entries = max_entries
+        self.replay_window_s = replay_window_s
+        # A timestamp is accepted up to replay_window_s either side of now, so a nonce must outlive
+        # that whole span or a replay could arrive after we forgot it
+        self.nonce_window_s = max(2 * replay_window_s, window_s)
+        self.max_nonces = max_nonces
+        self._entries: "OrderedDict[tuple, DedupEntry]" = OrderedDict()
+        self._nonces: "OrderedDict[tuple, Tuple[tuple, float]]" = OrderedDict() # (source, nonce) -> (key, seen at)
+        self._lock = threading.Lock()
+        self.stats = {"unique": 0, "duplicates": 0, "late_merges": 0, "replays": 0, "evicted": 0, "nonces_evicted": 0}
+
+    def key_for(self, record: dict) -> Optional[tuple]:
+        data = record["data"]
+        packet_id = data.get("packet_id")
+        if packet_id is None:
+            packet_id = data.get("nonce")
+        if packet_id is None:
+            return None
+        return (data.get("source_addr") or record["node_uuid"], packet_id)
+
+    def _expire(self, now: float):
+        while self._entries:
+            entry = next(iter(self._entries.values()))
+            if now - entry.first_seen <= self.window_s and len(self._entries) <= self.max_entries:
+                break
+            self._entries.popitem(last=False)
+            if now - entry.first_seen <= self.window_s:
+                self.stats["evicted"] += 1
+        while self._nonces:
+            _, seen_at = next(iter(self._nonces.values()))
+            if now - seen_at <= self.nonce_window_s and len(self._nonces) <= self.max_nonces:
+                break
+            self._nonces.popitem(last=False)
+            if now - seen_at <= self.nonce_window_s:
+                self.stats["nonces_evicted"] += 1 # Size cap hit: replays of these are no longer caught
+
+    def _is_replay(self, record: dict, key: Optional[tuple], now: float) -> bool:
+        data = record["data"]
+        sent_at = data.get("ts")
+        if sent_at is not None:
+            try:
+                sent_at = float(sent_at)
+            except (TypeError, ValueError):
+                return True
+            if abs(time.time() - sent_at) > self.replay_window_s:
+                return True
+        nonce = data.get("nonce")
+        if nonce is None:
+            return False
+        nonce_key = (data.get("source_addr") or record["node_uuid"], nonce)
+        seen = self._nonces.get(nonce_key)
+        if seen is not None:
+            # The same nonce on the same packet is a relayed copy while the merge window is open;
+            # on another packet, or after that, it is a replay
+            return seen[0] != key or now - seen[1] > self.window_s
+        self._nonces[nonce_key] = (key, now)
+        return False
+
+    def filter_batch(self, records: List[dict], now: float = None) -> Tuple[List[dict], Dict[tuple, dict], List[dict]]:
+        # Returns (records to insert, {key: row update} for duplicates of packets already written,
+        # the duplicate copies themselves: each is still a distinct node -> gateway link for the topology)
+        now = now or time.monotonic()
+        unique = []
+        updates = {}
+        copies = []
+        with self._lock:
+            self._expire(now)
+            for record in records:
+                key = self.key_for(record)
+                if self._is_replay(record, key, now):
+                    self.stats["replays"] += 1
+                    continue
+                data = record["data"]
+                gateway = data.get("gateway_id")
+                if key is None:
+                    record["gateways"] = [gateway] if gateway else []
+                    unique.append(record)
+                    continue
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self.stats["duplicates"] += 1
+                    copies.append(record)
+                    if entry.merge(data, gateway) and entry.row is not None:
+                        packet_id, timestamp = entry.row
+                        updates[key] = {"id": packet_id, "timestamp": timestamp, "snr": entry.snr, "rssi": entry.rssi, "gateways": list(entry.gateways)}
+                    continue
+                record["gateways"] = [gateway] if gateway else []
+                self._entries[key] = DedupEntry(now, record)
+                self.stats["unique"] += 1
+                unique.append(record)
+            self.stats["late_merges"] += len(updates)
+        return unique, updates, copies
+
+    def bind(self, records: List[dict], packets: List[dict]):
+        # Remember where each written packet landed so late copies can update it
+        with self._lock:
+            for record, packet in zip(records, packets):
+                entry = self._entries.get(self.key_for(record))
+                if entry is not None and entry.record is record:
+                    entry.row = (packet["id"], packet["timestamp"])
+                    entry.record = None
+
+    def forget(self, records: List[dict]):
+        # The batch was not written: later copies must be treated as new packets
+        with self._lock:
+            for record in records:
+                key = self.key_for(record)
+                entry = self._entries.get(key)
+                if entry is not None and entry.record is record:
+                    del self._entries[key]
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self._entries)
+            stats["nonces"] = len(self._nonces)
+        stats["window_s"] = self.window_s
+        stats["nonce_window_s"] = self.nonce_window_s
+        return stats
+
+packet_deduplicator = PacketDeduplicator()
@@ -0,0 +1,367 @@
+import asyncio
+import datetime
+import os
+import queue
+import threading
+import time
+import zlib
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from .db import crud
+from .db.writer import db_writer
+from .utils.histogram import Histogram
+
+try: # Optional: the TFLite runtime (or full TensorFlow); without it the NumPy fallback runs the models
+    from tflite_runtime.interpreter import Interpreter
+except ImportError:
+    try:
+        import tensorflow as tf
+        Interpreter = tf.lite.Interpreter
+    except ImportError:
+        Interpreter = None
+
+# Inference service settings
+AI_MODELS_DIR = os.environ.get("AI_MODELS_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ai_models"))
+INFERENCE_MAX_BATCH = int(os.environ.get("INFERENCE_MAX_BATCH", 64))
+INFERENCE_MAX_WAIT_MS = float(os.environ.get("INFERENCE_MAX_WAIT_MS", 2.0)) # How long a request waits for others to share its invocation
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", 1)) # Per model; each worker owns one interpreter
+INFERENCE_THREADS = int(os.environ.get("INFERENCE_THREADS", 1)) # CPU threads per interpreter
+INFERENCE_QUEUE_SIZE = int(os.environ.get("INFERENCE_QUEUE_SIZE", 10000))
+INFERENCE_LOG_FLUSH_INTERVAL_MS = int(os.environ.get("INFERENCE_LOG_FLUSH_INTERVAL_MS", 1000))
+INFERENCE_INGEST_INTERVAL_S = float(os.environ.get("INFERENCE_INGEST_INTERVAL_S", 300)) # power_optimizer runs per node at most this often
+
+# Model inputs, in order, and the range each raw value is scaled from into [0, 1]
+MODEL_FEATURES = {
+    "routing_predictor": ("snr", "rssi", "hop_count", "packets"), # One candidate link -> link quality
+    "power_optimizer": ("snr", "rssi", "tx_power", "hop_count"), # One node -> how much TX power it needs
+}
+FEATURE_RANGES = {"snr": (-20.0, 12.0), "rssi": (-130.0, -40.0), "hop_count": (0.0, 8.0), "packets": (0.0, 100.0), "tx_power": (2.0, 20.0)}
+TX_POWER_MIN, TX_POWER_MAX = FEATURE_RANGES["tx_power"]
+
+def features(model_name: str, values: dict) -> List[float]:
+    # Missing values sit mid-range rather than at an extreme
+    row = []
+    for name in MODEL_FEATURES[model_name]:
+        value = values.get(name)
+        low, high = FEATURE_RANGES[name]
+        row.append(0.5 if value is None else min(1.0, max(0.0, (float(value) - low) / (high - low))))
+    return row
+
+def describe_power(score: float) -> dict:
+    return {"score": round(score, 4), "recommended_tx_power": int(round(TX_POWER_MIN + score * (TX_POWER_MAX - TX_POWER_MIN)))}
+
+class NumpyModel:
+    """CPU fallback with the shipped models' architecture: Dense(10, relu) -> Dense(1, sigmoid).
+
+    Weights come from <model>.npz next to the .tflite file when present,
+    otherwise from a fixed Glorot-uniform initialisation seeded by the model
+    name, so results are stable across restarts.
+    """
+
+    backend = "numpy"
+
+    def __init__(self, name: str, inputs: int, hidden: int = 10, weights_path: str = None):
+        if weights_path and os.path.exists(weights_path):
+            weights = np.load(weights_path)
+            self.w1, self.b1, self.w2, self.b2 = (weights[key].astype(np.float32) for key in ("w1", "b1", "w2", "b2"))
+        else:
+            rng = np.random.default_rng(zlib.crc32(name.encode()))
+            limit1, limit2 = np.sqrt(6 / (inputs + hidden)), np.sqrt(6 / (hidden + 1))
+            self.w1 = rng.uniform(-limit1, limit1, (inputs, hidden)).astype(np.float32)
+            self.b1 = np.zeros(hidden, dtype=np.float32)
+            self.w2 = rng.uniform(-limit2, limit2, (hidden, 1)).astype(np.float32)
+            self.b2 = np.zeros(1, dtype=np.float32)
+
+    def __call__(self, x: np.ndarray) -> np.ndarray:
+        hidden = np.maximum(x @ self.w1 + self.b1, 0.0)
+        return 1.0 / (1.0 + np.exp(-(hidden @ self.w2 + self.b2)))
+
+class TFLiteModel:
+    """One TFLite interpreter (not thread-safe, so each worker owns one).
+
+    Batches are padded to the next power of two so the input tensor is only
+    resized and reallocated for a handful of shapes.
+    """
+
+    backend = "tflite"
+
+    def __init__(self, path: str, threads: int = INFERENCE_THREADS):
+        self.interpreter = Interpreter(model_path=path, num_threads=threads)
+        self.interpreter.allocate_tensors()
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+        self.batch = int(self.input["shape"][0])
+
+    def __call__(self, x: np.ndarray) -> np.ndarray:
+        rows = len(x)
+        padded = 1 << (rows - 1).bit_length()
+        if padded != self.batch:
+            self.interpreter.resize_tensor_input(self.input["index"], [padded, x.shape[1]])
+            self.interpreter.allocate_tensors()
+            self.batch = padded
+        if padded != rows:
+            x = np.concatenate([x, np.zeros((padded - rows, x.shape[1]), dtype=x.dtype)])
+        self.interpreter.set_tensor(self.input["index"], x.astype(self.input["dtype"], copy=False))
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output["index"])[:rows].copy()
+
+def load_model(name: str, models_dir: str = AI_MODELS_DIR):
+    path = os.path.join(models_dir, f"{name}.tflite")
+    if Interpreter is not None:
+        try:
+            return TFLiteModel(path)
+        except (ValueError, RuntimeError, OSError) as e:
+            print(f"Cannot load {path} with TFLite ({e}), using the NumPy fallback")
+    return NumpyModel(name, len(MODEL_FEATURES[name]), weights_path=os.path.join(models_dir, f"{name}.npz"))
+
+class InferenceQueueFull(RuntimeError):
+    pass
+
+class InferenceRequest:
+    __slots__ = ("features", "future", "enqueued_at", "node_id", "describe", "log")
+
+    def __init__(self, features: Sequence[float], node_id: Optional[str], describe: Optional[Callable[[float], dict]], log: bool):
+        self.features = features
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+        self.node_id = node_id
+        self.describe = describe
+        self.log = log
+
+class InferenceService:
+    """Micro-batched model inference shared by the API and the ingest path.
+
+    Callers on any thread submit one feature row and get a Future. Each model
+    has a request queue drained by INFERENCE_WORKERS threads, each owning its
+    own interpreter: a worker takes the first waiting request, gathers
+    whatever else arrives within max_wait_ms (up to max_batch rows) and runs
+    them as one vectorized invocation. Predictions that should be kept are
+    buffered and written to AILog in one batch per flush interval.
+    """
+
+    def __init__(self, models: Sequence[str] = tuple(MODEL_FEATURES), max_batch: int = INFERENCE_MAX_BATCH,
+                 max_wait_ms: float = INFERENCE_MAX_WAIT_MS, workers: int = INFERENCE_WORKERS, models_dir: str = AI_MODELS_DIR,
+                 log_flush_interval_ms: int = INFERENCE_LOG_FLUSH_INTERVAL_MS):
+        self.model_names = list(models)
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.workers = workers
+        self.models_dir = models_dir
+        self.log_flush_interval = log_flush_interval_ms / 1000.0
+        self.queues: Dict[str, queue.Queue] = {name: queue.Queue(maxsize=INFERENCE_QUEUE_SIZE) for name in self.model_names}
+        self.backends: Dict[str, str] = {}
+        self._threads: List[threading.Thread] = []
+        self._stop = threading.Event()
+        self._start_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._logs: List[dict] = []
+        self._last_log_flush = time.monotonic()
+        self._ingest_scored: Dict[str, float] = {} # node -> last power_optimizer run from ingest
+        self.latency_ms = {name: Histogram.exponential(0.05, 1.5, 30) for name in self.model_names} # Submit to result
+        self.invoke_ms = {name: Histogram.exponential(0.01, 1.5, 30) for name in self.model_names}
+        self.batch_sizes = {name: Histogram([2 ** i for i in range(max_batch.bit_length())]) for name in self.model_names}
+        self.stats = {"requests": 0, "invocations": 0, "rejected": 0, "errors": 0, "ai_logs_written": 0}
+
+    def start(self):
+        with self._start_lock:
+            if self._threads:
+                return
+            self._stop.clear()
+            for name in self.model_names:
+                for i in range(self.workers):
+                    model = load_model(name, self.models_dir) # One interpreter per worker
+                    self.backends[name] = model.backend
+                    thread = threading.Thread(target=self._run, args=(name, model), name=f"inference-{name}-{i}", daemon=True)
+                    thread.start()
+                    self._threads.append(thread)
+            print(f"Inference service: {', '.join(f'{name} ({backend})' for name, backend in self.backends.items())}")
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        self.flush_logs()
+
+    def submit(self, model_name: str, features: Sequence[float], node_id: str = None, describe: Callable[[float], dict] = None,
+               log: bool = False, block: bool = True) -> Future:
+        # Result: the model's score in [0, 1]. log=True also records describe(score) (or the score) in AILog.
+        # block=False rejects instead of waiting when the queue is full (ingest must not stall on inference).
+        if not self._threads:
+            self.start()
+        request = InferenceRequest(features, node_id, describe, log)
+        try:
+            self.queues[model_name].put(request, block=block)
+        except queue.Full:
+            with self._lock:
+                self.stats["rejected"] += 1
+            request.future.set_exception(InferenceQueueFull(f"Inference queue for {model_name} is full"))
+        return request.future
+
+    def predict(self, model_name: str, features: Sequence[float], **kwargs) -> float:
+        return self.submit(model_name, features, **kwargs).result()
+
+    async def predict_async(self, model_name: str, features: Sequence[float], **kwargs) -> float:
+        # Called on the event loop: a full queue raises InferenceQueueFull rather than blocking the loop
+        kwargs.setdefault("block", False)
+        return await asyncio.wrap_future(self.submit(model_name, features, **kwargs))
+
+    async def predict_many_async(self, model_name: str, rows: Sequence[Sequence[float]], **kwargs) -> List[float]:
+        # Submitted back to back, so they land in the same invocation (together with anyone else's)
+        kwargs.setdefault("block", False)
+        futures = [asyncio.wrap_future(self.submit(model_name, row, **kwargs)) for row in rows]
+        return list(await asyncio.gather(*futures))
+
+    def log(self, node_id: str, model_name: str, prediction: dict):
+        # Record a derived result (e.g. an optimized route) through the same AILog batches
+        with self._lock:
+            self._logs.append({"node_id": node_id, "model_name": model_name, "prediction": prediction, "timestamp": datetime.datetime.utcnow()})
+
+    def _next_batch(self, requests: queue.Queue) -> List[InferenceRequest]:
+        try:
+            batch = [requests.get(timeout=0.25)]
+        except queue.Empty:
+            return []
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(requests.get_nowait()) # Already waiting: no reason to sleep
+                continue
+            except queue.Empty:
+                pass
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self, model_name: str, model):
+        requests = self.queues[model_name]
+        while not self._stop.is_set() or not requests.empty():
+            try:
+                batch = self._next_batch(requests)
+                if batch:
+                    self._invoke(model_name, model, batch)
+                if time.monotonic() - self._last_log_flush >= self.log_flush_interval:
+                    self.flush_logs()
+            except Exception as e:
+                # This is the model's only worker: never let one bad batch take it down
+                print(f"Inference worker for {model_name} failed a batch: {e}")
+
+    def _invoke(self, model_name: str, model, batch: List[InferenceRequest]):
+        # Claim the futures first: callers that gave up (cancelled awaits) are dropped, and the rest can no longer be cancelled
+        batch = [request for request in batch if request.future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        x = np.asarray([request.features for request in batch], dtype=np.float32)
+        started = time.perf_counter()
+        try:
+            scores = model(x)[:, 0].tolist()
+        except Exception as e:
+            with self._lock:
+                self.stats["errors"] += len(batch)
+            for request in batch:
+                request.future.set_exception(e)
+            return
+        finished = time.perf_counter()
+        now = datetime.datetime.utcnow()
+        logs = []
+        for request, score in zip(batch, scores):
+            request.future.set_result(score)
+            if request.log:
+                try:
+                    prediction = request.describe(score) if request.describe else {"score": round(score, 4)}
+                except Exception as e:
+                    print(f"Error describing {model_name} prediction for {request.node_id}: {e}")
+                    prediction = {"score": round(score, 4)}
+                logs.append({"node_id": request.node_id, "model_name": model_name, "prediction": prediction, "timestamp": now})
+        with self._lock:
+            self.stats["requests"] += len(batch)
+            self.stats["invocations"] += 1
+            self.invoke_ms[model_name].record((finished - started) * 1000)
+            self.batch_sizes[model_name].record(len(batch))
+            latency = self.latency_ms[model_name]
+            for request in batch:
+                latency.record((finished - request.enqueued_at) * 1000)
+            self._logs.extend(logs)
+
+    def flush_logs(self) -> int:
+        with self._lock:
+            rows, self._logs = self._logs, []
+            self._last_log_flush = time.monotonic()
+        if not rows:
+            return 0
+        try:
+            db_writer.submit(crud.create_ai_logs, rows) # Fire and forget: inference never waits on the database
+        except Exception as e:
+            print(f"Error queueing {len(rows)} AI log rows: {e}")
+            return 0
+        with self._lock:
+            self.stats["ai_logs_written"] += len(rows)
+        return len(rows)
+
+    def observe_batch(self, records: List[dict]):
+        # Ingest path: score each node's TX power from its latest packet, at most once per INFERENCE_INGEST_INTERVAL_S
+        now = time.monotonic()
+        latest = {record["node_uuid"]: record["data"] for record in records}
+        for node_uuid, data in latest.items():
+            if now - self._ingest_scored.get(node_uuid, -INFERENCE_INGEST_INTERVAL_S) < INFERENCE_INGEST_INTERVAL_S:
+                continue
+            self._ingest_scored[node_uuid] = now
+            self.submit("power_optimizer", features("power_optimizer", data), node_id=node_uuid, describe=describe_power, log=True, block=False)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["models"] = {name: {
+                "backend": self.backends.get(name),
+                "queue_depth": self.queues[name].qsize(),
+                "latency_ms": self.latency_ms[name].snapshot(),
+                "invoke_ms": self.invoke_ms[name].snapshot(),
+                "batch_size": self.batch_sizes[name].snapshot(),
+            } for name in self.model_names}
+            stats["pending_ai_logs"] = len(self._logs)
+        stats["max_batch"] = self.max_batch
+        stats["max_wait_ms"] = self.max_wait * 1000
+        stats["tflite_available"] = Interpreter is not None
+        return stats
+
+inference_service = InferenceService()
+
+# Benchmark: many concurrent single-row requests, micro-batched versus one invocation per request
+def run_benchmark(requests: int = 20000, concurrency: int = 256) -> Dict[str, dict]:
+    import random
+
+    async def drive(service: InferenceService):
+        rows = [[random.random() for _ in range(4)] for _ in range(requests)]
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(row):
+            async with semaphore:
+                return await service.predict_async("routing_predictor", row)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(row) for row in rows))
+        return time.perf_counter() - started
+
+    results = {}
+    for label, max_batch in (("unbatched", 1), ("micro-batched", INFERENCE_MAX_BATCH)):
+        service = InferenceService(models=("routing_predictor",), max_batch=max_batch)
+        service.start()
+        elapsed = asyncio.run(drive(service))
+        service.stop()
+        stats = service.get_stats()["models"]["routing_predictor"]
+        results[label] = {"requests_per_s": round(requests / elapsed), "latency_p50_ms": stats["latency_ms"]["p50"],
+                          "latency_p99_ms": stats["latency_ms"]["p99"], "mean_batch": stats["batch_size"]["mean"],
+                          "backend": stats["backend"]}
+    return results
+
+if __name__ == "__main__":
+    for label, result in run_benchmark().items():
+        print(f"{label:>14}: {result}")
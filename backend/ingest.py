@@ -0,0 +1,176 @@
+import datetime
+import os
+import queue
+import threading
+import time
+
+from .db import crud
+from .db.writer import db_writer
+from .db.partitions import packet_partitioner
+from .rollups import link_rollups, ROLLUP_FLUSH_INTERVAL_S
+from .dedup import packet_deduplicator
+from .inference import inference_service
+from .anomaly_detector import anomaly_detector
+from .mesh_logic.topology import mesh_topology
+
+# Ingest pipeline settings
+INGEST_QUEUE_SIZE = int(os.environ.get("INGEST_QUEUE_SIZE", 10000))
+INGEST_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", 500))
+INGEST_FLUSH_INTERVAL_MS = int(os.environ.get("INGEST_FLUSH_INTERVAL_MS", 250))
+INGEST_ENQUEUE_TIMEOUT_MS = int(os.environ.get("INGEST_ENQUEUE_TIMEOUT_MS", 50))
+PACKET_RETENTION_CHECK_S = int(os.environ.get("PACKET_RETENTION_CHECK_S", 3600))
+
+class IngestPipeline:
+    """Bounded queue between the MQTT callback and the DB writer thread.
+
+    Producers call submit() and never touch the database. The ingest thread
+    drains the queue into batches of up to batch_size records (or whatever
+    arrived within flush_interval_ms) and hands each batch to db_writer, which
+    persists it in one transaction.
+    """
+
+    def __init__(self, maxsize=INGEST_QUEUE_SIZE, batch_size=INGEST_BATCH_SIZE,
+                 flush_interval_ms=INGEST_FLUSH_INTERVAL_MS, enqueue_timeout_ms=INGEST_ENQUEUE_TIMEOUT_MS):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.enqueue_timeout = enqueue_timeout_ms / 1000.0
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.stats = {
+            "enqueued": 0,
+            "dropped": 0, # Rejected because the queue stayed full for enqueue_timeout_ms
+            "blocked": 0, # Producer had to wait for room in the queue
+            "written": 0,
+            "failed": 0,
+            "duplicates": 0, # Copies folded into an earlier packet (or rejected as replays)
+            "batches": 0,
+            "last_batch_size": 0,
+            "last_flush_ms": 0.0,
+            "max_queue_depth": 0,
+        }
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self.stats[key] += amount
+
+    def submit(self, record: dict) -> bool:
+        # Called from the MQTT network thread, so never block it for long
+        record.setdefault("received_at", datetime.datetime.utcnow())
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self._count("blocked")
+            try:
+                self.queue.put(record, timeout=self.enqueue_timeout)
+            except queue.Full:
+                self._count("dropped")
+                return False
+        with self._lock:
+            self.stats["enqueued"] += 1
+            depth = self.queue.qsize()
+            if depth > self.stats["max_queue_depth"]:
+                self.stats["max_queue_depth"] = depth
+        return True
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="ingest-batcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _next_batch(self) -> list:
+        try:
+            batch = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        # Keep draining after stop() is requested so queued packets are not lost
+        next_retention = time.monotonic()
+        next_rollup_flush = time.monotonic() + ROLLUP_FLUSH_INTERVAL_S
+        while not self._stop.is_set() or not self.queue.empty():
+            batch = self._next_batch()
+            if batch:
+                self.flush(batch)
+            if time.monotonic() >= next_rollup_flush:
+                self.flush_rollups()
+                next_rollup_flush = time.monotonic() + ROLLUP_FLUSH_INTERVAL_S
+            # Retention goes through the same writer queue so dropping partitions never races an insert
+            if time.monotonic() >= next_retention:
+                self.drop_expired_partitions()
+                next_retention = time.monotonic() + PACKET_RETENTION_CHECK_S
+        self.flush_rollups()
+
+    def flush_rollups(self):
+        try:
+            db_writer.run(link_rollups.flush)
+        except Exception as e:
+            print(f"Error flushing packet rollups: {e}")
+
+    def drop_expired_partitions(self):
+        try:
+            dropped = db_writer.run(packet_partitioner.drop_expired)
+            if dropped:
+                print(f"Dropped expired packet partitions: {', '.join(dropped)}")
+        except Exception as e:
+            print(f"Error applying packet retention: {e}")
+
+    def flush(self, batch: list):
+        started = time.perf_counter()
+        records, updates, copies = packet_deduplicator.filter_batch(batch)
+        self._count("duplicates", len(batch) - len(records))
+        try:
+            if records:
+                packets = db_writer.run(crud.ingest_packet_batch, records)
+                packet_deduplicator.bind(records, packets)
+                inference_service.observe_batch(records)
+                anomaly_detector.observe_batch(records)
+            self._count("written", len(records))
+        except Exception as e:
+            print(f"Error writing ingest batch of {len(records)} packets: {e}")
+            packet_deduplicator.forget(records)
+            self._count("failed", len(records))
+        try:
+            if updates:
+                db_writer.run(crud.merge_duplicate_packets, list(updates.values()))
+        except Exception as e:
+            print(f"Error merging {len(updates)} duplicate packets: {e}")
+        if copies:
+            # Not stored, but the link to each extra gateway that heard the packet is real
+            mesh_topology.observe_batch(copies)
+        with self._lock:
+            self.stats["batches"] += 1
+            self.stats["last_batch_size"] = len(batch)
+            self.stats["last_flush_ms"] = round((time.perf_counter() - started) * 1000, 3)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+        stats["queue_depth"] = self.queue.qsize()
+        stats["queue_capacity"] = self.queue.maxsize
+        stats["batch_size"] = self.batch_size
+        stats["flush_interval_ms"] = self.flush_interval * 1000
+        stats["dedup"] = packet_deduplicator.get_stats()
+        stats["writer"] = db_writer.get_stats()
+        return stats
+
+ingest_pipeline = IngestPipeline()
@@ -0,0 +1,377 @@
+import datetime
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import zlib
+from typing import Callable, List, Optional
+
+import paho.mqtt.client as mqtt
+
+from .mesh_logic.mesh_parser import HEADER_OFFSET, is_frame
+from .uplink import decode_uplink, decode_uplinks
+
+# Sharded ingest settings
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", 0)) # 0 keeps the single in-process MQTT client
+INGEST_SHARDING = os.environ.get("INGEST_SHARDING", "shared") # "shared" (MQTT v5 shared subscription) or "hash" (by frame source / topic segment)
+INGEST_SHARE_GROUP = os.environ.get("INGEST_SHARE_GROUP", "novacomm")
+INGEST_WORKER_BATCH = int(os.environ.get("INGEST_WORKER_BATCH", 256)) # Events per IPC message
+INGEST_WORKER_FLUSH_MS = int(os.environ.get("INGEST_WORKER_FLUSH_MS", 20)) # Longest an event waits in its worker
+INGEST_WORKER_BUFFER = int(os.environ.get("INGEST_WORKER_BUFFER", 50000)) # Events a worker holds while its send queue is full
+INGEST_IPC_QUEUE_SIZE = int(os.environ.get("INGEST_IPC_QUEUE_SIZE", 1024)) # Batches a worker queues for its pipe before holding them back
+INGEST_WORKER_HEARTBEAT_S = float(os.environ.get("INGEST_WORKER_HEARTBEAT_S", 1.0)) # Worker counters report interval
+INGEST_WORKER_STALL_S = float(os.environ.get("INGEST_WORKER_STALL_S", 15)) # Heartbeat stamp this old: kill and restart
+INGEST_RESTART_BACKOFF_MAX_S = float(os.environ.get("INGEST_RESTART_BACKOFF_MAX_S", 30))
+INGEST_HEALTHY_AFTER_S = 60 # A worker up this long resets its restart backoff
+LAG_EWMA_ALPHA = 0.1
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+def shard_of(node_uuid: str, shards: int) -> int:
+    return zlib.crc32(node_uuid.encode()) % shards
+
+def shard_key(topic: str, payload: bytes) -> str:
+    # What hash sharding partitions on, read without decoding: a raw frame's source address (the
+    # node uuid decoding would give), else the topic's node/gateway segment. Every message maps to
+    # exactly one worker, which is all the split needs; dedup and writes happen downstream anyway.
+    if is_frame(payload):
+        return payload[HEADER_OFFSET:HEADER_OFFSET + 4].hex()
+    parts = topic.split('/')
+    return parts[1] if len(parts) >= 2 else topic
+
+def synthetic_uplinks(count: int, shard: int = 0, nodes: int = 2000):
+    # (topic, payload) pairs for the benchmark: JSON telemetry and raw frames, half each
+    from .mesh_logic.mesh_parser import build_frame
+    for i in range(count):
+        node = (i * 7919 + shard) % nodes
+        if i % 2:
+            yield f"novacomm/gw{node % 4}/rx", build_frame(node, 0, i & 0xFFFF, os.urandom(24), hop_count=1)
+        else:
+            yield f"novacomm/node_{node}/rx", json.dumps({"uuid": f"node_{node}", "payload": "00" * 24, "packet_id": i,
+                                                          "snr": 7.5, "rssi": -92, "hop_count": 1}).encode()
+
+def run_worker(shard: int, shards: int, sharding: str, topic: str, host: str, port: int, out, stop_flag, heartbeat, synthetic: int = 0):
+    # Worker process: subscribe, batch-decode and ship events to the writer process over `out` (its own pipe)
+    stats = {"received": 0, "decoded": 0, "errors": 0, "foreign": 0, "dropped": 0, "batches": 0}
+    raw: List[tuple] = [] # (topic, payload, received_ts) as received, decoded together on the next flush
+    buffer: List[tuple] = [] # (event, received_ts) waiting for room in the send queue
+    lock = threading.Lock()
+    outbox = queue.Queue(maxsize=INGEST_IPC_QUEUE_SIZE) # Pipe writes block when the parent is behind; only this thread waits
+
+    def send():
+        while True:
+            message = outbox.get()
+            if message is None:
+                return
+            try:
+                out.send(message)
+            except (OSError, ValueError): # Parent gone
+                return
+
+    def handle(topic: str, payload: bytes):
+        received_ts = time.time()
+        if sharding == "hash" and shard_of(shard_key(topic, payload), shards) != shard:
+            stats["foreign"] += 1 # Another worker's message: skipped before any decoding
+            return
+        with lock:
+            stats["received"] += 1
+            if len(raw) + len(buffer) >= INGEST_WORKER_BUFFER:
+                stats["dropped"] += 1
+                return
+            raw.append((topic, payload, received_ts))
+
+    def decode(messages: List[tuple]) -> List[tuple]:
+        events = []
+        for event, (_, _, received_ts) in zip(decode_uplinks([(topic, payload) for topic, payload, _ in messages]), messages):
+            if event is None:
+                stats["errors"] += 1
+            else:
+                events.append((event, received_ts))
+        stats["decoded"] += len(events)
+        return events
+
+    def generate():
+        for topic, payload in synthetic_uplinks(synthetic, shard):
+            handle(topic, payload)
+
+    sender = threading.Thread(target=send, daemon=True)
+    sender.start()
+    client = None
+    if synthetic:
+        threading.Thread(target=generate, daemon=True).start()
+    else:
+        client = mqtt.Client(client_id=f"novacomm-ingest-{shard}", protocol=mqtt.MQTTv5)
+        client.on_connect = lambda client, userdata, flags, rc, properties=None: client.subscribe(topic, qos=1)
+        client.on_message = lambda client, userdata, msg: handle(msg.topic, msg.payload)
+        client.connect_async(host, port, 60) # The network thread keeps retrying until the broker is up
+        client.loop_start()
+
+    parent = os.getppid()
+    last_report = 0.0
+    while True:
+        heartbeat.value = time.monotonic() # Liveness goes through shared memory, so backpressure cannot look like a hang
+        time.sleep(INGEST_WORKER_FLUSH_MS / 1000)
+        stopping = bool(stop_flag.value) or os.getppid() != parent
+        with lock:
+            messages = raw[:]
+            del raw[:]
+        decoded = decode(messages) if messages else []
+        with lock:
+            pending = buffer + decoded
+            del buffer[:]
+        sent = 0
+        try:
+            while sent < len(pending):
+                outbox.put(("events", shard, pending[sent:sent + INGEST_WORKER_BATCH]), timeout=1.0)
+                sent += INGEST_WORKER_BATCH
+                stats["batches"] += 1
+                heartbeat.value = time.monotonic()
+        except queue.Full:
+            with lock: # Writer is behind: keep the rest, newest events after it
+                buffer[:0] = pending[sent:]
+        now = time.monotonic()
+        if now - last_report >= INGEST_WORKER_HEARTBEAT_S or stopping:
+            last_report = now
+            try: # Counters for get_stats only; skipped when the queue is full
+                outbox.put_nowait(("stats", shard, {**stats, "buffered": len(raw) + len(buffer), "queued": outbox.qsize(), "pid": os.getpid()}))
+            except queue.Full:
+                pass
+        if stopping:
+            break
+    if client is not None:
+        client.loop_stop()
+        client.disconnect()
+    try:
+        outbox.put(None, timeout=5.0)
+    except queue.Full:
+        pass
+    sender.join(5.0)
+    out.close()
+
+class ShardState:
+    def __init__(self, shard: int):
+        self.shard = shard
+        self.process = None
+        self.heartbeat = None # Shared double the worker stamps with time.monotonic() every loop
+        self.started_at = 0.0
+        self.next_start = 0.0 # Restart backoff
+        self.failures = 0 # Consecutive crashes, for the backoff
+        self.restarts = 0
+        self.last_exitcode = None
+        self.worker_stats: dict = {}
+        self.events = 0
+        self.batches = 0
+        self.lost_events = 0 # Held inside workers that died (buffered or queued for the pipe), per their last report
+        self.truncated_batches = 0 # Cut off mid-send by a worker's death
+        self.lag_ms = 0.0 # EWMA of MQTT receipt -> hand-off to the ingest pipeline
+        self.max_lag_ms = 0.0
+
+class IngestSupervisor:
+    """Runs N ingest worker processes and feeds what they decode into this process.
+
+    Each worker owns an MQTT v5 client on a shared subscription
+    ($share/<group>/<topic>), so the broker spreads uplinks across them, or
+    with INGEST_SHARDING=hash subscribes to everything and keeps only the
+    messages whose frame source address or topic segment hashes to its shard,
+    skipping the rest undecoded (for brokers without shared subscriptions).
+    Decoding happens in the workers; batches of decoded events come back over
+    a pipe per worker and are dispatched here, into the one ingest
+    pipeline, DB writer and WebSocket broadcaster.
+
+    A supervisor thread restarts workers that exit or whose shared-memory
+    heartbeat stops advancing, with exponential backoff. Every worker has its
+    own pipe and drain thread, which reads until the worker's end closes, so
+    batches already sent by a dead worker are still dispatched. Per-shard lag
+    is measured from MQTT receipt in the worker to hand-off here.
+    """
+
+    def __init__(self, workers: int = INGEST_WORKERS, sharding: str = INGEST_SHARDING, share_group: str = INGEST_SHARE_GROUP):
+        if sharding not in ("shared", "hash"):
+            raise ValueError(f"Unknown INGEST_SHARDING {sharding!r}")
+        self.workers = workers
+        self.sharding = sharding
+        self.share_group = share_group
+        self.enabled = workers > 0
+        self.shards = [ShardState(shard) for shard in range(workers)]
+        self.dispatch: Optional[Callable] = None
+        self.synthetic = 0 # Benchmark only: messages each worker generates instead of subscribing
+        self._ctx = multiprocessing.get_context("spawn") # Workers must not inherit the app's threads and DB connections
+        self._stop_flag = None # Shared flag rather than an Event: a killed worker would leave Event.set() waiting on it
+        self._stop = threading.Event() # Supervisor thread
+        self._supervisor = None
+        self._drainers: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._broker = None
+
+    def _spawn(self, state: ShardState):
+        # Each worker gets its own pipe: a worker killed mid-send cannot wedge the others
+        host, port, topic = self._broker
+        if self.sharding == "shared":
+            topic = f"$share/{self.share_group}/{topic}"
+        reader, writer = self._ctx.Pipe(duplex=False)
+        state.heartbeat = self._ctx.RawValue("d", time.monotonic())
+        state.process = self._ctx.Process(target=run_worker, name=f"ingest-worker-{state.shard}", daemon=True,
+                                          args=(state.shard, self.workers, self.sharding, topic, host, port, writer,
+                                                self._stop_flag, state.heartbeat, self.synthetic))
+        state.process.start()
+        writer.close() # Only the worker holds the write end, so its death always reads as EOF, even mid-batch
+        state.started_at = time.monotonic()
+        drainer = threading.Thread(target=self._drain, args=(state, reader), name=f"ingest-ipc-drain-{state.shard}", daemon=True)
+        drainer.start()
+        self._drainers = [thread for thread in self._drainers if thread.is_alive()] + [drainer]
+
+    def start(self, dispatch: Callable, host: str = "localhost", port: int = 1883, topic: str = "novacomm/+/rx"):
+        if self._supervisor is not None:
+            return
+        self.dispatch = dispatch
+        self._broker = (host, port, topic)
+        self._stop_flag = self._ctx.RawValue("b", 0)
+        self._stop.clear()
+        for state in self.shards:
+            self._spawn(state)
+        self._supervisor = threading.Thread(target=self._supervise, name="ingest-supervisor", daemon=True)
+        self._supervisor.start()
+        print(f"Ingest: {self.workers} worker processes, {self.sharding} sharding")
+
+    def _handle(self, message: tuple):
+        kind, shard, body = message
+        state = self.shards[shard]
+        if kind == "stats":
+            with self._lock:
+                state.worker_stats = body
+            return
+        for event, received_ts in body:
+            try:
+                self.dispatch(event, _EPOCH + datetime.timedelta(seconds=received_ts))
+            except Exception as e:
+                print(f"Error dispatching uplink from shard {shard}: {e}")
+        lag_ms = (time.time() - body[0][1]) * 1000 # Oldest event of the batch
+        with self._lock:
+            state.events += len(body)
+            state.batches += 1
+            state.lag_ms = lag_ms if state.batches == 1 else state.lag_ms + LAG_EWMA_ALPHA * (lag_ms - state.lag_ms)
+            state.max_lag_ms = max(state.max_lag_ms, lag_ms)
+
+    def _drain(self, state: ShardState, reader):
+        # One per worker process: runs until that worker's pipe is closed and empty, across its restart
+        while True:
+            try:
+                message = reader.recv()
+            except EOFError: # Worker gone and everything it sent has been read (a half-sent batch ends here too)
+                break
+            except OSError as e: # "got end of file during message": killed mid-send
+                print(f"Ingest shard {state.shard}: worker died mid-batch, dropped it ({e})")
+                with self._lock:
+                    state.truncated_batches += 1
+                break
+            except Exception as e:
+                print(f"Ingest shard {state.shard}: unreadable message from worker: {e}")
+                break
+            self._handle(message)
+        reader.close()
+
+    def _supervise(self):
+        while not self._stop.wait(1.0):
+            now = time.monotonic()
+            for state in self.shards:
+                process = state.process
+                if process is not None and process.is_alive():
+                    silent = now - state.heartbeat.value
+                    if silent > INGEST_WORKER_STALL_S:
+                        print(f"Ingest worker {state.shard} sent no heartbeat for {silent:.0f}s, killing it")
+                        process.kill()
+                        process.join(5)
+                    elif state.failures and now - state.started_at > INGEST_HEALTHY_AFTER_S:
+                        state.failures = 0
+                    if process.is_alive():
+                        continue
+                if process is not None:
+                    state.last_exitcode = process.exitcode
+                    state.process = None
+                    with self._lock:
+                        state.lost_events += state.worker_stats.get("buffered", 0) + state.worker_stats.get("queued", 0) * INGEST_WORKER_BATCH
+                        state.worker_stats = {}
+                    state.failures += 1
+                    state.next_start = now + min(2 ** (state.failures - 1), INGEST_RESTART_BACKOFF_MAX_S)
+                    print(f"Ingest worker {state.shard} exited with code {state.last_exitcode}, restarting in {state.next_start - now:.0f}s")
+                if now >= state.next_start:
+                    state.restarts += 1
+                    self._spawn(state)
+
+    def stop(self, timeout: float = 5.0):
+        if self._supervisor is None:
+            return
+        self._stop.set() # No more restarts
+        self._supervisor.join()
+        self._supervisor = None
+        self._stop_flag.value = 1 # Workers ship what they hold and exit; the drain threads keep reading meanwhile
+        deadline = time.monotonic() + timeout
+        for state in self.shards:
+            if state.process is not None:
+                state.process.join(max(0.0, deadline - time.monotonic()))
+                if state.process.is_alive():
+                    state.process.kill()
+        for drainer in self._drainers: # Each ends at its worker's EOF, after dispatching what was sent
+            drainer.join(max(1.0, deadline - time.monotonic()))
+        self._drainers = []
+
+    def get_stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            shards = [{
+                "shard": state.shard,
+                "pid": state.process.pid if state.process is not None else None,
+                "alive": state.process is not None and state.process.is_alive(),
+                "restarts": state.restarts,
+                "last_exitcode": state.last_exitcode,
+                "heartbeat_age_s": round(now - state.heartbeat.value, 1) if state.heartbeat is not None else None,
+                "events": state.events,
+                "batches": state.batches,
+                "lost_events": state.lost_events,
+                "truncated_batches": state.truncated_batches,
+                "lag_ms": round(state.lag_ms, 3),
+                "max_lag_ms": round(state.max_lag_ms, 3),
+                "worker": state.worker_stats,
+            } for state in self.shards]
+        return {"workers": self.workers, "sharding": self.sharding, "shards": shards}
+
+ingest_supervisor = IngestSupervisor()
+
+def run_benchmark(messages: int = 200_000, worker_counts=(1, 2, 4)):
+    # Decode throughput: in-process (what the single MQTT thread does) vs worker processes shipping over IPC
+    payloads = list(synthetic_uplinks(messages))
+    started = time.perf_counter()
+    for topic, payload in payloads:
+        decode_uplink(topic, payload)
+    print(f"in-process decode: {messages / (time.perf_counter() - started):,.0f} msgs/s")
+    started = time.perf_counter()
+    for i in range(0, messages, INGEST_WORKER_BATCH):
+        decode_uplinks(payloads[i:i + INGEST_WORKER_BATCH])
+    print(f"batched decode ({INGEST_WORKER_BATCH}/flush): {messages / (time.perf_counter() - started):,.0f} msgs/s")
+
+    for workers in worker_counts:
+        received = []
+        supervisor = IngestSupervisor(workers=workers)
+        supervisor.synthetic = messages // workers
+        started = time.perf_counter()
+        supervisor.start(lambda event, received_at: received.append(1))
+        while len(received) < supervisor.synthetic * workers and time.perf_counter() - started < 120:
+            time.sleep(0.01)
+        elapsed = time.perf_counter() - started
+        stats = supervisor.get_stats()
+        print(f"{workers} worker(s): {len(received) / elapsed:,.0f} msgs/s end to end (incl. process start-up), "
+              f"lag ewma {max(shard['lag_ms'] for shard in stats['shards']):.1f} ms, "
+              f"max {max(shard['max_lag_ms'] for shard in stats['shards']):.1f} ms")
+        if workers == worker_counts[-1]:
+            victim = supervisor.shards[0].process
+            victim.kill()
+            time.sleep(3)
+            state = supervisor.get_stats()["shards"][0]
+            print(f"killed worker 0 (pid {victim.pid}): restarts={state['restarts']} alive={state['alive']} "
+                  f"last_exitcode={state['last_exitcode']}")
+        supervisor.stop()
+
+if __name__ == "__main__":
+    run_benchmark()
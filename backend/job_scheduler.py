@@ -0,0 +1,335 @@
+import asyncio
+import datetime
+import heapq
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .db import models
+from .db.database import ReadSessionLocal
+from .db.writer import db_writer
+from .mesh_logic.mode_switcher import switch_node_mode
+from .mesh_logic.route_planner import route_planner
+from .websocket_handler import publish_update
+
+# Job scheduler settings
+JOB_DEFAULT_CONCURRENCY = int(os.environ.get("JOB_DEFAULT_CONCURRENCY", 4))
+JOB_CONCURRENCY = os.environ.get("JOB_CONCURRENCY", "OTA=2,Mode Switch=8,Broadcast=1,Route Optimization=1") # Per job type, "type=limit,..."
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", 3))
+JOB_RETRY_BASE_S = float(os.environ.get("JOB_RETRY_BASE_S", 30)) # Doubles with every attempt
+JOB_RETRY_MAX_S = float(os.environ.get("JOB_RETRY_MAX_S", 3600))
+JOB_TIMEOUT_S = float(os.environ.get("JOB_TIMEOUT_S", 300))
+JOB_STATUS_FLUSH_INTERVAL_MS = int(os.environ.get("JOB_STATUS_FLUSH_INTERVAL_MS", 1000))
+JOB_LOAD_BATCH_SIZE = 5000
+
+PENDING_STATUSES = ("scheduled", "in_progress") # in_progress at startup means the process died mid-job
+
+def parse_concurrency(spec: str) -> Dict[str, int]:
+    limits = {}
+    for item in spec.split(","):
+        if "=" in item:
+            job_type, limit = item.rsplit("=", 1)
+            limits[job_type.strip()] = int(limit)
+    return limits
+
+def _epoch(value: datetime.datetime) -> float:
+    # schedule_time is stored as naive UTC
+    return value.replace(tzinfo=datetime.timezone.utc).timestamp() if value.tzinfo is None else value.timestamp()
+
+def _utc(epoch: float) -> datetime.datetime:
+    return datetime.datetime.utcfromtimestamp(epoch)
+
+class JobFailed(Exception):
+    # Raised by handlers for failures that retrying cannot fix
+    pass
+
+class ScheduledJob:
+    __slots__ = ("id", "job_type", "node_id", "payload", "attempts", "due")
+
+    def __init__(self, id: int, job_type: str, node_id: Optional[str], payload: Optional[dict], attempts: int, due: float):
+        self.id = id
+        self.job_type = job_type
+        self.node_id = node_id
+        self.payload = payload or {}
+        self.attempts = attempts or 0
+        self.due = due
+
+class JobScheduler:
+    """Runs models.Job rows at their schedule_time.
+
+    Pending jobs are loaded once at startup into a min-heap keyed on due time;
+    crud adds and cancels jobs as they are created or deleted, so the table is
+    never polled. The dispatcher sleeps until the earliest due job (or until a
+    new one arrives), moves due jobs into per-type ready queues and starts them
+    up to each type's concurrency limit. Failed jobs are retried with
+    exponential backoff. Status changes are buffered and written back in one
+    bulk UPDATE per flush interval through the DB writer.
+    """
+
+    def __init__(self, concurrency: Dict[str, int] = None, default_concurrency: int = JOB_DEFAULT_CONCURRENCY,
+                 max_attempts: int = JOB_MAX_ATTEMPTS, flush_interval_ms: int = JOB_STATUS_FLUSH_INTERVAL_MS):
+        self.concurrency = concurrency if concurrency is not None else parse_concurrency(JOB_CONCURRENCY)
+        self.default_concurrency = default_concurrency
+        self.max_attempts = max_attempts
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.handlers: Dict[str, Callable[[ScheduledJob], Awaitable[None]]] = {}
+        self._heap: List[tuple] = [] # (due, id, ScheduledJob)
+        self._jobs: Dict[int, ScheduledJob] = {} # Live (not cancelled, not finished) jobs by id
+        self._ready: Dict[str, deque] = {}
+        self._running: Dict[str, int] = {}
+        self._tasks = set()
+        self._pending_status: Dict[int, dict] = {} # id -> fields not yet written back
+        self._lock = threading.Lock() # crud adds/cancels jobs from threadpool and writer threads
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher = None
+        self._flusher = None
+        self.stats = {"loaded": 0, "added": 0, "cancelled": 0, "started": 0, "completed": 0, "failed": 0,
+                      "retried": 0, "status_flushes": 0, "status_rows": 0, "max_start_lag_ms": 0.0}
+
+    def register(self, job_type: str, handler: Callable[[ScheduledJob], Awaitable[None]]):
+        self.handlers[job_type] = handler
+
+    def limit_for(self, job_type: str) -> int:
+        return self.concurrency.get(job_type, self.default_concurrency)
+
+    # Scheduling (any thread)
+
+    def _push(self, job: ScheduledJob):
+        with self._lock:
+            self._jobs[job.id] = job
+            heapq.heappush(self._heap, (job.due, job.id, job))
+        self._wake()
+
+    def add(self, db_job: models.Job):
+        if db_job.status not in PENDING_STATUSES:
+            return
+        with self._lock:
+            self.stats["added"] += 1
+        self._push(ScheduledJob(db_job.id, db_job.job_type, db_job.node_id, db_job.payload, db_job.attempts, _epoch(db_job.schedule_time)))
+
+    def cancel(self, job_id: int):
+        # Heap entries are skipped lazily when popped; a job already running is left to finish
+        with self._lock:
+            if self._jobs.pop(job_id, None) is not None:
+                self.stats["cancelled"] += 1
+            self._pending_status.pop(job_id, None)
+
+    def _wake(self):
+        loop, wakeup = self.loop, self._wakeup
+        if loop is None or wakeup is None or loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            wakeup.set()
+        else:
+            loop.call_soon_threadsafe(wakeup.set)
+
+    def load(self, db: Session) -> int:
+        # Startup: one streamed scan over the (status, schedule_time) index, then a single heapify
+        stmt = (select(models.Job.id, models.Job.job_type, models.Job.node_id, models.Job.payload, models.Job.attempts, models.Job.schedule_time)
+                .where(models.Job.status.in_(PENDING_STATUSES))
+                .execution_options(yield_per=JOB_LOAD_BATCH_SIZE))
+        entries = []
+        for row in db.execute(stmt):
+            job = ScheduledJob(row.id, row.job_type, row.node_id, row.payload, row.attempts, _epoch(row.schedule_time) if row.schedule_time else time.time())
+            entries.append((job.due, job.id, job))
+        with self._lock:
+            for _, job_id, job in entries:
+                self._jobs[job_id] = job
+            self._heap.extend(entries)
+            heapq.heapify(self._heap)
+        self.stats["loaded"] += len(entries)
+        return len(entries)
+
+    # Dispatch (event loop)
+
+    async def start(self):
+        if self._dispatcher is not None:
+            return
+        self.loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        db = ReadSessionLocal()
+        try:
+            loaded = await asyncio.to_thread(self.load, db)
+        finally:
+            db.close()
+        print(f"Job scheduler loaded {loaded} pending jobs")
+        self._dispatcher = asyncio.create_task(self._run())
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        for task in (self._dispatcher, self._flusher):
+            if task is not None:
+                task.cancel()
+        self._dispatcher = self._flusher = None
+        if self._tasks:
+            await asyncio.wait(list(self._tasks), timeout=5)
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            delay = self._dispatch_due()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def _dispatch_due(self) -> Optional[float]:
+        # Returns seconds until the next due job, None if the heap is empty
+        now = time.time()
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                _, job_id, job = heapq.heappop(self._heap)
+                if self._jobs.get(job_id) is not job:
+                    continue # Cancelled, or superseded by a newer entry for the same job
+                self._ready.setdefault(job.job_type, deque()).append(job)
+            next_due = self._heap[0][0] if self._heap else None
+        for job_type, ready in self._ready.items():
+            limit = self.limit_for(job_type)
+            while ready and self._running.get(job_type, 0) < limit:
+                job = ready.popleft()
+                if self._jobs.get(job.id) is not job:
+                    continue
+                self._running[job_type] = self._running.get(job_type, 0) + 1
+                task = asyncio.create_task(self._execute(job))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+        return None if next_due is None else max(0.0, next_due - time.time())
+
+    def _set_status(self, job: ScheduledJob, **fields):
+        with self._lock:
+            self._pending_status.setdefault(job.id, {}).update(fields)
+
+    async def _execute(self, job: ScheduledJob):
+        started = time.time()
+        lag_ms = (started - job.due) * 1000
+        self.stats["started"] += 1
+        self.stats["max_start_lag_ms"] = max(self.stats["max_start_lag_ms"], round(lag_ms, 3))
+        job.attempts += 1
+        self._set_status(job, status="in_progress", attempts=job.attempts)
+        try:
+            handler = self.handlers.get(job.job_type)
+            if handler is None:
+                raise JobFailed(f"No handler for job type {job.job_type!r}")
+            await asyncio.wait_for(handler(job), timeout=JOB_TIMEOUT_S)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            if isinstance(e, JobFailed) or job.attempts >= self.max_attempts:
+                self.stats["failed"] += 1
+                self._finish(job, status="failed", last_error=error, finished_at=datetime.datetime.utcnow())
+            else:
+                # Exponential backoff with +-10% jitter so a failed batch does not retry in lockstep
+                backoff = min(JOB_RETRY_BASE_S * 2 ** (job.attempts - 1), JOB_RETRY_MAX_S) * random.uniform(0.9, 1.1)
+                self._retry(job, time.time() + backoff, error)
+        else:
+            self.stats["completed"] += 1
+            self._finish(job, status="completed", last_error=None, finished_at=datetime.datetime.utcnow())
+        finally:
+            self._running[job.job_type] -= 1
+            self._wakeup.set() # A slot is free for the next ready job of this type
+
+    def _retry(self, job: ScheduledJob, due: float, error: str):
+        with self._lock:
+            if self._jobs.get(job.id) is not job:
+                return
+            job.due = due
+            self.stats["retried"] += 1
+            heapq.heappush(self._heap, (job.due, job.id, job))
+            self._pending_status.setdefault(job.id, {}).update(status="scheduled", schedule_time=_utc(due), last_error=error)
+
+    def _finish(self, job: ScheduledJob, **fields):
+        with self._lock:
+            if self._jobs.get(job.id) is not job:
+                return # Deleted while it ran: there is no row left to update
+            del self._jobs[job.id]
+            self._pending_status.setdefault(job.id, {}).update(fields)
+
+    # Status write-back
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self) -> int:
+        with self._lock:
+            pending, self._pending_status = self._pending_status, {}
+        if not pending:
+            return 0
+        rows = [{"id": job_id, **fields} for job_id, fields in pending.items()]
+        try:
+            await db_writer.run_async(self._write_status, rows)
+        except Exception as e:
+            print(f"Error writing back {len(rows)} job status changes: {e}")
+            with self._lock:
+                for job_id, fields in pending.items():
+                    self._pending_status[job_id] = {**fields, **self._pending_status.get(job_id, {})}
+            return 0
+        self.stats["status_flushes"] += 1
+        self.stats["status_rows"] += len(rows)
+        for row in rows:
+            publish_update("job_update", row)
+        return len(rows)
+
+    @staticmethod
+    def _write_status(db: Session, rows: List[dict]):
+        db.bulk_update_mappings(models.Job, rows)
+        db.commit()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["scheduled"] = len(self._jobs)
+            stats["heap_entries"] = len(self._heap)
+            stats["next_due_in_s"] = round(self._heap[0][0] - time.time(), 3) if self._heap else None
+            stats["pending_status_writes"] = len(self._pending_status)
+        stats["ready"] = {job_type: len(ready) for job_type, ready in self._ready.items() if ready}
+        stats["running"] = {job_type: count for job_type, count in self._running.items() if count}
+        stats["concurrency"] = {job_type: self.limit_for(job_type) for job_type in set(self.concurrency) | set(self._running)}
+        return stats
+
+job_scheduler = JobScheduler()
+
+# Built-in job types
+
+async def run_mode_switch(job: ScheduledJob):
+    mode = job.payload.get("mode")
+    if not job.node_id or not mode:
+        raise JobFailed("Mode Switch jobs need node_id and payload.mode")
+    if not await switch_node_mode(job.node_id, mode):
+        raise RuntimeError(f"Node {job.node_id} did not switch to {mode}")
+
+async def run_ota(job: ScheduledJob):
+    from .ota_manager import ota_manager # ota_manager imports crud, which imports this module
+    version = job.payload.get("firmware_version")
+    if not job.node_id or not version:
+        raise JobFailed("OTA jobs need node_id and payload.firmware_version")
+    if not await ota_manager.deploy_firmware(job.node_id, version):
+        raise JobFailed(f"Firmware {version} is not available")
+
+async def run_broadcast(job: ScheduledJob):
+    # Fan a scheduled message out to dashboard clients (and the node, once downlinks exist)
+    publish_update("broadcast", {"job_id": job.id, "node_id": job.node_id, **job.payload})
+
+async def run_route_optimization(job: ScheduledJob):
+    # Bulk next-hop tables for the whole mesh; payload {"full": true} ignores the incremental state
+    result = await asyncio.to_thread(route_planner.recompute, bool((job.payload or {}).get("full")))
+    publish_update("route_tables", {"job_id": job.id, **result})
+
+job_scheduler.register("Mode Switch", run_mode_switch)
+job_scheduler.register("OTA", run_ota)
+job_scheduler.register("Broadcast", run_broadcast)
+job_scheduler.register("Route Optimization", run_route_optimization)
@@ -0,0 +1,195 @@
+import datetime
+import os
+import threading
+import time
+from typing import Dict
+
+from sqlalchemy.orm import Session
+
+from .db import models
+from .db.writer import db_writer
+from .node_registry import node_registry
+from .utils.timer_wheel import TimerWheel
+from .websocket_handler import publish_update
+
+# Liveness tracker settings
+LIVENESS_TICK_S = float(os.environ.get("LIVENESS_TICK_S", 1.0)) # Sweep, write and broadcast interval
+LIVENESS_TIMEOUT_FACTOR = float(os.environ.get("LIVENESS_TIMEOUT_FACTOR", 3.0)) # Offline after this many missed reports
+LIVENESS_MIN_TIMEOUT_S = float(os.environ.get("LIVENESS_MIN_TIMEOUT_S", 120))
+LIVENESS_MAX_TIMEOUT_S = float(os.environ.get("LIVENESS_MAX_TIMEOUT_S", 3600))
+LIVENESS_DEFAULT_TIMEOUT_S = float(os.environ.get("LIVENESS_DEFAULT_TIMEOUT_S", 900)) # Until a node's report interval is known
+INTERVAL_ALPHA = 0.1
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+def _epoch(value: datetime.datetime) -> float:
+    return (value - _EPOCH).total_seconds() # Naive UTC, as stored
+
+class NodeLiveness:
+    __slots__ = ("last_seen", "interval", "online")
+
+    def __init__(self, last_seen: float, online: bool):
+        self.last_seen = last_seen
+        self.interval = None # EWMA of the gaps between reports while online
+        self.online = online
+
+    def timeout(self) -> float:
+        if self.interval is None:
+            return LIVENESS_DEFAULT_TIMEOUT_S
+        return min(max(LIVENESS_TIMEOUT_FACTOR * self.interval, LIVENESS_MIN_TIMEOUT_S), LIVENESS_MAX_TIMEOUT_S)
+
+class LivenessTracker:
+    """Online/offline status for every node, driven by expected-next-heard deadlines.
+
+    Each report moves the node's deadline on a timer wheel to a few of its
+    usual report intervals ahead; nodes whose deadline passes go offline,
+    and a report from an offline node brings it back. Only those transitions
+    are written: once per tick, in one bulk UPDATE, followed by a single
+    node_status broadcast that also carries the last_seen of every node
+    heard during the tick.
+    """
+
+    def __init__(self, tick: float = LIVENESS_TICK_S):
+        self.tick_interval = tick
+        self.wheel = TimerWheel(tick=tick, slots=int(max(LIVENESS_MAX_TIMEOUT_S, LIVENESS_DEFAULT_TIMEOUT_S) / tick) + 1)
+        self._nodes: Dict[str, NodeLiveness] = {}
+        self._transitions: Dict[str, str] = {} # uuid -> new status, waiting for the next tick
+        self._heard: Dict[str, datetime.datetime] = {} # uuid -> last_seen reported since the last tick
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {"heard": 0, "went_online": 0, "went_offline": 0, "ticks": 0, "written": 0, "broadcasts": 0, "last_tick_ms": 0.0}
+
+    def load(self, db: Session):
+        # Arm a deadline for every node the DB thinks is online; stale ones go offline on the first tick
+        with self._lock:
+            for uuid, status, last_seen in db.query(models.Node.uuid, models.Node.status, models.Node.last_seen):
+                seen = _epoch(last_seen) if last_seen else 0.0
+                state = self._nodes[uuid] = NodeLiveness(seen, status == "online")
+                if state.online:
+                    self.wheel.schedule(uuid, seen + state.timeout())
+
+    def heard_batch(self, seen: Dict[str, datetime.datetime]):
+        # uuid -> latest packet time, for nodes already in the registry
+        with self._lock:
+            for uuid, last_seen in seen.items():
+                t = _epoch(last_seen)
+                state = self._nodes.get(uuid)
+                if state is None:
+                    node = node_registry.peek(uuid)
+                    state = self._nodes[uuid] = NodeLiveness(t, node is not None and node["status"] == "online")
+                elif t > state.last_seen:
+                    if state.online:
+                        gap = t - state.last_seen
+                        state.interval = gap if state.interval is None else state.interval + INTERVAL_ALPHA * (gap - state.interval)
+                    state.last_seen = t
+                if not state.online:
+                    state.online = True
+                    self._transitions[uuid] = "online"
+                    self.stats["went_online"] += 1
+                self.wheel.schedule(uuid, state.last_seen + state.timeout())
+                self._heard[uuid] = last_seen
+            self.stats["heard"] += len(seen)
+
+    def forget(self, uuid: str):
+        with self._lock:
+            self._nodes.pop(uuid, None)
+            self._transitions.pop(uuid, None)
+            self._heard.pop(uuid, None)
+            self.wheel.cancel(uuid)
+
+    def sweep(self, now: float = None) -> int:
+        now = now or time.time()
+        with self._lock:
+            expired = self.wheel.advance(now)
+            for uuid, _ in expired:
+                state = self._nodes.get(uuid)
+                if state is not None and state.online:
+                    state.online = False
+                    self._transitions[uuid] = "offline"
+                    self.stats["went_offline"] += 1
+            return len(expired)
+
+    def flush(self) -> int:
+        with self._lock:
+            transitions, self._transitions = self._transitions, {}
+            heard, self._heard = self._heard, {}
+        rows = []
+        for uuid, status in transitions.items():
+            node = node_registry.peek(uuid)
+            if node is not None and node["status"] != status:
+                rows.append({"id": node["id"], "status": status})
+            else:
+                transitions[uuid] = None # Deleted, or flipped back within the tick
+        if rows:
+            try:
+                db_writer.run(self._write, rows)
+            except Exception as e:
+                print(f"Error writing {len(rows)} node status changes: {e}")
+                with self._lock:
+                    for uuid, status in transitions.items():
+                        if status is not None:
+                            self._transitions.setdefault(uuid, status) # Unless newer ones arrived meanwhile
+                    for uuid, last_seen in heard.items():
+                        self._heard.setdefault(uuid, last_seen)
+                return 0
+            for uuid, status in transitions.items():
+                if status is not None:
+                    node_registry.update_fields(uuid, {"status": status})
+        changed = {uuid: status for uuid, status in transitions.items() if status is not None}
+        if changed or heard:
+            publish_update("node_status", {
+                "online": [uuid for uuid, status in changed.items() if status == "online"],
+                "offline": [uuid for uuid, status in changed.items() if status == "offline"],
+                "last_seen": heard,
+            })
+            with self._lock:
+                self.stats["broadcasts"] += 1
+        with self._lock:
+            self.stats["written"] += len(rows)
+        return len(rows)
+
+    @staticmethod
+    def _write(db: Session, rows: list):
+        db.bulk_update_mappings(models.Node, rows)
+        db.commit()
+
+    def tick(self, now: float = None):
+        started = time.perf_counter()
+        self.sweep(now)
+        self.flush()
+        with self._lock:
+            self.stats["ticks"] += 1
+            self.stats["last_tick_ms"] = round((time.perf_counter() - started) * 1000, 3)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="liveness-tracker", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.tick_interval):
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"Liveness tick failed: {e}")
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["nodes"] = len(self._nodes)
+            stats["online"] = sum(1 for state in self._nodes.values() if state.online)
+            stats["timers"] = len(self.wheel)
+            stats["pending_transitions"] = len(self._transitions)
+        return stats
+
+liveness_tracker = LivenessTracker()
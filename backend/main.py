@@ -1,22 +1,35 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException, status
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect, Depends
 from fastapi.responses import HTMLResponse
-from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import timedelta, datetime
-from jose import JWTError, jwt
 import json
 import secrets
-import os
 import asyncio
 import threading
 
-from .db import engine, Base, crud, schemas
-from .api import auth, nodes, packets, mesh, ota, jobs, users
+from .db import schemas
+from .db.database import ReadSessionLocal
+from .db.storage import init_db
+from .db.writer import db_writer
+from .api import auth, nodes, packets, mesh, ota, jobs, users, alerts, ai_logs
+from .api.deps import get_async_db, get_current_user
+from .api.auth import authenticate_user
 from .websocket_handler import manager, broadcast_update
-from .utils.token import ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, create_access_token
+from .utils.token import ACCESS_TOKEN_EXPIRE_MINUTES, create_access_token
+from .auth_cache import auth_cache
+from .utils.hashing import password_hasher
+from .utils.login_throttle import login_throttle
 from .mqtt_bridge import start_mqtt_bridge # Import the MQTT bridge function
-
-Base.metadata.create_all(bind=engine)
+from .ingest import ingest_pipeline
+from .ingest_workers import ingest_supervisor
+from .node_registry import node_registry
+from .liveness import liveness_tracker
+from .job_scheduler import job_scheduler
+from .ota_manager import ota_manager
+from .inference import inference_service
+from .mesh_logic.route_planner import route_planner
+from .anomaly_detector import anomaly_detector
 
 app = FastAPI(
     title="NovaComm++ Dashboard API",
@@ -32,51 +45,8 @@ app.include_router(mesh.router, prefix="/api/mesh", tags=["Mesh"])
 app.include_router(ota.router, prefix="/api/ota", tags=["OTA"])
 app.include_router(jobs.router, prefix="/api/jobs", tags=["Jobs"])
 app.include_router(users.router, prefix="/api/users", tags=["Users"])
-
-# OAuth2 setup
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
-
-# Dependency to get the DB session
-def get_db():
-    db = crud.SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-# Function to authenticate user
-def authenticate_user(db: Session, username: str, password: str):
-    user = crud.get_user_by_username(db, username=username)
-    if not user or not crud.verify_password(password, user.hashed_password):
-        return False
-    return user
-
-# Get SECRET_KEY from environment variable
-# IMPORTANT: Set this environment variable in your deployment environment!
-SECRET_KEY = os.environ.get("NOVCOMM_SECRET_KEY", "super-secret-default-key-please-change-me")
-if SECRET_KEY == "super-secret-default-key-please-change-me":
-    print("WARNING: NOVCOMM_SECRET_KEY environment variable not set. Using a default key. \n"
-          "This is INSECURE for production. Please set NOVCOMM_SECRET_KEY to a strong, random value.")
-
-# Dependency to get current user
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        token_data = schemas.TokenData(username=username)
-    except JWTError:
-        raise credentials_exception
-    user = crud.get_user_by_username(db, username=token_data.username)
-    if user is None:
-        raise credentials_exception
-    return user
+app.include_router(alerts.router, prefix="/api/alerts", tags=["Alerts"])
+app.include_router(ai_logs.router, prefix="/api/ai-logs", tags=["AI Logs"])
 
 @app.get("/")
 def read_root():
@@ -87,22 +57,69 @@ async def websocket_endpoint(websocket: WebSocket):
     await manager.connect(websocket)
     try:
         while True:
-            data = await websocket.receive_text()
-            # You can add logic here to process incoming WebSocket messages if needed
-            # await manager.send_personal_message(f"You wrote: {data}", websocket)
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            # {"action": "subscribe", "types": [...], "nodes": [...]} narrows what this client receives
+            manager.handle_message(websocket, message.get("text") if message.get("text") is not None else message.get("bytes"))
     except WebSocketDisconnect:
         manager.disconnect(websocket)
         print("Client disconnected")
 
+@app.get("/api/ingest/stats", response_model=dict)
+def get_ingest_stats(current_user: schemas.User = Depends(get_current_user)):
+    # Queue depth, batch and backpressure counters for the MQTT ingest pipeline
+    return ingest_pipeline.get_stats()
+
+@app.get("/api/ingest/shards", response_model=dict)
+def get_ingest_shards(current_user: schemas.User = Depends(get_current_user)):
+    # Per-worker liveness, restarts and MQTT-to-pipeline lag when INGEST_WORKERS > 0
+    return ingest_supervisor.get_stats()
+
+@app.get("/api/registry/stats", response_model=dict)
+def get_registry_stats(current_user: schemas.User = Depends(get_current_user)):
+    # Node registry hit/miss counters and write-behind flush lag
+    return node_registry.get_stats()
+
+@app.get("/api/liveness/stats", response_model=dict)
+def get_liveness_stats(current_user: schemas.User = Depends(get_current_user)):
+    # Online count, armed deadlines and batched status transitions
+    return liveness_tracker.get_stats()
+
+@app.get("/api/auth/cache/stats", response_model=dict)
+def get_auth_cache_stats(current_user: schemas.User = Depends(get_current_user)):
+    # Token/principal cache hit counters
+    return auth_cache.get_stats()
+
+@app.get("/api/auth/hashing/stats", response_model=dict)
+def get_password_hashing_stats(current_user: schemas.User = Depends(get_current_user)):
+    # bcrypt pool queueing (pending, wait/run times, rejections) and failed-login throttling
+    return {"hasher": password_hasher.get_stats(), "throttle": login_throttle.get_stats()}
+
+@app.get("/api/scheduler/stats", response_model=dict)
+def get_scheduler_stats(current_user: schemas.User = Depends(get_current_user)):
+    # Scheduled/ready/running jobs per type, retries and status write-back batches
+    return job_scheduler.get_stats()
+
+@app.get("/api/inference/stats", response_model=dict)
+def get_inference_stats(current_user: schemas.User = Depends(get_current_user)):
+    # Per-model queue depth, batch sizes and latency percentiles for on-gateway inference
+    return inference_service.get_stats()
+
+@app.get("/api/anomaly/stats", response_model=dict)
+def get_anomaly_stats(current_user: schemas.User = Depends(get_current_user)):
+    # Tracked nodes, armed silence timers, active alerts per kind and rate-limit suppressions
+    return anomaly_detector.get_stats()
+
+@app.get("/api/ws/stats", response_model=dict)
+def get_websocket_stats(current_user: schemas.User = Depends(get_current_user)):
+    # Fan-out counters: connected clients, dropped messages and slow-client disconnects
+    return manager.get_stats()
+
 @app.post("/token", response_model=schemas.Token)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = authenticate_user(db, form_data.username, form_data.password)
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Incorrect username or password",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+async def login_for_access_token(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    client_ip = request.client.host if request.client else None
+    user = await authenticate_user(db, form_data.username, form_data.password, client_ip)
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
         data={"sub": user.username}, expires_delta=access_token_expires
@@ -111,6 +128,33 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
 
 @app.on_event("startup")
 async def startup_event():
+    # Let sync code (MQTT thread, threadpool endpoints) publish WebSocket updates onto this loop
+    manager.bind_loop(asyncio.get_running_loop())
+    # Create tables (and hypertables on TimescaleDB) before anything touches the database
+    init_db()
+    # All writes are serialized on the DB writer thread
+    db_writer.start()
+    # Warm the node registry and start its write-behind flusher; arm liveness deadlines for online nodes
+    # and anomaly silence timers for every known node
+    db = ReadSessionLocal()
+    try:
+        node_registry.load(db)
+        liveness_tracker.load(db)
+    finally:
+        db.close()
+    anomaly_detector.load(node_registry.last_seen())
+    node_registry.start()
+    liveness_tracker.start()
+    # Load pending jobs into the scheduler's heap and start dispatching
+    await job_scheduler.start()
+    # Resume OTA transfers from their last acked chunk
+    await ota_manager.start()
+    # Load the routing/power models and start their micro-batching workers
+    inference_service.start()
+    # Keep next-hop tables current with incremental recomputes as the topology changes
+    route_planner.start()
+    # Silence timers and batched alert writes for the detector fed by ingest
+    anomaly_detector.start()
     # Start MQTT bridge in a separate thread/task
     print("Starting MQTT bridge on startup...")
     # Use a separate thread for the MQTT client loop to avoid blocking FastAPI's event loop
@@ -121,4 +165,14 @@ async def startup_event():
 @app.on_event("shutdown")
 async def shutdown_event():
     print("Shutting down MQTT bridge...")
-    # You might need to add a way to gracefully stop the MQTT client here
\ No newline at end of file
+    # You might need to add a way to gracefully stop the MQTT client here
+    ingest_supervisor.stop() # Hand events still held by ingest workers to the pipeline
+    ingest_pipeline.stop() # Flush packets still waiting in the ingest queue
+    liveness_tracker.stop() # Write and broadcast transitions from the last tick
+    node_registry.stop() # Write back pending last_seen changes
+    await job_scheduler.stop() # Let running jobs finish briefly and write back their status
+    await ota_manager.stop() # Write back transfer progress; unfinished transfers resume on the next start
+    inference_service.stop() # Drain queued predictions and flush their AI logs
+    route_planner.stop() # Also shuts down its solver processes
+    anomaly_detector.stop() # Queue alerts raised since the last tick
+    db_writer.stop() # Last, once nothing else can submit writes
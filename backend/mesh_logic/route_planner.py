@@ -0,0 +1,383 @@
+import heapq
+import math
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import dijkstra
+except ImportError: # Falls back to a heap Dijkstra per destination
+    csr_matrix = None
+    dijkstra = None
+
+from .topology import MeshTopology, mesh_topology
+
+# Route planner settings
+ROUTE_PLANNER_INTERVAL_S = float(os.environ.get("ROUTE_PLANNER_INTERVAL_S", 30)) # Background incremental refresh
+ROUTE_PLANNER_ALL_PAIRS_MAX_NODES = int(os.environ.get("ROUTE_PLANNER_ALL_PAIRS_MAX_NODES", 4000)) # Above this, only routes to gateways
+ROUTE_PLANNER_PROCESS_MIN_NODES = int(os.environ.get("ROUTE_PLANNER_PROCESS_MIN_NODES", 1000)) # Smaller meshes are solved in-process
+ROUTE_PLANNER_WORKERS = int(os.environ.get("ROUTE_PLANNER_WORKERS", min(4, os.cpu_count() or 1)))
+ROUTE_PLANNER_COST_EPSILON = float(os.environ.get("ROUTE_PLANNER_COST_EPSILON", 0.05)) # Relative cost change that counts as a link change
+
+# Link cost: expected transmissions (1 / delivery ratio), with the delivery ratio estimated from
+# the link SNR (RSSI when no SNR was reported) as a logistic around the demodulation floor
+LINK_SNR_FLOOR_DB = float(os.environ.get("LINK_SNR_FLOOR_DB", -10.0))
+LINK_SNR_SCALE_DB = 2.0
+LINK_RSSI_FLOOR_DBM = float(os.environ.get("LINK_RSSI_FLOOR_DBM", -120.0))
+LINK_RSSI_SCALE_DB = 4.0
+LINK_MIN_DELIVERY = 0.05 # Caps the cost of a barely-working link at 20 transmissions
+LINK_DEFAULT_COST = 2.0 # Link heard but no radio metrics yet
+
+def link_costs(snrs: Sequence[Optional[float]], rssis: Sequence[Optional[float]]) -> np.ndarray:
+    snr = np.array([np.nan if value is None else value for value in snrs], dtype=np.float64)
+    rssi = np.array([np.nan if value is None else value for value in rssis], dtype=np.float64)
+    with np.errstate(invalid="ignore"):
+        delivery = np.where(~np.isnan(snr), 1.0 / (1.0 + np.exp(-(snr - LINK_SNR_FLOOR_DB) / LINK_SNR_SCALE_DB)),
+                            1.0 / (1.0 + np.exp(-(rssi - LINK_RSSI_FLOOR_DBM) / LINK_RSSI_SCALE_DB)))
+    costs = 1.0 / np.maximum(delivery, LINK_MIN_DELIVERY)
+    return np.where(np.isnan(costs), LINK_DEFAULT_COST, costs)
+
+def _heap_trees(n: int, rows: np.ndarray, cols: np.ndarray, costs: np.ndarray, sources: Sequence[int]) -> Tuple[np.ndarray, np.ndarray]:
+    adjacency: List[List[Tuple[int, float]]] = [[] for _ in range(n)]
+    for a, b, cost in zip(rows.tolist(), cols.tolist(), costs.tolist()):
+        adjacency[a].append((b, cost))
+    dist = np.full((len(sources), n), np.inf)
+    pred = np.full((len(sources), n), -9999, dtype=np.int32)
+    for row, source in enumerate(sources):
+        best = dist[row]
+        parent = pred[row]
+        best[source] = 0.0
+        heap = [(0.0, source)]
+        while heap:
+            d, node = heapq.heappop(heap)
+            if d > best[node]:
+                continue
+            for neighbor, cost in adjacency[node]:
+                candidate = d + cost
+                if candidate < best[neighbor]:
+                    best[neighbor] = candidate
+                    parent[neighbor] = node
+                    heapq.heappush(heap, (candidate, neighbor))
+    return dist, pred
+
+def shortest_path_trees(n: int, rows: np.ndarray, cols: np.ndarray, costs: np.ndarray, sources: Sequence[int]) -> Tuple[np.ndarray, np.ndarray]:
+    # One shortest-path tree per source over a symmetric link-cost graph: dist[i, v] and pred[i, v]
+    # (v's neighbour towards sources[i], -9999 when unreachable). Top-level so process pool workers can run it.
+    if dijkstra is None:
+        return _heap_trees(n, rows, cols, costs, sources)
+    graph = csr_matrix((costs, (rows, cols)), shape=(n, n))
+    dist, pred = dijkstra(graph, directed=True, indices=np.asarray(sources, dtype=np.int32), return_predecessors=True)
+    return dist, pred.astype(np.int32, copy=False)
+
+class RoutePlan:
+    """One immutable set of routing tables. Replaced whole, never modified once published."""
+
+    __slots__ = ("node_ids", "index", "gateways", "destinations", "dest_row", "dist", "pred", "version", "computed_at")
+
+    def __init__(self, node_ids: List[str], index: Dict[str, int], gateways: List[int], destinations: List[int],
+                 dist: np.ndarray, pred: np.ndarray, version: Optional[int], computed_at: Optional[float]):
+        self.node_ids = node_ids
+        self.index = index
+        self.gateways = gateways
+        self.destinations = destinations # Node index of each tree
+        self.dest_row = {node: row for row, node in enumerate(destinations)}
+        self.dist = dist
+        self.pred = pred
+        self.version = version # Topology version the tables were computed from
+        self.computed_at = computed_at
+
+EMPTY_PLAN = RoutePlan([], {}, [], [], np.zeros((0, 0)), np.zeros((0, 0), dtype=np.int32), None, None)
+
+class RoutePlanner:
+    """Next-hop tables for the whole mesh, computed from the live topology.
+
+    Links become a symmetric sparse graph weighted by expected transmissions.
+    One shortest-path tree is kept per destination (every node, or only the
+    gateways on very large meshes); since costs are symmetric, a node's
+    predecessor in the tree rooted at d is its next hop towards d.
+
+    recompute() diffs the topology since the last plan and re-solves only the
+    trees a changed link can affect: a cheaper or new link matters to the trees
+    where it would shorten a path, a dearer or removed one only to the trees that
+    use it. Node additions/removals re-solve everything. Large batches of trees
+    are split across a process pool.
+
+    Each recompute builds a new RoutePlan and publishes it with one reference
+    assignment; readers take `plan = self.plan` once and use only that, so
+    they never see the index of one plan with the matrices of another.
+    """
+
+    def __init__(self, topology: MeshTopology = mesh_topology, interval: float = ROUTE_PLANNER_INTERVAL_S,
+                 all_pairs_max_nodes: int = ROUTE_PLANNER_ALL_PAIRS_MAX_NODES, process_min_nodes: int = ROUTE_PLANNER_PROCESS_MIN_NODES,
+                 workers: int = ROUTE_PLANNER_WORKERS, cost_epsilon: float = ROUTE_PLANNER_COST_EPSILON):
+        self.topology = topology
+        self.interval = interval
+        self.all_pairs_max_nodes = all_pairs_max_nodes
+        self.process_min_nodes = process_min_nodes
+        self.workers = workers
+        self.cost_epsilon = cost_epsilon
+        self.plan = EMPTY_PLAN # Published plan; only recompute() replaces it
+        self._measured: Dict[Tuple[str, str], float] = {} # Directed link -> latest cost
+        self._planned: Dict[Tuple[int, int], float] = {} # Undirected edge (low, high index) -> cost the trees were solved with
+        self._lock = threading.Lock() # One plan at a time
+        self._pool = None
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {"full_runs": 0, "incremental_runs": 0, "skipped_runs": 0, "trees_solved": 0, "links_changed": 0,
+                      "links_ignored": 0, "last_run_ms": 0.0, "last_trees_solved": 0}
+
+    def _edges(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        if not self._planned:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32), np.zeros(0)
+        pairs = np.array(list(self._planned), dtype=np.int32)
+        costs = np.fromiter(self._planned.values(), dtype=np.float64, count=len(self._planned))
+        return np.concatenate([pairs[:, 0], pairs[:, 1]]), np.concatenate([pairs[:, 1], pairs[:, 0]]), np.concatenate([costs, costs])
+
+    def _edge_cost(self, a: str, b: str) -> float:
+        # Either direction of a link proves the pair can talk; the better one is used both ways
+        costs = [cost for cost in (self._measured.get((a, b)), self._measured.get((b, a))) if cost is not None]
+        return min(costs) if costs else math.inf
+
+    def _solve(self, n: int, sources: List[int]) -> Tuple[np.ndarray, np.ndarray]:
+        rows, cols, costs = self._edges()
+        if n < self.process_min_nodes or self.workers < 2 or len(sources) < 2 * self.workers:
+            return shortest_path_trees(n, rows, cols, costs, sources)
+        if self._pool is None:
+            # spawn: the API process has live threads (db writer, MQTT) that fork would copy mid-flight
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        chunks = [sources[i::self.workers] for i in range(self.workers)]
+        results = list(self._pool.map(shortest_path_trees, [n] * len(chunks), [rows] * len(chunks), [cols] * len(chunks),
+                                      [costs] * len(chunks), chunks))
+        order = np.argsort(np.concatenate([np.asarray(chunk) for chunk in chunks]), kind="stable")
+        return np.concatenate([dist for dist, _ in results])[order], np.concatenate([pred for _, pred in results])[order]
+
+    def _full(self, snapshot: dict) -> RoutePlan:
+        node_ids = sorted(node["id"] for node in snapshot["nodes"])
+        index = {node_id: i for i, node_id in enumerate(node_ids)}
+        gateways = [index[node["id"]] for node in snapshot["nodes"] if node["group"] == 0]
+        links = [link for link in snapshot["links"] if link["source"] in index and link["target"] in index]
+        costs = link_costs([link["snr"] for link in links], [link["rssi"] for link in links])
+        self._measured = {(link["source"], link["target"]): float(cost) for link, cost in zip(links, costs)}
+        self._planned = {}
+        for a, b in self._measured:
+            i, j = sorted((index[a], index[b]))
+            if i != j:
+                self._planned[(i, j)] = self._edge_cost(a, b)
+        n = len(node_ids)
+        destinations = list(range(n)) if n <= self.all_pairs_max_nodes else list(gateways)
+        dist, pred = self._solve(n, destinations) if destinations else (np.zeros((0, n)), np.zeros((0, n), dtype=np.int32))
+        return RoutePlan(node_ids, index, gateways, destinations, dist, pred, snapshot["version"], time.time())
+
+    def _incremental(self, delta: dict) -> Tuple[RoutePlan, int]:
+        plan = self.plan
+        touched = set()
+        for link in delta["removed_links"]:
+            self._measured.pop((link["source"], link["target"]), None)
+            touched.add((link["source"], link["target"]))
+        if delta["links"]:
+            costs = link_costs([link["snr"] for link in delta["links"]], [link["rssi"] for link in delta["links"]])
+            for link, cost in zip(delta["links"], costs):
+                self._measured[(link["source"], link["target"])] = float(cost)
+                touched.add((link["source"], link["target"]))
+
+        affected = np.zeros(len(plan.destinations), dtype=bool)
+        changed = 0
+        for a, b in touched:
+            u, v = plan.index[a], plan.index[b]
+            if u == v:
+                continue
+            key = (min(u, v), max(u, v))
+            old = self._planned.get(key, math.inf)
+            new = self._edge_cost(a, b)
+            if old == new or (math.isfinite(old) and math.isfinite(new) and abs(new - old) <= self.cost_epsilon * old):
+                self.stats["links_ignored"] += 1 # Jitter: keep solving with the cost the trees were built on
+                continue
+            changed += 1
+            if math.isfinite(new):
+                self._planned[key] = new
+            else:
+                del self._planned[key]
+            if new < old: # Cheaper or new: matters where it would shorten the path to one end
+                with np.errstate(invalid="ignore"):
+                    affected |= np.abs(plan.dist[:, u] - plan.dist[:, v]) > new
+            if new > old: # Dearer or gone: matters only to trees routing over it
+                affected |= (plan.pred[:, v] == u) | (plan.pred[:, u] == v)
+        self.stats["links_changed"] += changed
+
+        rows = np.flatnonzero(affected)
+        dist, pred = plan.dist, plan.pred
+        if len(rows):
+            # Copy, then patch: readers may still be using the published matrices
+            dist, pred = dist.copy(), pred.copy()
+            dist[rows], pred[rows] = self._solve(len(plan.node_ids), [plan.destinations[row] for row in rows])
+        return RoutePlan(plan.node_ids, plan.index, plan.gateways, plan.destinations, dist, pred, delta["version"], time.time()), len(rows)
+
+    def recompute(self, full: bool = False) -> dict:
+        with self._lock:
+            started = time.perf_counter()
+            self.topology.expire() # Without traffic nothing else ages links out, and the version check below would skip
+            current = self.plan
+            delta = None
+            if not full and current.version is not None:
+                if self.topology.version == current.version:
+                    self.stats["skipped_runs"] += 1
+                    return {"version": current.version, "full": False, "trees_solved": 0, "elapsed_ms": 0.0}
+                delta = self.topology.snapshot(since=current.version)
+                # Node set changes renumber the matrices; those (rare) go through a full solve
+                if delta["full"] or delta["removed_nodes"] or any(node["id"] not in current.index for node in delta["nodes"]):
+                    delta = None
+            if delta is None:
+                plan = self._full(self.topology.snapshot())
+                solved = len(plan.destinations)
+                self.stats["full_runs"] += 1
+            else:
+                plan, solved = self._incremental(delta)
+                self.stats["incremental_runs"] += 1
+            self.plan = plan # Publish
+            elapsed_ms = round((time.perf_counter() - started) * 1000, 3)
+            self.stats["trees_solved"] += solved
+            self.stats["last_trees_solved"] = solved
+            self.stats["last_run_ms"] = elapsed_ms
+            return {"version": plan.version, "full": delta is None, "trees_solved": solved, "elapsed_ms": elapsed_ms}
+
+    # Readers: pass `plan` to answer several questions from the same plan
+
+    def next_hop(self, source: str, destination: str, plan: RoutePlan = None) -> Optional[str]:
+        plan = plan or self.plan
+        s, d = plan.index.get(source), plan.index.get(destination)
+        row = plan.dest_row.get(d)
+        if s is None or row is None or s == d:
+            return None
+        hop = plan.pred[row, s]
+        return plan.node_ids[hop] if hop >= 0 else None
+
+    def path(self, source: str, destination: str, plan: RoutePlan = None) -> Optional[List[str]]:
+        plan = plan or self.plan
+        if source == destination:
+            return [source]
+        hops = [source]
+        while hops[-1] != destination and len(hops) <= len(plan.node_ids):
+            hop = self.next_hop(hops[-1], destination, plan)
+            if hop is None:
+                return None
+            hops.append(hop)
+        return hops
+
+    def table(self, node_id: str, plan: RoutePlan = None) -> Optional[Dict[str, dict]]:
+        # A node's routing table: destination -> next hop and path cost, reachable destinations only
+        plan = plan or self.plan
+        s = plan.index.get(node_id)
+        if s is None:
+            return None
+        hops, costs = plan.pred[:, s], plan.dist[:, s]
+        return {plan.node_ids[d]: {"next_hop": plan.node_ids[hops[row]], "cost": round(float(costs[row]), 3)}
+                for row, d in enumerate(plan.destinations) if d != s and hops[row] >= 0}
+
+    def gateway_routes(self, plan: RoutePlan = None) -> Dict[str, dict]:
+        # Every node's best gateway: the nearest one by path cost, with the next hop towards it
+        plan = plan or self.plan
+        gateway_rows = [plan.dest_row[g] for g in plan.gateways if g in plan.dest_row]
+        if not gateway_rows:
+            return {}
+        dist = plan.dist[gateway_rows]
+        nearest = np.argmin(dist, axis=0)
+        cols = np.arange(len(plan.node_ids))
+        costs = dist[nearest, cols]
+        hops = plan.pred[np.asarray(gateway_rows)[nearest], cols]
+        return {plan.node_ids[s]: {"gateway": plan.node_ids[plan.gateways[nearest[s]]], "next_hop": plan.node_ids[hops[s]],
+                                   "cost": round(float(costs[s]), 3)}
+                for s in range(len(plan.node_ids)) if hops[s] >= 0}
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="route-planner", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.recompute()
+            except Exception as e:
+                print(f"Route planner: recompute failed: {e}")
+
+    def get_stats(self, plan: RoutePlan = None) -> dict:
+        plan = plan or self.plan
+        stats = dict(self.stats)
+        stats.update({
+            "version": plan.version,
+            "computed_at": plan.computed_at,
+            "nodes": len(plan.node_ids),
+            "links": len(self._planned),
+            "gateways": len(plan.gateways),
+            "trees": len(plan.destinations),
+            "backend": "scipy" if dijkstra is not None else "heapq",
+            "workers": self.workers,
+        })
+        return stats
+
+route_planner = RoutePlanner()
+
+def synthetic_mesh(nodes: int, gateways: int = 4, radius: float = 0.06, seed: int = 7) -> MeshTopology:
+    # Random geometric mesh on the unit square: nodes in radio range hear each other, SNR falls off with distance
+    rng = np.random.default_rng(seed)
+    topology = MeshTopology(gateway_id="gw0")
+    points = rng.random((nodes, 2))
+    ids = [f"gw{i}" if i < gateways else f"node_{i}" for i in range(nodes)]
+    now = time.monotonic()
+    for i in range(nodes):
+        distance = np.hypot(*(points - points[i]).T)
+        for j in np.flatnonzero((distance < radius) & (np.arange(nodes) > i)):
+            snr = 10.0 - 25.0 * distance[j] / radius + rng.normal(0, 1)
+            topology.observe(ids[i], {"route": [ids[j]], "snr": snr, "rssi": -90.0 - 30.0 * distance[j] / radius}, gateway_id=ids[j], now=now)
+    with topology._lock: # Extra gateways are group 0 like the configured one
+        for i in range(1, gateways):
+            topology._nodes[ids[i]]["group"] = 0
+    return topology
+
+def run_benchmark(nodes: int = 2000, changes: Sequence[int] = (1, 5, 20)):
+    topology = synthetic_mesh(nodes)
+    for workers in (1, max(2, ROUTE_PLANNER_WORKERS)):
+        planner = RoutePlanner(topology, workers=workers)
+        result = planner.recompute(full=True)
+        print(f"full, {workers} worker(s): {result['trees_solved']} trees over {planner.get_stats()['links']} links in {result['elapsed_ms']} ms")
+        if workers > 1:
+            planner.recompute(full=True) # Second run without the pool start-up
+            print(f"full, {workers} worker(s), warm pool: {planner.stats['last_run_ms']} ms")
+
+    # Degrade/improve a few links and compare the incremental result with a from-scratch solve
+    rng = np.random.default_rng(1)
+    links = list(topology._links.values())
+    for count in changes:
+        for link in rng.choice(len(links), count, replace=False):
+            link = links[link]
+            for _ in range(5): # Enough packets for the EWMA to move the link well past the cost epsilon
+                topology.observe(link.source, {"route": [link.target], "snr": float(rng.uniform(-20, 10)), "rssi": -100.0}, gateway_id=link.target)
+        result = planner.recompute()
+        print(f"incremental after {count} link change(s): {result['trees_solved']} trees in {result['elapsed_ms']} ms")
+    # Solve every tree again from the same (epsilon-filtered) costs the incremental planner kept
+    reference = RoutePlanner(topology, workers=1)
+    reference._planned = dict(planner._planned)
+    dist, _ = reference._solve(len(planner.plan.node_ids), planner.plan.destinations)
+    print(f"incremental matches full solve: {bool(np.allclose(dist, planner.plan.dist))}")
+    print(f"gateway routes: {len(planner.gateway_routes())} of {nodes} nodes reachable")
+    planner.stop()
+
+if __name__ == "__main__":
+    run_benchmark()
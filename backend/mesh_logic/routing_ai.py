@@ -1,4 +1,40 @@
+from ..inference import features, inference_service
+from .topology import mesh_topology
+
 async def optimize_route(node_id: str, current_route: list) -> list:
-    print(f"Simulating AI-driven route optimization for {node_id}")
-    # In a real system, this would use an AI model to suggest better routes
-    return current_route # No change for simulation
+    # Each relay in the route may be swapped for a common neighbour of the hops before and after it when
+    # routing_predictor scores the detour higher. Every candidate link of the route goes into one batched call.
+    route = [hop for hop in current_route if hop != node_id]
+    route = [node_id] + route
+    if len(route) < 3:
+        return route
+    adjacency = mesh_topology.neighbors()
+
+    candidates = {} # relay position -> nodes that could stand in for it
+    links = [] # (a, b) pairs to score
+    for i in range(1, len(route) - 1):
+        before, after = route[i - 1], route[i + 1]
+        options = {route[i]} | (set(adjacency.get(before, {})) & set(adjacency.get(after, {})))
+        options -= set(route) - {route[i]}
+        candidates[i] = sorted(options)
+        for option in candidates[i]:
+            links += [(before, option), (option, after)]
+    if not links:
+        return route
+
+    rows = [features("routing_predictor", adjacency.get(a, {}).get(b, {})) for a, b in dict.fromkeys(links)]
+    scores = dict(zip(dict.fromkeys(links), await inference_service.predict_many_async("routing_predictor", rows)))
+
+    optimized = list(route)
+    replaced = set()
+    for i, options in candidates.items():
+        if i - 1 in replaced: # Its "before" hop changed; keep the original relay rather than score a link we never evaluated
+            continue
+        before, after = route[i - 1], route[i + 1]
+        best = max(options, key=lambda option: scores[(before, option)] * scores[(option, after)])
+        if best != route[i] and scores[(before, best)] * scores[(best, after)] > scores[(before, route[i])] * scores[(route[i], after)]:
+            optimized[i] = best
+            replaced.add(i)
+    inference_service.log(node_id, "routing_predictor", {"route": route, "optimized_route": optimized, "changed": optimized != route,
+                                                         "links_scored": len(scores)})
+    return optimized
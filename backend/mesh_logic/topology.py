@@ -0,0 +1,190 @@
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+# Topology engine settings
+MESH_GATEWAY_ID = os.environ.get("MESH_GATEWAY_ID", "gateway")
+TOPOLOGY_LINK_TTL_S = float(os.environ.get("TOPOLOGY_LINK_TTL_S", 900)) # Links not heard for this long age out
+TOPOLOGY_TOMBSTONE_TTL_S = float(os.environ.get("TOPOLOGY_TOMBSTONE_TTL_S", 3600)) # How long removals stay diffable
+LINK_EWMA_ALPHA = 0.2
+
+class Link:
+    __slots__ = ("source", "target", "snr", "rssi", "packets", "last_heard", "version")
+
+    def __init__(self, source: str, target: str):
+        self.source = source
+        self.target = target
+        self.snr = None
+        self.rssi = None
+        self.packets = 0
+        self.last_heard = 0.0
+        self.version = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "source": self.source,
+            "target": self.target,
+            "value": self.packets,
+            "snr": round(self.snr, 2) if self.snr is not None else None,
+            "rssi": round(self.rssi, 2) if self.rssi is not None else None,
+            "version": self.version,
+        }
+
+class MeshTopology:
+    """Adjacency of the mesh as observed from received traffic.
+
+    Every change bumps a global version and stamps the touched node/link with it,
+    so a client holding version v can be sent only what changed after v.
+    Radio metrics (SNR/RSSI, EWMA-smoothed) describe the last hop into the gateway.
+    """
+
+    def __init__(self, gateway_id: str = MESH_GATEWAY_ID, link_ttl: float = TOPOLOGY_LINK_TTL_S,
+                 tombstone_ttl: float = TOPOLOGY_TOMBSTONE_TTL_S):
+        self.gateway_id = gateway_id
+        self.link_ttl = link_ttl
+        self.tombstone_ttl = tombstone_ttl
+        self.version = 0
+        self._links: Dict[Tuple[str, str], Link] = {}
+        self._nodes: Dict[str, dict] = {} # id -> {"id", "group", "hop_count", "version"}
+        self._node_heard: Dict[str, float] = {}
+        self._removed: Dict[Tuple[str, str], Tuple[int, float]] = {} # link key -> (version, removed at)
+        self._removed_nodes: Dict[str, Tuple[int, float]] = {}
+        self._oldest_delta_version = 0 # Deltas from versions before this one need a full snapshot
+        self._lock = threading.Lock()
+
+    def _bump(self) -> int:
+        self.version += 1
+        return self.version
+
+    def _touch_node(self, node_id: str, now: float, hop_count: Optional[int] = None):
+        self._node_heard[node_id] = now
+        node = self._nodes.get(node_id)
+        if node is None:
+            node = self._nodes[node_id] = {"id": node_id, "group": 0 if node_id == self.gateway_id else 1, "hop_count": None, "version": 0}
+            self._removed_nodes.pop(node_id, None)
+            node["version"] = self._bump()
+        if hop_count is not None and hop_count != node["hop_count"]:
+            node["hop_count"] = hop_count
+            node["version"] = self._bump()
+
+    def _touch_link(self, source: str, target: str, now: float, snr: float = None, rssi: float = None):
+        key = (source, target)
+        link = self._links.get(key)
+        changed = link is None
+        if link is None:
+            link = self._links[key] = Link(source, target)
+            self._removed.pop(key, None)
+        link.packets += 1
+        link.last_heard = now
+        if snr is not None:
+            previous = link.snr
+            link.snr = snr if previous is None else previous + LINK_EWMA_ALPHA * (snr - previous)
+            changed = changed or previous is None or abs(link.snr - previous) >= 0.5
+        if rssi is not None:
+            previous = link.rssi
+            link.rssi = rssi if previous is None else previous + LINK_EWMA_ALPHA * (rssi - previous)
+            changed = changed or previous is None or abs(link.rssi - previous) >= 1.0
+        if changed:
+            # Packet counters alone do not make a link "changed" for delta clients
+            link.version = self._bump()
+
+    def observe(self, source: str, data: dict, gateway_id: str = None, now: float = None):
+        # data: decoded packet fields (dest_addr, hop_count, route, snr, rssi) as carried by the uplink
+        now = now or time.monotonic()
+        gateway = gateway_id or data.get("gateway_id") or self.gateway_id
+        hop_count = data.get("hop_count")
+        route = data.get("route")
+        with self._lock:
+            self._touch_node(gateway, now)
+            self._touch_node(source, now, hop_count)
+            if route:
+                # Explicit path [source, relay..., gateway]; radio metrics belong to the final hop
+                path = [source] + [hop for hop in route if hop != source]
+                if path[-1] != gateway:
+                    path.append(gateway)
+                for hop in path:
+                    self._touch_node(hop, now)
+                for a, b in zip(path[:-2], path[1:-1]):
+                    self._touch_link(a, b, now)
+                self._touch_link(path[-2], path[-1], now, data.get("snr"), data.get("rssi"))
+            elif not hop_count:
+                self._touch_link(source, gateway, now, data.get("snr"), data.get("rssi"))
+            dest = data.get("dest_addr")
+            if dest and dest != gateway:
+                self._touch_node(dest, now)
+
+    def observe_batch(self, records: List[dict]):
+        now = time.monotonic()
+        for record in records:
+            self.observe(record["node_uuid"], record["data"], now=now)
+        self.expire(now)
+
+    def expire(self, now: float = None) -> int:
+        now = now or time.monotonic()
+        with self._lock:
+            stale = [key for key, link in self._links.items() if now - link.last_heard > self.link_ttl]
+            for key in stale:
+                del self._links[key]
+                self._removed[key] = (self._bump(), now)
+            linked = {node for key in self._links for node in key}
+            for node_id in list(self._nodes):
+                if node_id != self.gateway_id and node_id not in linked and now - self._node_heard.get(node_id, 0.0) > self.link_ttl:
+                    del self._nodes[node_id]
+                    self._node_heard.pop(node_id, None)
+                    self._removed_nodes[node_id] = (self._bump(), now)
+            # Forget old tombstones; clients older than that get a full snapshot
+            for removed in (self._removed, self._removed_nodes):
+                for key in [key for key, (version, at) in removed.items() if now - at > self.tombstone_ttl]:
+                    self._oldest_delta_version = max(self._oldest_delta_version, removed.pop(key)[0])
+            return len(stale)
+
+    def snapshot(self, since: int = None) -> dict:
+        # Full graph, or only what changed after `since` when the tombstones still cover it
+        self.expire() # Links age out even while no traffic arrives to trigger observe_batch
+        with self._lock:
+            if since is not None and since >= self._oldest_delta_version and since <= self.version:
+                return {
+                    "version": self.version,
+                    "since": since,
+                    "full": False,
+                    "nodes": [dict(node) for node in self._nodes.values() if node["version"] > since],
+                    "links": [link.to_dict() for link in self._links.values() if link.version > since],
+                    "removed_nodes": [node_id for node_id, (version, _) in self._removed_nodes.items() if version > since],
+                    "removed_links": [{"source": key[0], "target": key[1]} for key, (version, _) in self._removed.items() if version > since],
+                }
+            return {
+                "version": self.version,
+                "full": True,
+                "nodes": [dict(node) for node in self._nodes.values()],
+                "links": [link.to_dict() for link in self._links.values()],
+            }
+
+    def neighbors(self) -> Dict[str, Dict[str, dict]]:
+        # Undirected adjacency: node -> {neighbor: metrics of the link, plus the neighbor's hop count}
+        self.expire()
+        with self._lock:
+            adjacency: Dict[str, Dict[str, dict]] = {}
+            for (a, b), link in self._links.items():
+                metrics = {"snr": link.snr, "rssi": link.rssi, "packets": link.packets}
+                adjacency.setdefault(a, {})[b] = {**metrics, "hop_count": self._nodes.get(b, {}).get("hop_count")}
+                adjacency.setdefault(b, {})[a] = {**metrics, "hop_count": self._nodes.get(a, {}).get("hop_count")}
+        return adjacency
+
+    def health(self) -> dict:
+        self.expire()
+        with self._lock:
+            links = list(self._links.values())
+            hop_counts = [node["hop_count"] for node in self._nodes.values() if node["hop_count"] is not None]
+        snrs = [link.snr for link in links if link.snr is not None]
+        rssis = [link.rssi for link in links if link.rssi is not None]
+        return {
+            "version": self.version,
+            "nodes": len(self._nodes),
+            "active_links": len(links),
+            "avg_link_snr": round(sum(snrs) / len(snrs), 2) if snrs else None,
+            "avg_link_rssi": round(sum(rssis) / len(rssis), 2) if rssis else None,
+            "avg_hop_count": round(sum(hop_counts) / len(hop_counts), 2) if hop_counts else None,
+        }
+
+mesh_topology = MeshTopology()
@@ -1,108 +1,69 @@
 import paho.mqtt.client as mqtt
-import json
 import asyncio
-import threading
-import time
+import datetime
 import os
 
-from db.database import SessionLocal
-from db import crud, schemas
-from websocket_handler import broadcast_update
+from .ingest import ingest_pipeline
+from .node_registry import node_registry
+from .ingest_workers import ingest_supervisor
+from .ota_manager import ota_manager
+from .uplink import UplinkEvent, decode_uplink
 
 # MQTT Broker settings
 MQTT_BROKER_HOST = os.environ.get("MQTT_BROKER_HOST", "localhost")
 MQTT_BROKER_PORT = int(os.environ.get("MQTT_BROKER_PORT", 1883))
 MQTT_TOPIC_RX = os.environ.get("MQTT_TOPIC_RX", "novacomm/+/rx") # Wildcard for node_uuid
+MQTT_TOPIC_TX = os.environ.get("MQTT_TOPIC_TX", "novacomm/{gateway}/tx") # Downlink frames for a gateway to transmit
+MQTT_TX_BROADCAST_GATEWAY = "all" # Used when the node has not been heard through any gateway yet
+
+mqtt_client = None
+
+def send_downlink(node_id: str, gateway_id, frame: bytes):
+    # OTA transport: paho's publish is thread-safe and only queues the message for the network thread
+    if mqtt_client is None:
+        raise RuntimeError("MQTT client not connected")
+    mqtt_client.publish(MQTT_TOPIC_TX.format(gateway=gateway_id or MQTT_TX_BROADCAST_GATEWAY), frame, qos=1)
 
 def on_connect(client, userdata, flags, rc):
     print(f"Connected to MQTT broker with result code {rc}")
-    client.subscribe(MQTT_TOPIC_RX)
+    if not ingest_supervisor.enabled:
+        client.subscribe(MQTT_TOPIC_RX)
+    # Otherwise uplinks are consumed by the ingest worker processes; this client only sends downlinks
+
+def dispatch_uplink(event: UplinkEvent, received_at: datetime.datetime = None):
+    # Hand a decoded uplink to the OTA engine and the ingest pipeline (from the paho thread or the worker IPC drain)
+    kind, node_uuid, gateway_id, sleep_flag, body = event
+    if kind == "ack":
+        ota_manager.on_ack(node_uuid, body, gateway_id, sleep_flag)
+        return
+    ota_manager.on_uplink(node_uuid, gateway_id, sleep_flag)
+    record = {"node_uuid": node_uuid, "data": body}
+    if received_at is not None:
+        record["received_at"] = received_at
+    if not ingest_pipeline.submit(record):
+        print(f"Ingest queue full, dropped packet from {node_uuid}")
 
 def on_message(client, userdata, msg):
-    print(f"MQTT message received on topic {msg.topic}: {msg.payload.decode()}")
+    # Runs on the paho network thread: parse and hand off, the DB writes happen in the ingest pipeline
     try:
-        # Assuming payload is JSON, e.g., {"uuid": "node_X", "payload": "data", "snr": 10.5, "rssi": -70, ...}
-        packet_data = json.loads(msg.payload.decode())
-        
-        node_uuid = packet_data.get("uuid")
-        if not node_uuid:
-            # Try to extract uuid from topic if not in payload
-            topic_parts = msg.topic.split('/')
-            if len(topic_parts) >= 2: # e.g., novacomm/node_X/rx
-                node_uuid = topic_parts[1]
-            else:
-                print("Could not determine node_uuid from topic or payload.")
-                return
-        
-        db = SessionLocal()
-        try:
-            # Create or update node status and details
-            node = crud.get_node_by_uuid(db, uuid=node_uuid)
-            if not node:
-                # Create new node with initial data
-                node_create_data = {
-                    "uuid": node_uuid,
-                    "name": packet_data.get("name", f"Node {node_uuid}"),
-                    "lat": packet_data.get("lat"),
-                    "lng": packet_data.get("lng"),
-                    "mode": packet_data.get("mode", "normal"),
-                    "tx_power": packet_data.get("tx_power"),
-                    "freq": packet_data.get("freq"),
-                    "bandwidth": packet_data["bandwidth"],
-                    "ai_model": packet_data.get("ai_model"),
-                    "firmware": packet_data.get("firmware"),
-                    "configuration": packet_data.get("configuration", {})
-                }
-                node = crud.create_node(db, schemas.NodeCreate(**node_create_data))
-            else:
-                # Update existing node's last_seen, status, and other dynamic fields
-                node_update_data = {
-                    "last_seen": datetime.datetime.utcnow(),
-                    "status": "online",
-                    "lat": packet_data.get("lat", node.lat),
-                    "lng": packet_data.get("lng", node.lng),
-                    "mode": packet_data.get("mode", node.mode),
-                    "tx_power": packet_data.get("tx_power", node.tx_power),
-                    "freq": packet_data.get("freq", node.freq),
-                    "bandwidth": packet_data.get("bandwidth", node.bandwidth),
-                    "ai_model": packet_data.get("ai_model", node.ai_model),
-                    "firmware": packet_data.get("firmware", node.firmware),
-                    "configuration": packet_data.get("configuration", node.configuration)
-                }
-                crud.update_node(db, node_uuid, node_update_data)
-            
-            # Create packet entry
-            packet_schema = schemas.PacketCreate(
-                node_id=node_uuid, # Use uuid here as node_id in Packet model
-                payload=packet_data.get("payload", ""),
-                snr=packet_data.get("snr", 0.0),
-                rssi=packet_data.get("rssi", 0.0)
-            )
-            crud.create_packet(db, packet_schema)
-            
-            # Create AI Log if relevant data is present
-            if "ai_prediction" in packet_data:
-                ai_log_schema = schemas.AILogCreate(
-                    node_id=node_uuid,
-                    model_name=packet_data.get("ai_model_name", "unknown"),
-                    prediction=packet_data["ai_prediction"],
-                    accuracy=packet_data.get("ai_accuracy")
-                )
-                crud.create_ai_log(db, ai_log_schema)
-
-        except Exception as e:
-            print(f"Error processing MQTT message: {e}")
-            db.rollback()
-        finally:
-            db.close()
-
-    except json.JSONDecodeError:
-        print(f"Received non-JSON MQTT message: {msg.payload.decode()}")
+        event = decode_uplink(msg.topic, msg.payload)
+    except ValueError as e:
+        print(f"Dropped MQTT message on topic {msg.topic}: {e}")
+        return
+    dispatch_uplink(event)
 
 async def start_mqtt_bridge():
+    global mqtt_client
+    ingest_pipeline.start()
+    node_registry.start()
     client = mqtt.Client()
     client.on_connect = on_connect
     client.on_message = on_message
+    mqtt_client = client
+    ota_manager.transport = send_downlink
+    if ingest_supervisor.enabled:
+        # Sharded ingest: worker processes subscribe and decode, this process writes and broadcasts
+        ingest_supervisor.start(dispatch_uplink, MQTT_BROKER_HOST, MQTT_BROKER_PORT, MQTT_TOPIC_RX)
 
     try:
         client.connect(MQTT_BROKER_HOST, MQTT_BROKER_PORT, 60)
@@ -0,0 +1,193 @@
+import bisect
+import datetime
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from sqlalchemy.orm import Session
+
+from .db import models, schemas
+from .db.writer import db_writer
+
+NODE_REGISTRY_FLUSH_INTERVAL_S = float(os.environ.get("NODE_REGISTRY_FLUSH_INTERVAL_S", 5))
+
+# Fields that change on every packet and are written back lazily (status only changes on
+# liveness transitions, which the liveness tracker writes itself)
+WRITE_BEHIND_FIELDS = ("last_seen",)
+
+class NodeRegistry:
+    """Process-wide cache of node state keyed by uuid.
+
+    Reads (API and ingest) are served from memory. last_seen changes are
+    coalesced per node and written back in one bulk UPDATE every flush interval;
+    everything else still goes through crud and refreshes the cached entry.
+    """
+
+    def __init__(self, flush_interval: float = NODE_REGISTRY_FLUSH_INTERVAL_S):
+        self.flush_interval = flush_interval
+        self._nodes: Dict[str, dict] = {}
+        self._dirty: Dict[str, dict] = {} # uuid -> pending write-behind fields
+        self._dirty_since: Optional[float] = None # monotonic time of the oldest unflushed change
+        self._loaded = False
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {"hits": 0, "misses": 0, "flushes": 0, "flushed_rows": 0, "last_flush_lag_ms": 0.0, "max_flush_lag_ms": 0.0}
+
+    def _to_dict(self, db_node: models.Node) -> dict:
+        node = schemas.Node.from_orm(db_node).dict()
+        # Pending write-behind values are newer than what the DB row holds
+        node.update(self._dirty.get(node["uuid"], {}))
+        return node
+
+    def load(self, db: Session):
+        with self._lock:
+            for db_node in db.query(models.Node).all():
+                self._nodes[db_node.uuid] = self._to_dict(db_node)
+            self._loaded = True
+
+    def contains(self, uuid: str) -> bool:
+        with self._lock:
+            return uuid in self._nodes
+
+    def peek(self, uuid: str) -> Optional[dict]:
+        # Uncounted, uncopied read for the ingest path; callers must not mutate the result
+        with self._lock:
+            return self._nodes.get(uuid)
+
+    def last_seen(self) -> Dict[str, datetime.datetime]:
+        # uuid -> last_seen for every cached node, for trackers arming timers at startup
+        with self._lock:
+            return {uuid: node["last_seen"] for uuid, node in self._nodes.items()}
+
+    def get(self, db: Session, uuid: str) -> Optional[dict]:
+        with self._lock:
+            node = self._nodes.get(uuid)
+            if node is not None:
+                self.stats["hits"] += 1
+                return dict(node)
+            self.stats["misses"] += 1
+        db_node = db.query(models.Node).filter(models.Node.uuid == uuid).first()
+        if db_node is None:
+            return None
+        return dict(self.put(db_node))
+
+    def list(self, db: Session, skip: int = 0, limit: int = 100, after_id: int = None) -> list:
+        # Ordered by id; after_id seeks past a keyset cursor instead of skipping
+        if not self._loaded:
+            self.load(db)
+        with self._lock:
+            self.stats["hits"] += 1
+            nodes = sorted(self._nodes.values(), key=lambda node: node["id"])
+        if after_id is not None:
+            ids = [node["id"] for node in nodes]
+            skip = bisect.bisect_right(ids, after_id)
+        return [dict(node) for node in nodes[skip:skip + limit]]
+
+    def status_counts(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        with self._lock:
+            for node in self._nodes.values():
+                counts[node["status"]] = counts.get(node["status"], 0) + 1
+        return counts
+
+    def put(self, db_node: models.Node) -> dict:
+        with self._lock:
+            node = self._to_dict(db_node)
+            self._nodes[node["uuid"]] = node
+            return node
+
+    def update_fields(self, uuid: str, fields: dict):
+        # Fields already persisted by the caller
+        with self._lock:
+            node = self._nodes.get(uuid)
+            if node is not None:
+                node.update(fields)
+
+    def touch(self, uuid: str, last_seen) -> Optional[dict]:
+        with self._lock:
+            node = self._nodes.get(uuid)
+            if node is None:
+                return None
+            if node["last_seen"] is None or last_seen >= node["last_seen"]:
+                node["last_seen"] = last_seen
+            self._dirty[uuid] = {field: node[field] for field in WRITE_BEHIND_FIELDS}
+            if self._dirty_since is None:
+                self._dirty_since = time.monotonic()
+            return node
+
+    def invalidate(self, uuid: str):
+        # Drop the cached row; the next read reloads it (pending write-behind fields are kept)
+        with self._lock:
+            self._nodes.pop(uuid, None)
+
+    def remove(self, uuid: str):
+        with self._lock:
+            self._nodes.pop(uuid, None)
+            self._dirty.pop(uuid, None)
+
+    def flush(self, db: Session = None) -> int:
+        with self._lock:
+            if not self._dirty:
+                return 0
+            dirty, self._dirty = self._dirty, {}
+            dirty_since, self._dirty_since = self._dirty_since, None
+            rows = [{"id": self._nodes[uuid]["id"], **fields} for uuid, fields in dirty.items() if uuid in self._nodes]
+        try:
+            if db is None:
+                db_writer.run(self._write, rows)
+            else:
+                self._write(db, rows)
+        except Exception as e:
+            print(f"Error flushing node registry: {e}")
+            if db is not None:
+                db.rollback()
+            with self._lock:
+                # Put the changes back unless newer ones arrived meanwhile
+                for uuid, fields in dirty.items():
+                    self._dirty.setdefault(uuid, fields)
+                self._dirty_since = dirty_since if self._dirty_since is None else min(dirty_since, self._dirty_since)
+            return 0
+        lag_ms = round((time.monotonic() - dirty_since) * 1000, 3)
+        with self._lock:
+            self.stats["flushes"] += 1
+            self.stats["flushed_rows"] += len(rows)
+            self.stats["last_flush_lag_ms"] = lag_ms
+            self.stats["max_flush_lag_ms"] = max(self.stats["max_flush_lag_ms"], lag_ms)
+        return len(rows)
+
+    @staticmethod
+    def _write(db: Session, rows: list):
+        db.bulk_update_mappings(models.Node, rows)
+        db.commit()
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="node-registry-flush", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["nodes"] = len(self._nodes)
+            stats["pending_writes"] = len(self._dirty)
+            stats["pending_lag_ms"] = round((time.monotonic() - self._dirty_since) * 1000, 3) if self._dirty_since else 0.0
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = round(stats["hits"] / lookups, 4) if lookups else None
+        return stats
+
+node_registry = NodeRegistry()
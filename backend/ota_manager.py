@@ -1,25 +1,582 @@
+import asyncio
 import os
-from typing import Optional
+import struct
+import time
+import zlib
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+from .db import crud
+from .db.database import ReadSessionLocal
+from .db.writer import db_writer
+from .mesh_logic.mesh_parser import DATA_OFFSET, FRAME_OVERHEAD, PACKET_TYPE_OTA_CHUNK, build_frame
+from .utils.content_store import ContentStore, StoredFile
+
+# OTA transfer settings
+LORA_MAX_PAYLOAD = 255 # Largest frame the radio sends in one transmission
+OTA_CHUNK_HEADER = struct.Struct(">HHI") # Chunk index, chunk count, CRC-32 of the whole image
+OTA_MAX_CHUNK_SIZE = LORA_MAX_PAYLOAD - FRAME_OVERHEAD - OTA_CHUNK_HEADER.size
+OTA_CHUNK_SIZE = min(int(os.environ.get("OTA_CHUNK_SIZE", 128)), OTA_MAX_CHUNK_SIZE)
+OTA_MAX_FIRMWARE_SIZE = OTA_CHUNK_SIZE * 0xFFFF # Chunk indexes are 16-bit
+OTA_GATEWAY_CONCURRENCY = int(os.environ.get("OTA_GATEWAY_CONCURRENCY", 4)) # Transfers sending through one gateway at a time
+OTA_ACK_TIMEOUT_S = float(os.environ.get("OTA_ACK_TIMEOUT_S", 2.0))
+OTA_CHUNK_RETRIES = int(os.environ.get("OTA_CHUNK_RETRIES", 3)) # Unacked sends in a row before the node is assumed asleep
+OTA_NODE_TIMEOUT_S = float(os.environ.get("OTA_NODE_TIMEOUT_S", 24 * 3600)) # A transfer whose node stays silent this long fails
+OTA_PROBE_INTERVAL_S = float(os.environ.get("OTA_PROBE_INTERVAL_S", 300)) # Retry a silent node in case its wake-up uplink was lost
+OTA_PROGRESS_FLUSH_INTERVAL_MS = int(os.environ.get("OTA_PROGRESS_FLUSH_INTERVAL_MS", 1000))
+OTA_IMAGE_CACHE_SIZE = int(os.environ.get("OTA_IMAGE_CACHE_SIZE", 8)) # Chunked images kept in memory
+
+OTA_ACK = struct.Struct(">H")
+SERVER_ADDR = 0x00000000
+
+def node_address(node_id: str) -> int:
+    # Nodes seen as raw frames are named by their hex source address; other uuids get a stable 32-bit hash
+    try:
+        return int(node_id, 16) & 0xFFFFFFFF
+    except ValueError:
+        return zlib.crc32(node_id.encode())
+
+class FirmwareImage:
+    """A firmware file split once into LoRa-sized chunk payloads, shared by every transfer of that version."""
+
+    __slots__ = ("version", "size", "crc32", "chunks")
+
+    def __init__(self, version: str, data: bytes, chunk_size: int = OTA_CHUNK_SIZE):
+        total = max(1, -(-len(data) // chunk_size))
+        if total > 0xFFFF:
+            raise ValueError(f"Firmware {version} needs {total} chunks, the protocol allows 65535")
+        self.version = version
+        self.size = len(data)
+        self.crc32 = zlib.crc32(data)
+        self.chunks = [OTA_CHUNK_HEADER.pack(i, total, self.crc32) + data[i * chunk_size:(i + 1) * chunk_size] for i in range(total)]
+
+class OTATransfer:
+    __slots__ = ("task_id", "node_id", "address", "image", "next_chunk", "awake", "gateway_id", "wake", "ack", "last_heard", "started", "sent")
+
+    def __init__(self, task_id: int, node_id: str, image: FirmwareImage, next_chunk: int = 0):
+        self.task_id = task_id
+        self.node_id = node_id
+        self.address = node_address(node_id)
+        self.image = image
+        self.next_chunk = min(next_chunk, len(image.chunks))
+        self.awake: Optional[bool] = None # None: not known to be asleep, a window is attempted
+        self.gateway_id: Optional[str] = None # Gateway that last heard the node
+        self.wake = asyncio.Event()
+        self.ack: Optional[asyncio.Future] = None
+        self.last_heard: Optional[float] = None
+        self.started = time.time()
+        self.sent = 0
 
 class OTAManager:
-    def __init__(self, upload_dir="./ota_uploads"):
+    """Fleet OTA rollouts: chunked, resumable firmware transfers over the gateways.
+
+    Each firmware version is split once into chunks that fit a LoRa frame and
+    cached. Every node gets one transfer coroutine that sends a chunk, waits
+    for the node's cumulative ack and continues from the index the node asks
+    for, so an interrupted transfer resumes from the last acked chunk. A node
+    whose uplink carries SLEEP_FLAG (or that stops acking) is left alone until
+    its next uplink, and while it sleeps it does not hold one of its gateway's
+    OTA_GATEWAY_CONCURRENCY slots. Progress is buffered and written to
+    OTATask in one batch per flush interval.
+
+    transport(node_id, gateway_id, frame) delivers a downlink frame; the MQTT
+    bridge installs one that publishes to the gateway's tx topic.
+    """
+
+    def __init__(self, upload_dir="./ota_uploads", transport: Callable[[str, Optional[str], bytes], None] = None,
+                 gateway_concurrency: int = OTA_GATEWAY_CONCURRENCY, ack_timeout: float = OTA_ACK_TIMEOUT_S,
+                 chunk_retries: int = OTA_CHUNK_RETRIES, node_timeout: float = OTA_NODE_TIMEOUT_S,
+                 probe_interval: float = OTA_PROBE_INTERVAL_S, flush_interval_ms: int = OTA_PROGRESS_FLUSH_INTERVAL_MS):
         self.upload_dir = upload_dir
-        os.makedirs(self.upload_dir, exist_ok=True)
+        self.store = ContentStore(upload_dir)
+        self.transport = transport
+        self.gateway_concurrency = gateway_concurrency
+        self.ack_timeout = ack_timeout
+        self.chunk_retries = chunk_retries
+        self.node_timeout = node_timeout
+        self.probe_interval = probe_interval
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.images: "OrderedDict[str, FirmwareImage]" = OrderedDict()
+        self.transfers: Dict[str, OTATransfer] = {} # One active transfer per node
+        self.heard: Dict[str, tuple] = {} # node id -> (gateway id, sleep flag) of its last uplink, seeds new transfers
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._gateway_slots: Dict[str, asyncio.Semaphore] = {}
+        self._gateway_active: Dict[str, int] = {}
+        self._progress: Dict[int, dict] = {} # task id -> latest progress not yet written
+        self._packet_id = 0
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._flusher = None
+        self.stats = {"transfers_started": 0, "transfers_completed": 0, "transfers_failed": 0, "chunks_sent": 0,
+                      "chunks_acked": 0, "retransmits": 0, "ack_timeouts": 0, "sleeps": 0, "wakeups": 0, "probes": 0,
+                      "max_gateway_active": 0, "progress_flushes": 0, "progress_rows": 0}
+
+    async def upload_firmware(self, src) -> StoredFile:
+        # src: the upload's file object. Streamed into the content store off the event loop, hashed as it is copied;
+        # raises ValueError for images too large to chunk
+        stored = await asyncio.to_thread(self.store.save, src, OTA_MAX_FIRMWARE_SIZE)
+        if not stored.created:
+            print(f"Firmware upload {stored.sha256[:12]} is identical to a stored image, keeping one copy")
+        return stored
+
+    # Firmware images
+
+    def add_image(self, version: str, data: bytes) -> FirmwareImage:
+        image = FirmwareImage(version, data)
+        self.images[version] = image
+        self.images.move_to_end(version)
+        while len(self.images) > OTA_IMAGE_CACHE_SIZE:
+            self.images.popitem(last=False)
+        return image
+
+    @staticmethod
+    def _read_firmware(version: str) -> bytes:
+        db = ReadSessionLocal()
+        try:
+            db_firmware = crud.get_firmware_by_version(db, version)
+        finally:
+            db.close()
+        if db_firmware is None or not db_firmware.file_path:
+            raise LookupError(f"Firmware {version} not found")
+        with open(db_firmware.file_path, "rb") as f:
+            return f.read()
 
-    async def upload_firmware(self, filename: str, file_content: bytes) -> str:
-        file_path = os.path.join(self.upload_dir, filename)
-        with open(file_path, "wb") as f:
-            f.write(file_content)
-        return file_path
+    async def get_image(self, version: str) -> FirmwareImage:
+        image = self.images.get(version)
+        if image is not None:
+            self.images.move_to_end(version)
+            return image
+        return self.add_image(version, await asyncio.to_thread(self._read_firmware, version))
+
+    # Rollouts
+
+    async def create_rollout(self, firmware_version: str, node_ids: Optional[List[str]] = None):
+        # Raises LookupError for an unknown version before any task is created
+        image = await self.get_image(firmware_version)
+        db_rollout, tasks = await db_writer.run_async(crud.create_ota_rollout, firmware_version, node_ids, f"/api/ota/ota/firmware/{firmware_version}")
+        for task_id, node_id in tasks:
+            self.start_transfer(task_id, node_id, image)
+        print(f"OTA rollout {db_rollout.id}: firmware {firmware_version} ({len(image.chunks)} chunks) to {len(tasks)} nodes")
+        return db_rollout, tasks
 
     async def deploy_firmware(self, node_id: str, firmware_version: str) -> bool:
-        # Simulate pushing firmware to a node
-        print(f"Simulating OTA deployment of firmware {firmware_version} to node {node_id}")
-        # In a real system, this would involve sending commands via LoRa/MQTT
+        # Single-node rollout; progress is reported on the node's OTATask
+        try:
+            await self.create_rollout(firmware_version, [node_id])
+        except LookupError as e:
+            print(f"OTA deployment to {node_id} failed: {e}")
+            return False
         return True
 
     async def get_firmware_status(self, node_id: str) -> dict:
-        # Simulate getting OTA status from a node
-        return {"node_id": node_id, "status": "deployed", "version": "1.0.0"}
+        transfer = self.transfers.get(node_id)
+        if transfer is not None:
+            total = len(transfer.image.chunks)
+            return {"node_id": node_id, "status": "in_progress", "version": transfer.image.version, "task_id": transfer.task_id,
+                    "chunks_acked": transfer.next_chunk, "chunks_total": total, "progress": round(100.0 * transfer.next_chunk / total, 1),
+                    "awake": transfer.awake, "gateway_id": transfer.gateway_id}
+        db = ReadSessionLocal()
+        try:
+            db_task = await asyncio.to_thread(crud.get_latest_ota_task, db, node_id)
+        finally:
+            db.close()
+        if db_task is None:
+            return {"node_id": node_id, "status": "none"}
+        return {"node_id": node_id, "status": db_task.status, "version": db_task.firmware_version, "task_id": db_task.id,
+                "chunks_acked": db_task.chunks_acked, "chunks_total": db_task.chunks_total, "progress": db_task.progress}
+
+    # Transfers (event loop)
+
+    def start_transfer(self, task_id: int, node_id: str, image: FirmwareImage, next_chunk: int = 0) -> OTATransfer:
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+        previous = self.transfers.get(node_id)
+        if previous is not None:
+            # A newer rollout supersedes the node's running transfer
+            self._tasks.pop(previous.task_id).cancel()
+            self._set_progress(previous, "failed")
+        transfer = OTATransfer(task_id, node_id, image, next_chunk)
+        if node_id in self.heard:
+            transfer.gateway_id, sleep_flag = self.heard[node_id]
+            transfer.awake = not sleep_flag
+        else:
+            transfer.awake = False # No gateway to send through yet: wait for its next uplink (or the probe)
+        self.transfers[node_id] = transfer
+        self._tasks[task_id] = self.loop.create_task(self._transfer(transfer))
+        self.stats["transfers_started"] += 1
+        return transfer
+
+    async def _transfer(self, transfer: OTATransfer):
+        total = len(transfer.image.chunks)
+        try:
+            self._set_progress(transfer, "in_progress")
+            while transfer.next_chunk < total:
+                if transfer.awake is False:
+                    transfer.wake.clear()
+                    try:
+                        await asyncio.wait_for(transfer.wake.wait(), timeout=self.probe_interval)
+                    except asyncio.TimeoutError:
+                        if time.time() - (transfer.last_heard or transfer.started) >= self.node_timeout:
+                            print(f"OTA to {transfer.node_id} failed: not heard from for {self.node_timeout:.0f} s")
+                            self.stats["transfers_failed"] += 1
+                            self._set_progress(transfer, "failed")
+                            return
+                        transfer.awake = None # Probe with another window
+                        self.stats["probes"] += 1
+                        continue
+                async with self._gateway_slot(transfer.gateway_id):
+                    await self._send_window(transfer)
+            self.stats["transfers_completed"] += 1
+            self._set_progress(transfer, "completed")
+        finally:
+            if self.transfers.get(transfer.node_id) is transfer:
+                del self.transfers[transfer.node_id]
+            if self._tasks.get(transfer.task_id) is asyncio.current_task():
+                del self._tasks[transfer.task_id]
+
+    async def _send_window(self, transfer: OTATransfer):
+        # Stop-and-wait while the node is awake: one chunk in flight, the ack names the next one to send
+        total = len(transfer.image.chunks)
+        misses = 0
+        last_sent = None
+        while transfer.next_chunk < total and transfer.awake is not False:
+            index = transfer.next_chunk
+            if index == last_sent:
+                self.stats["retransmits"] += 1
+            last_sent = index
+            transfer.ack = self.loop.create_future()
+            self._send_chunk(transfer, index)
+            try:
+                acked = await asyncio.wait_for(transfer.ack, timeout=self.ack_timeout)
+            except asyncio.TimeoutError:
+                self.stats["ack_timeouts"] += 1
+                misses += 1
+                if misses >= self.chunk_retries:
+                    transfer.awake = False # Most likely asleep: wait for its next uplink
+                    self.stats["sleeps"] += 1
+                continue
+            finally:
+                transfer.ack = None
+            misses = 0
+            if acked > index:
+                self.stats["chunks_acked"] += 1
+            transfer.next_chunk = min(acked, total)
+            self._set_progress(transfer, "in_progress")
+
+    def _send_chunk(self, transfer: OTATransfer, index: int):
+        self._packet_id = (self._packet_id + 1) & 0xFFFF
+        frame = build_frame(SERVER_ADDR, transfer.address, self._packet_id, transfer.image.chunks[index], packet_type=PACKET_TYPE_OTA_CHUNK)
+        transfer.sent += 1
+        self.stats["chunks_sent"] += 1
+        if self.transport is None:
+            return # No downlink yet (MQTT not connected): the ack times out and the chunk is retried
+        try:
+            self.transport(transfer.node_id, transfer.gateway_id, frame)
+        except Exception as e:
+            print(f"OTA downlink to {transfer.node_id} failed: {e}")
+
+    def _gateway_slot(self, gateway_id: Optional[str]) -> "_GatewaySlot":
+        key = gateway_id or ""
+        semaphore = self._gateway_slots.get(key)
+        if semaphore is None:
+            semaphore = self._gateway_slots[key] = asyncio.Semaphore(self.gateway_concurrency)
+        return _GatewaySlot(self, key, semaphore)
+
+    # Uplinks (any thread: the MQTT network thread calls these)
+
+    def on_uplink(self, node_id: str, gateway_id: Optional[str] = None, sleep_flag: bool = False):
+        # Only nodes with a transfer in flight cost more than two dict operations
+        self.heard[node_id] = (gateway_id, sleep_flag)
+        if node_id in self.transfers and self.loop is not None:
+            self.loop.call_soon_threadsafe(self._on_uplink, node_id, gateway_id, sleep_flag, None)
+
+    def on_ack(self, node_id: str, payload: bytes, gateway_id: Optional[str] = None, sleep_flag: bool = False):
+        if len(payload) < OTA_ACK.size:
+            return
+        (next_chunk,) = OTA_ACK.unpack_from(payload)
+        self.heard[node_id] = (gateway_id, sleep_flag)
+        if node_id in self.transfers and self.loop is not None:
+            self.loop.call_soon_threadsafe(self._on_uplink, node_id, gateway_id, sleep_flag, next_chunk)
+
+    def _on_uplink(self, node_id: str, gateway_id: Optional[str], sleep_flag: bool, next_chunk: Optional[int]):
+        transfer = self.transfers.get(node_id)
+        if transfer is None:
+            return
+        transfer.last_heard = time.time()
+        if gateway_id:
+            transfer.gateway_id = gateway_id
+        if next_chunk is not None:
+            if transfer.ack is not None and not transfer.ack.done():
+                transfer.ack.set_result(next_chunk)
+            else:
+                # Unsolicited ack, e.g. a node announcing where it stands after a reboot
+                transfer.next_chunk = min(next_chunk, len(transfer.image.chunks))
+        if sleep_flag:
+            transfer.awake = False
+        else:
+            if transfer.awake is False:
+                self.stats["wakeups"] += 1
+            transfer.awake = True
+            transfer.wake.set()
+
+    # Progress write-back
+
+    def _set_progress(self, transfer: OTATransfer, status: str):
+        total = len(transfer.image.chunks)
+        acked = total if status == "completed" else transfer.next_chunk
+        self._progress[transfer.task_id] = {"id": transfer.task_id, "progress": round(100.0 * acked / total, 1), "status": status,
+                                            "chunks_acked": acked, "chunks_total": total}
+
+    async def _write_progress(self, rows: List[dict]):
+        await db_writer.run_async(crud.update_ota_tasks_progress, rows)
+
+    async def flush(self) -> int:
+        pending, self._progress = self._progress, {}
+        if not pending:
+            return 0
+        rows = list(pending.values())
+        try:
+            await self._write_progress(rows)
+        except Exception as e:
+            print(f"Error writing back {len(rows)} OTA progress updates: {e}")
+            for task_id, row in pending.items():
+                self._progress.setdefault(task_id, row)
+            return 0
+        self.stats["progress_flushes"] += 1
+        self.stats["progress_rows"] += len(rows)
+        return len(rows)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    # Lifecycle
+
+    async def start(self):
+        # Resume transfers interrupted by a restart from their last acked chunk
+        if self._flusher is not None:
+            return
+        self.loop = asyncio.get_running_loop()
+        db = ReadSessionLocal()
+        try:
+            db_tasks = await asyncio.to_thread(crud.get_unfinished_ota_tasks, db)
+        finally:
+            db.close()
+        for db_task in db_tasks:
+            try:
+                image = await self.get_image(db_task.firmware_version)
+            except (LookupError, OSError, ValueError) as e:
+                print(f"Cannot resume OTA task {db_task.id}: {e}")
+                self._progress[db_task.id] = {"id": db_task.id, "progress": db_task.progress or 0.0, "status": "failed"}
+                continue
+            self.start_transfer(db_task.id, db_task.node_id, image, db_task.chunks_acked or 0)
+        if db_tasks:
+            print(f"Resumed {len(self.transfers)} OTA transfers")
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        # Running transfers stay in_progress in the database and resume on the next start
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        await self.flush()
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats)
+        stats["active_transfers"] = len(self.transfers)
+        stats["asleep"] = sum(1 for transfer in self.transfers.values() if transfer.awake is False)
+        stats["gateway_active"] = {gateway or "unknown": count for gateway, count in self._gateway_active.items() if count}
+        stats["cached_images"] = list(self.images)
+        stats["pending_progress_writes"] = len(self._progress)
+        return stats
+
+class _GatewaySlot:
+    # async with: one of a gateway's concurrent-transfer slots, with bookkeeping for stats
+    __slots__ = ("manager", "key", "semaphore")
+
+    def __init__(self, manager: OTAManager, key: str, semaphore: asyncio.Semaphore):
+        self.manager = manager
+        self.key = key
+        self.semaphore = semaphore
+
+    async def __aenter__(self):
+        await self.semaphore.acquire()
+        active = self.manager._gateway_active[self.key] = self.manager._gateway_active.get(self.key, 0) + 1
+        self.manager.stats["max_gateway_active"] = max(self.manager.stats["max_gateway_active"], active)
+
+    async def __aexit__(self, *exc):
+        self.manager._gateway_active[self.key] -= 1
+        self.semaphore.release()
 
 ota_manager = OTAManager()
+
+# Simulated fleet: stands in for the radios so rollouts can be exercised end to end without hardware
+class SimulatedNode:
+    __slots__ = ("node_id", "gateway_id", "sleepy", "awake", "received", "next_chunk", "total", "crc32", "duplicates")
+
+    def __init__(self, node_id: str, gateway_id: str, sleepy: bool):
+        self.node_id = node_id
+        self.gateway_id = gateway_id
+        self.sleepy = sleepy
+        self.awake = True
+        self.received = bytearray()
+        self.next_chunk = 0
+        self.total = None
+        self.crc32 = None
+        self.duplicates = 0 # Chunks received again after being acked
+
+    def verified(self) -> bool:
+        return self.total is not None and self.next_chunk == self.total and zlib.crc32(self.received) == self.crc32
+
+class SimulatedFleet:
+    """The manager's transport for a fleet of simulated nodes.
+
+    Frames arrive after airtime_s and are lost with probability loss in both
+    directions. Sleepy nodes alternate awake_s awake and sleep_s asleep,
+    announcing each change with an uplink the way a real node sets SLEEP_FLAG;
+    frames sent to a sleeping node are lost. Always-on nodes send telemetry
+    every telemetry_s. Nodes keep received chunks across
+    manager restarts, so a resumed transfer can be checked for resends.
+    """
+
+    def __init__(self, manager: OTAManager, count: int, gateways: int = 8, sleepy_ratio: float = 0.5, awake_s: float = 2.0,
+                 sleep_s: float = 4.0, telemetry_s: float = 5.0, loss: float = 0.05, airtime_s: float = 0.005, seed: int = 0):
+        import random
+        self.random = random.Random(seed)
+        self.airtime_s = airtime_s
+        self.loss = loss
+        self.awake_s = awake_s
+        self.sleep_s = sleep_s
+        self.telemetry_s = telemetry_s
+        self.nodes = {f"{0x10000000 + i:08x}": SimulatedNode(f"{0x10000000 + i:08x}", f"gw-{i % gateways}", self.random.random() < sleepy_ratio)
+                      for i in range(count)}
+        self.attach(manager)
+        self._duty_cycles = []
+
+    def attach(self, manager: OTAManager):
+        self.manager = manager
+        manager.transport = self
+
+    def __call__(self, node_id: str, gateway_id: Optional[str], frame: bytes):
+        asyncio.get_running_loop().call_later(self.airtime_s, self._deliver, self.nodes[node_id], frame)
+
+    def _deliver(self, node: SimulatedNode, frame: bytes):
+        if not node.awake or self.random.random() < self.loss:
+            return
+        chunk = frame[DATA_OFFSET:len(frame) - (FRAME_OVERHEAD - DATA_OFFSET)]
+        index, total, crc32 = OTA_CHUNK_HEADER.unpack_from(chunk)
+        if node.total != total or node.crc32 != crc32:
+            node.received, node.next_chunk, node.total, node.crc32 = bytearray(), 0, total, crc32 # New image
+        if index == node.next_chunk:
+            node.received += chunk[OTA_CHUNK_HEADER.size:]
+            node.next_chunk += 1
+        elif index < node.next_chunk:
+            node.duplicates += 1
+        if self.random.random() >= self.loss:
+            asyncio.get_running_loop().call_later(self.airtime_s, self.manager.on_ack, node.node_id, OTA_ACK.pack(node.next_chunk), node.gateway_id, False)
+
+    def start(self):
+        # Every node announces itself, then runs its duty cycle or telemetry loop with a random phase
+        for node in self.nodes.values():
+            self.manager.on_uplink(node.node_id, node.gateway_id, False)
+            cycle = self._duty_cycle(node) if node.sleepy else self._telemetry(node)
+            self._duty_cycles.append(asyncio.get_running_loop().create_task(cycle))
+
+    def stop(self):
+        for task in self._duty_cycles:
+            task.cancel()
+        self._duty_cycles = []
+
+    async def _duty_cycle(self, node: SimulatedNode):
+        await asyncio.sleep(self.random.uniform(0, self.awake_s))
+        while True:
+            node.awake = False
+            self.manager.on_uplink(node.node_id, node.gateway_id, True)
+            await asyncio.sleep(self.sleep_s)
+            node.awake = True
+            self.manager.on_uplink(node.node_id, node.gateway_id, False)
+            await asyncio.sleep(self.awake_s)
+
+    async def _telemetry(self, node: SimulatedNode):
+        await asyncio.sleep(self.random.uniform(0, self.telemetry_s))
+        while True:
+            if self.random.random() >= self.loss:
+                self.manager.on_uplink(node.node_id, node.gateway_id, False)
+            await asyncio.sleep(self.telemetry_s)
+
+def run_simulation(nodes: int = 300, image_size: int = 8 * 1024, gateways: int = 8, gateway_concurrency: int = 4,
+                   loss: float = 0.05, interrupt_after_s: float = 3.0, timeout_s: float = 120.0) -> dict:
+    # Rolls one image out to a simulated fleet, restarts the manager midway from the written-back progress
+    # and checks every node ends up with a verified image
+    import tempfile
+
+    async def simulate():
+        written: Dict[int, dict] = {}
+
+        def make_manager():
+            manager = OTAManager(upload_dir=tempfile.gettempdir(), gateway_concurrency=gateway_concurrency,
+                                 ack_timeout=0.1, chunk_retries=2, node_timeout=30.0, probe_interval=10.0, flush_interval_ms=200)
+            manager.loop = asyncio.get_running_loop()
+
+            async def write_progress(rows):
+                for row in rows:
+                    written[row["id"]] = row
+            manager._write_progress = write_progress
+            return manager
+
+        manager = make_manager()
+        fleet = SimulatedFleet(manager, nodes, gateways=gateways, loss=loss)
+        image = manager.add_image("sim-1.0.0", os.urandom(image_size))
+        node_ids = list(fleet.nodes)
+        fleet.start()
+        await asyncio.sleep(fleet.telemetry_s) # Let the fleet be heard before the rollout starts
+        started = time.perf_counter()
+        for task_id, node_id in enumerate(node_ids, start=1):
+            manager.start_transfer(task_id, node_id, image)
+        manager._flusher = asyncio.create_task(manager._flush_loop())
+
+        # Restart: the new manager only knows what was written back, like after a process restart
+        await asyncio.sleep(interrupt_after_s)
+        await manager.stop()
+        first_stats = manager.get_stats()
+        resumed_from = {task_id: row.get("chunks_acked", 0) for task_id, row in written.items() if row["status"] != "completed"}
+        manager = make_manager()
+        fleet.attach(manager)
+        for task_id, node_id in enumerate(node_ids, start=1):
+            if task_id in resumed_from:
+                manager.start_transfer(task_id, node_id, image, resumed_from[task_id])
+        manager._flusher = asyncio.create_task(manager._flush_loop())
+        deadline = time.perf_counter() + timeout_s
+        while manager.transfers and time.perf_counter() < deadline:
+            await asyncio.sleep(0.1)
+        elapsed = time.perf_counter() - started
+        await manager.stop()
+        fleet.stop()
+
+        stats = manager.get_stats()
+        return {
+            "nodes": nodes,
+            "chunks_per_image": len(image.chunks),
+            "elapsed_s": round(elapsed, 2),
+            "verified": sum(1 for node in fleet.nodes.values() if node.verified()),
+            "completed_tasks": sum(1 for row in written.values() if row["status"] == "completed"),
+            "resumed": len(resumed_from),
+            "chunks_skipped_by_resume": sum(resumed_from.values()),
+            "duplicate_chunks": sum(node.duplicates for node in fleet.nodes.values()), # Resent because an ack was lost
+            "chunks_sent": first_stats["chunks_sent"] + stats["chunks_sent"],
+            "ack_timeouts": first_stats["ack_timeouts"] + stats["ack_timeouts"],
+            "max_gateway_active": max(first_stats["max_gateway_active"], stats["max_gateway_active"]),
+            "gateway_concurrency": gateway_concurrency,
+            "progress_flushes": first_stats["progress_flushes"] + stats["progress_flushes"],
+            "progress_rows": first_stats["progress_rows"] + stats["progress_rows"],
+        }
+
+    return asyncio.run(simulate())
+
+if __name__ == "__main__":
+    print(run_simulation())
@@ -0,0 +1,289 @@
+import datetime
+import os
+import threading
+from typing import Dict, List, Tuple
+
+from sqlalchemy import delete, insert
+from sqlalchemy.orm import Session
+
+from .db import models
+
+# Bucket widths in seconds, finest first
+ROLLUP_RESOLUTIONS = tuple(int(r) for r in os.environ.get("ROLLUP_RESOLUTIONS", "60,300,3600").split(","))
+# How many of the newest buckets per resolution stay in memory to absorb late packets
+ROLLUP_OPEN_BUCKETS = int(os.environ.get("ROLLUP_OPEN_BUCKETS", 3))
+ROLLUP_FLUSH_INTERVAL_S = float(os.environ.get("ROLLUP_FLUSH_INTERVAL_S", 5))
+FLEET_NODE_ID = "*" # Rollup rows aggregating every node
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# Fixed-width histogram sketches: mergeable by adding counts, quantile error <= width / 2
+SNR_SKETCH = (-40.0, 0.5) # (lowest value, bin width) in dB
+RSSI_SKETCH = (-160.0, 1.0) # in dBm
+
+def sketch_add(sketch: dict, value: float, params: Tuple[float, float]):
+    low, width = params
+    key = str(max(0, int((value - low) // width)))
+    sketch[key] = sketch.get(key, 0) + 1
+
+def sketch_merge(sketch: dict, other: dict):
+    for key, count in other.items():
+        sketch[key] = sketch.get(key, 0) + count
+
+def sketch_quantile(sketch: dict, q: float, params: Tuple[float, float]):
+    total = sum(sketch.values())
+    if not total:
+        return None
+    low, width = params
+    rank = q * (total - 1)
+    seen = 0
+    for key in sorted(sketch, key=int):
+        seen += sketch[key]
+        if seen > rank:
+            return low + (int(key) + 0.5) * width
+    return None
+
+def bucket_start(timestamp: datetime.datetime, resolution: int) -> datetime.datetime:
+    seconds = int((timestamp - EPOCH).total_seconds())
+    return EPOCH + datetime.timedelta(seconds=seconds - seconds % resolution)
+
+class RollupBucket:
+    __slots__ = ("count", "snr_min", "snr_max", "snr_sum", "rssi_min", "rssi_max", "rssi_sum", "snr_sketch", "rssi_sketch")
+
+    def __init__(self):
+        self.count = 0
+        self.snr_min = self.snr_max = self.rssi_min = self.rssi_max = None
+        self.snr_sum = self.rssi_sum = 0.0
+        self.snr_sketch = {}
+        self.rssi_sketch = {}
+
+    def add(self, snr: float, rssi: float):
+        self.count += 1
+        self.snr_min = snr if self.snr_min is None else min(self.snr_min, snr)
+        self.snr_max = snr if self.snr_max is None else max(self.snr_max, snr)
+        self.rssi_min = rssi if self.rssi_min is None else min(self.rssi_min, rssi)
+        self.rssi_max = rssi if self.rssi_max is None else max(self.rssi_max, rssi)
+        self.snr_sum += snr
+        self.rssi_sum += rssi
+        sketch_add(self.snr_sketch, snr, SNR_SKETCH)
+        sketch_add(self.rssi_sketch, rssi, RSSI_SKETCH)
+
+    def merge(self, other: "RollupBucket") -> "RollupBucket":
+        if not other.count:
+            return self
+        self.snr_min = other.snr_min if self.snr_min is None else min(self.snr_min, other.snr_min)
+        self.snr_max = other.snr_max if self.snr_max is None else max(self.snr_max, other.snr_max)
+        self.rssi_min = other.rssi_min if self.rssi_min is None else min(self.rssi_min, other.rssi_min)
+        self.rssi_max = other.rssi_max if self.rssi_max is None else max(self.rssi_max, other.rssi_max)
+        self.count += other.count
+        self.snr_sum += other.snr_sum
+        self.rssi_sum += other.rssi_sum
+        sketch_merge(self.snr_sketch, other.snr_sketch)
+        sketch_merge(self.rssi_sketch, other.rssi_sketch)
+        return self
+
+    def copy(self) -> "RollupBucket":
+        return RollupBucket().merge(self)
+
+    @classmethod
+    def from_row(cls, row) -> "RollupBucket":
+        bucket = cls()
+        for field in cls.__slots__:
+            value = getattr(row, field)
+            if value is not None:
+                setattr(bucket, field, dict(value) if field.endswith("sketch") else value)
+        return bucket
+
+    def to_row(self, key: tuple) -> dict:
+        resolution, node_id, start = key
+        row = {field: getattr(self, field) for field in self.__slots__}
+        row.update(resolution=resolution, node_id=node_id, bucket_start=start)
+        return row
+
+    def summary(self) -> dict:
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "snr": {"min": self.snr_min, "max": self.snr_max, "mean": self.snr_sum / self.count},
+            "rssi": {"min": self.rssi_min, "max": self.rssi_max, "mean": self.rssi_sum / self.count},
+        }
+
+class LinkQualityRollups:
+    """Incremental per-node (and fleet-wide) SNR/RSSI rollups at several bucket widths.
+
+    The ingest writer folds each committed batch into the open buckets it keeps
+    in memory and upserts the touched rows every ROLLUP_FLUSH_INTERVAL_S, so
+    dashboards never aggregate raw packets.
+    """
+
+    def __init__(self, resolutions: tuple = ROLLUP_RESOLUTIONS, open_buckets: int = ROLLUP_OPEN_BUCKETS):
+        self.resolutions = tuple(sorted(resolutions))
+        self.open_buckets = open_buckets
+        self._buckets: Dict[tuple, RollupBucket] = {} # (resolution, node_id, bucket_start) -> bucket
+        self._newest: Dict[int, datetime.datetime] = {}
+        self._evicted_before: Dict[int, datetime.datetime] = {}
+        self._dirty = set() # Keys changed since the last flush
+        self._flushing = set() # Keys being written by flush, outside the lock
+        self._started_at = datetime.datetime.utcnow()
+        self._lock = threading.Lock()
+
+    def add(self, db: Session, packets: List[dict]):
+        # Folds committed packets into the in-memory buckets; db is only read for buckets that may already be stored
+        contributions: Dict[tuple, RollupBucket] = {}
+        for packet in packets:
+            snr, rssi = packet.get("snr"), packet.get("rssi")
+            if snr is None or rssi is None:
+                continue
+            for resolution in self.resolutions:
+                start = bucket_start(packet["timestamp"], resolution)
+                for node_id in (packet["node_id"], FLEET_NODE_ID):
+                    key = (resolution, node_id, start)
+                    bucket = contributions.get(key)
+                    if bucket is None:
+                        bucket = contributions[key] = RollupBucket()
+                    bucket.add(snr, rssi)
+        if not contributions:
+            return
+        with self._lock:
+            missing = [key for key in contributions if key not in self._buckets and self._may_exist(key)]
+        # Read outside the lock so query() on the event loop never waits on this IO
+        stored = self._load(db, missing) if missing else {}
+        with self._lock:
+            for key, contribution in contributions.items():
+                base = self._buckets.get(key) or stored.get(key)
+                self._buckets[key] = base.merge(contribution) if base else contribution
+                self._dirty.add(key)
+            self._evict(contributions)
+
+    def flush(self, db: Session) -> int:
+        # Upserts every bucket changed since the last flush; the write runs outside the lock
+        with self._lock:
+            if not self._dirty:
+                return 0
+            dirty, self._dirty = self._dirty, set()
+            self._flushing = dirty
+            staged = {key: self._buckets[key].copy() for key in dirty}
+        try:
+            self._upsert(db, staged)
+            db.commit()
+        except Exception:
+            db.rollback()
+            with self._lock:
+                self._dirty |= dirty
+                self._flushing = set()
+            raise
+        with self._lock:
+            self._flushing = set()
+        return len(dirty)
+
+    def _may_exist(self, key: tuple) -> bool:
+        # Buckets opened after startup and never evicted can only live in memory
+        resolution, _, start = key
+        evicted = self._evicted_before.get(resolution)
+        return start <= self._started_at or (evicted is not None and start <= evicted)
+
+    def _load(self, db: Session, keys: List[tuple]) -> Dict[tuple, RollupBucket]:
+        stored = {}
+        wanted = set(keys)
+        for resolution in {key[0] for key in keys}:
+            node_ids = {key[1] for key in keys if key[0] == resolution}
+            starts = {key[2] for key in keys if key[0] == resolution}
+            rows = db.query(models.PacketRollup).filter(
+                models.PacketRollup.resolution == resolution,
+                models.PacketRollup.node_id.in_(node_ids),
+                models.PacketRollup.bucket_start.in_(starts),
+            ).all()
+            for row in rows:
+                key = (row.resolution, row.node_id, row.bucket_start)
+                if key in wanted:
+                    stored[key] = RollupBucket.from_row(row)
+        return stored
+
+    def _upsert(self, db: Session, staged: Dict[tuple, RollupBucket]):
+        table = models.PacketRollup.__table__
+        rows = [bucket.to_row(key) for key, bucket in staged.items()]
+        dialect = db.get_bind().dialect.name
+        if dialect in ("sqlite", "postgresql"):
+            if dialect == "sqlite":
+                from sqlalchemy.dialects.sqlite import insert as dialect_insert
+            else:
+                from sqlalchemy.dialects.postgresql import insert as dialect_insert
+            stmt = dialect_insert(table)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["resolution", "node_id", "bucket_start"],
+                set_={field: stmt.excluded[field] for field in RollupBucket.__slots__},
+            )
+            db.execute(stmt, rows)
+            return
+        for row in rows:
+            db.execute(delete(table).where(
+                table.c.resolution == row["resolution"],
+                table.c.node_id == row["node_id"],
+                table.c.bucket_start == row["bucket_start"],
+            ))
+        db.execute(insert(table), rows)
+
+    def _evict(self, touched: Dict[tuple, RollupBucket]):
+        for resolution in self.resolutions:
+            starts = [key[2] for key in touched if key[0] == resolution]
+            if not starts:
+                continue
+            newest = max(starts)
+            if self._newest.get(resolution) is not None and newest <= self._newest[resolution]:
+                continue
+            # A new bucket opened: retire the flushed ones that fell out of the open window
+            self._newest[resolution] = newest
+            cutoff = newest - datetime.timedelta(seconds=resolution * self.open_buckets)
+            expired = [key for key in self._buckets if key[0] == resolution and key[2] < cutoff
+                       and key not in self._dirty and key not in self._flushing]
+            for key in expired:
+                del self._buckets[key]
+            if expired:
+                evicted = max(key[2] for key in expired)
+                self._evicted_before[resolution] = max(evicted, self._evicted_before.get(resolution, evicted))
+
+    def pick_resolution(self, span_seconds: float, interval_seconds: float = None, max_points: int = 300) -> int:
+        # Coarsest stored bucket that is no wider than the requested point spacing
+        wanted = interval_seconds or span_seconds / max_points
+        fitting = [resolution for resolution in self.resolutions if resolution <= wanted]
+        return max(fitting) if fitting else self.resolutions[0]
+
+    def query(self, db: Session, node_id: str = None, start_time: datetime.datetime = None,
+              end_time: datetime.datetime = None, interval_seconds: float = None, max_points: int = 300) -> dict:
+        end_time = end_time or datetime.datetime.utcnow()
+        start_time = start_time or end_time - datetime.timedelta(days=1)
+        resolution = self.pick_resolution((end_time - start_time).total_seconds(), interval_seconds, max_points)
+        rows = db.query(models.PacketRollup).filter(
+            models.PacketRollup.resolution == resolution,
+            models.PacketRollup.node_id == (node_id or FLEET_NODE_ID),
+            models.PacketRollup.bucket_start >= bucket_start(start_time, resolution),
+            models.PacketRollup.bucket_start <= end_time,
+        ).order_by(models.PacketRollup.bucket_start).all()
+        buckets = {row.bucket_start: RollupBucket.from_row(row) for row in rows}
+        with self._lock:
+            # Buckets not flushed (or not committed) yet are newer in memory than in the table
+            for key in self._dirty | self._flushing:
+                if key[0] == resolution and key[1] == (node_id or FLEET_NODE_ID) and bucket_start(start_time, resolution) <= key[2] <= end_time:
+                    buckets[key[2]] = self._buckets[key].copy()
+        total = RollupBucket()
+        series = []
+        for start in sorted(buckets):
+            total.merge(buckets[start])
+            series.append({"bucket_start": start, **buckets[start].summary()})
+        summary = total.summary()
+        if total.count:
+            for q in (0.5, 0.9, 0.99):
+                label = f"p{int(q * 100)}"
+                summary["snr"][label] = sketch_quantile(total.snr_sketch, q, SNR_SKETCH)
+                summary["rssi"][label] = sketch_quantile(total.rssi_sketch, q, RSSI_SKETCH)
+        return {
+            "node_uuid": node_id,
+            "start_time": start_time,
+            "end_time": end_time,
+            "resolution_seconds": resolution,
+            "summary": summary,
+            "series": series,
+        }
+
+link_rollups = LinkQualityRollups()
@@ -0,0 +1,73 @@
+import json
+from typing import List, Optional, Sequence, Tuple
+
+from .mesh_logic.mesh_parser import PACKET_TYPE_OTA_ACK, decode_frames, is_frame, parse_mesh_packet
+
+# Decoding of MQTT uplinks into ingest events. Kept free of DB/app imports so ingest
+# worker processes can load it on their own.
+
+# (kind, node_uuid, gateway_id, sleep_flag, body): kind "packet" carries the packet dict for the
+# ingest pipeline, kind "ack" the raw OTA ack payload for the rollout engine
+UplinkEvent = Tuple[str, str, Optional[str], bool, object]
+
+def _frame_event(topic: str, frame: dict) -> UplinkEvent:
+    # Raw NovaComm frame forwarded as-is by a gateway radio: the node is the frame's source address
+    topic_parts = topic.split('/')
+    node_uuid = frame["source"]
+    gateway_id = topic_parts[1] if len(topic_parts) >= 2 else None
+    if frame["packet_type"] == PACKET_TYPE_OTA_ACK:
+        # OTA control traffic, not telemetry: goes to the rollout engine only
+        return "ack", node_uuid, gateway_id, frame["sleep_flag"], bytes.fromhex(frame["payload"])
+    packet_data = {key: frame[key] for key in ("payload", "packet_id", "ttl", "hop_count", "packet_type", "sleep_flag")}
+    packet_data["dest_addr"] = frame["destination"]
+    packet_data["source_addr"] = frame["source"]
+    if gateway_id:
+        packet_data["gateway_id"] = gateway_id
+    return "packet", node_uuid, gateway_id, frame["sleep_flag"], packet_data
+
+def _json_event(topic: str, payload: bytes) -> UplinkEvent:
+    topic_parts = topic.split('/')
+    try:
+        # Assuming payload is JSON, e.g., {"uuid": "node_X", "payload": "data", "snr": 10.5, "rssi": -70, ...}
+        packet_data = json.loads(payload.decode())
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise ValueError("Non-JSON message")
+    if not isinstance(packet_data, dict):
+        raise ValueError("JSON payload is not an object")
+    node_uuid = packet_data.get("uuid")
+    if node_uuid and len(topic_parts) >= 2 and topic_parts[1] != node_uuid:
+        # Relayed by a gateway publishing under its own id; copies from other gateways are merged on ingest
+        packet_data.setdefault("gateway_id", topic_parts[1])
+    if not node_uuid:
+        # Try to extract uuid from topic if not in payload
+        if len(topic_parts) >= 2: # e.g., novacomm/node_X/rx
+            node_uuid = topic_parts[1]
+        else:
+            raise ValueError("Could not determine node_uuid from topic or payload")
+    return "packet", node_uuid, packet_data.get("gateway_id"), bool(packet_data.get("sleep_flag")), packet_data
+
+def decode_uplink(topic: str, payload: bytes) -> UplinkEvent:
+    # Raises ValueError for anything that is not a usable uplink
+    if is_frame(payload):
+        return _frame_event(topic, parse_mesh_packet(payload))
+    return _json_event(topic, payload)
+
+def decode_uplinks(messages: Sequence[Tuple[str, bytes]]) -> List[Optional[UplinkEvent]]:
+    # Batch form of decode_uplink: None where it would raise. Raw frames go through the
+    # vectorized decoder in one pass instead of one struct/CRC decode each.
+    events: List[Optional[UplinkEvent]] = [None] * len(messages)
+    frame_at = []
+    for i, (topic, payload) in enumerate(messages):
+        if is_frame(payload):
+            frame_at.append(i)
+            continue
+        try:
+            events[i] = _json_event(topic, payload)
+        except ValueError:
+            pass
+    if frame_at:
+        frames = decode_frames([messages[i][1] for i in frame_at]).to_dicts(valid_only=False)
+        for i, frame in zip(frame_at, frames):
+            if frame["status"] == "ok":
+                events[i] = _frame_event(messages[i][0], frame)
+    return events
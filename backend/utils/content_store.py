@@ -0,0 +1,54 @@
+import os
+import tempfile
+from typing import NamedTuple, Optional
+
+from .crypto import sha256_copy
+
+# Files stored under their SHA-256 (root/ab/abcdef...), so identical content is kept once
+CONTENT_STORE_CHUNK_SIZE = 1024 * 1024
+
+class StoredFile(NamedTuple):
+    sha256: str
+    size: int
+    path: str
+    created: bool # False when identical content was already stored
+
+class ContentStore:
+    """A directory of immutable files named by the SHA-256 of their content.
+
+    save() streams a file object into a temp file in the same directory tree,
+    hashing as it copies, then renames it to its digest. The rename is atomic,
+    so readers never see a partial file, and a second upload of the same bytes
+    only costs the copy and is then discarded.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.tmp_dir = os.path.join(root, "tmp")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def path_for(self, sha256: str) -> str:
+        return os.path.join(self.root, sha256[:2], sha256)
+
+    def exists(self, sha256: str) -> bool:
+        return os.path.exists(self.path_for(sha256))
+
+    def save(self, src, max_size: Optional[int] = None) -> StoredFile:
+        # Blocking: run it off the event loop
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as dst:
+                sha256, size = sha256_copy(src, dst, CONTENT_STORE_CHUNK_SIZE, max_size)
+                dst.flush()
+                os.fsync(dst.fileno())
+            path = self.path_for(sha256)
+            if os.path.exists(path):
+                os.unlink(tmp_path)
+                return StoredFile(sha256, size, path, False)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+            return StoredFile(sha256, size, path, True)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
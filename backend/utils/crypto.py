@@ -3,6 +3,21 @@ import hashlib
 def generate_sha256(data: bytes) -> str:
     return hashlib.sha256(data).hexdigest()
 
+def sha256_copy(src, dst, chunk_size: int = 1024 * 1024, max_size: int = None) -> tuple:
+    # Copies file object src into dst chunk by chunk while hashing, so large files are read once and never held in memory.
+    # Returns (hex digest, bytes copied); raises ValueError past max_size.
+    hasher = hashlib.sha256()
+    size = 0
+    while True:
+        chunk = src.read(chunk_size)
+        if not chunk:
+            return hasher.hexdigest(), size
+        size += len(chunk)
+        if max_size is not None and size > max_size:
+            raise ValueError(f"File exceeds {max_size} bytes")
+        hasher.update(chunk)
+        dst.write(chunk)
+
 # Placeholder for ECDSA signing/verification
 async def verify_ecdsa_signature(data: bytes, signature: bytes, public_key: bytes) -> bool:
     print("Simulating ECDSA signature verification")
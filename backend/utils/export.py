@@ -0,0 +1,99 @@
+import csv
+import io
+import json
+from typing import Iterable, Iterator, List
+
+try: # Optional: only needed for the columnar export formats
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# Row streaming encoders for bulk exports. Each takes an iterable of row batches
+# (lists of mappings) and yields encoded chunks, one per batch, so memory stays
+# bounded by the batch size whatever the size of the export.
+
+EXPORT_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+COLUMNAR_FORMATS = ("parquet", "arrow")
+
+def columnar_available() -> bool:
+    return pa is not None
+
+_json_encode = json.JSONEncoder(default=str, check_circular=False, separators=(",", ":")).encode
+
+def encode_ndjson(batches: Iterable[List[dict]]) -> Iterator[bytes]:
+    for batch in batches:
+        yield "".join(_json_encode(dict(row)) + "\n" for row in batch).encode()
+
+def encode_csv(batches: Iterable[List[dict]], columns: List[str]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for batch in batches:
+        writer.writerows([row[column] for column in columns] for row in batch)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode() # Header only, empty export
+
+class _DrainableSink(io.RawIOBase):
+    # Write-only file object whose contents are handed out (and released) after every batch
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self) -> bytes:
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+def _record_batch(batch: List[dict], schema):
+    return pa.RecordBatch.from_pydict({name: [row[name] for row in batch] for name in schema.names}, schema=schema)
+
+def encode_columnar(batches: Iterable[List[dict]], schema, fmt: str) -> Iterator[bytes]:
+    # fmt is "parquet" (one row group per batch) or "arrow" (IPC stream, one record batch per batch)
+    sink = _DrainableSink()
+    writer = pq.ParquetWriter(sink, schema) if fmt == "parquet" else pa.ipc.new_stream(sink, schema)
+    try:
+        for batch in batches:
+            record_batch = _record_batch(batch, schema)
+            if fmt == "parquet":
+                writer.write_table(pa.Table.from_batches([record_batch]))
+            else:
+                writer.write_batch(record_batch)
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.drain()
+
+def packet_arrow_schema():
+    return pa.schema([
+        ("id", pa.int64()),
+        ("node_id", pa.string()),
+        ("timestamp", pa.timestamp("us")),
+        ("payload", pa.string()),
+        ("snr", pa.float64()),
+        ("rssi", pa.float64()),
+        ("source_addr", pa.string()),
+        ("packet_id", pa.int64()),
+        ("gateways", pa.list_(pa.string())),
+    ])
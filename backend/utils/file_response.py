@@ -0,0 +1,115 @@
+import os
+import re
+from email.utils import formatdate
+from typing import Optional, Tuple
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+# File downloads with HTTP range requests, for resumable firmware fetches by gateways
+
+FILE_RESPONSE_CHUNK_SIZE = 256 * 1024
+ZEROCOPY_EXTENSION = "http.response.zerocopysend" # ASGI extension: the server sendfile()s straight from our fd
+
+_BYTE_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    # One byte range -> (first, last) inclusive. None means "send the whole file": multipart ranges and
+    # malformed headers may be ignored that way (RFC 9110 14.2). Raises ValueError when unsatisfiable.
+    match = _BYTE_RANGE.match(header.strip())
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if not first:
+        suffix = int(last) # bytes=-N: the last N bytes
+        if suffix == 0 or size == 0:
+            raise ValueError("Unsatisfiable range")
+        return max(0, size - suffix), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise ValueError("Unsatisfiable range")
+    return start, min(int(last), size - 1) if last else size - 1
+
+def _read_at(f, offset: int, length: int) -> bytes:
+    if hasattr(os, "pread"):
+        return os.pread(f.fileno(), length, offset) # No shared file position, no seek
+    f.seek(offset)
+    return f.read(length)
+
+class RangedFileResponse(Response):
+    """Serves a file with single byte-range support (206/416), ETag/If-None-Match/If-Range and HEAD.
+
+    The body goes out through the ASGI zero-copy send extension when the
+    server offers it, so the kernel copies file pages straight to the socket.
+    Otherwise it is read with pread() in a worker thread, chunk by chunk, and
+    the event loop never blocks on disk.
+    """
+
+    def __init__(self, path: str, request_headers: Headers, media_type: str = "application/octet-stream",
+                 filename: Optional[str] = None, etag: Optional[str] = None, method: str = "GET"):
+        self.path = path
+        self.media_type = media_type
+        self.background = None
+        stat = os.stat(path)
+        size = stat.st_size
+        etag_value = f'"{etag}"' if etag else None
+        headers = {"accept-ranges": "bytes", "last-modified": formatdate(stat.st_mtime, usegmt=True)}
+        if etag_value:
+            headers["etag"] = etag_value
+        if filename:
+            headers["content-disposition"] = f'attachment; filename="{filename}"'
+
+        self.status_code = 200
+        self.start, self.end = 0, size - 1
+        self.send_body = method != "HEAD"
+        if_none_match = request_headers.get("if-none-match")
+        if etag_value and if_none_match and (if_none_match.strip() == "*" or etag_value in if_none_match):
+            self.status_code = 304
+            self.send_body = False
+        else:
+            range_header = request_headers.get("range")
+            if_range = request_headers.get("if-range")
+            if range_header and (if_range is None or if_range == etag_value): # A stale If-Range gets the full, new file
+                try:
+                    byte_range = parse_range(range_header, size)
+                except ValueError:
+                    self.status_code = 416
+                    self.send_body = False
+                    self.start, self.end = 0, -1
+                    headers["content-range"] = f"bytes */{size}"
+                else:
+                    if byte_range is not None:
+                        self.status_code = 206
+                        self.start, self.end = byte_range
+                        headers["content-range"] = f"bytes {self.start}-{self.end}/{size}"
+            if self.status_code != 304:
+                headers["content-length"] = str(self.end - self.start + 1)
+        self.init_headers(headers)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        count = self.end - self.start + 1
+        if not self.send_body or count <= 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        f = await anyio.to_thread.run_sync(open, self.path, "rb")
+        try:
+            if ZEROCOPY_EXTENSION in scope.get("extensions", {}):
+                await send({"type": ZEROCOPY_EXTENSION, "file": f, "offset": self.start, "count": count, "more_body": False})
+                return
+            offset, remaining = self.start, count
+            while remaining > 0:
+                chunk = await anyio.to_thread.run_sync(_read_at, f, offset, min(FILE_RESPONSE_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break # Truncated underneath us; content-length is already sent, so just end the body
+                offset += len(chunk)
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            f.close()
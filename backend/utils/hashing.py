@@ -0,0 +1,92 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from passlib.context import CryptContext
+
+# Password hashing pool settings
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", min(4, os.cpu_count() or 1)))
+PASSWORD_HASH_MAX_PENDING = int(os.environ.get("PASSWORD_HASH_MAX_PENDING", 8 * PASSWORD_HASH_WORKERS)) # Queued + running async jobs before rejecting
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+class PasswordHasherBusy(Exception):
+    pass
+
+class PasswordHasher:
+    """Runs bcrypt on a small dedicated thread pool instead of the caller's thread.
+
+    bcrypt releases the GIL, so a few threads keep the event loop and the
+    request threadpool responsive while hashes are computed. Async callers are
+    rejected with PasswordHasherBusy once max_pending jobs are queued, so a
+    login burst cannot build an unbounded backlog.
+    """
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_pending: int = PASSWORD_HASH_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self._pending = 0
+        self._lock = threading.Lock()
+        self.stats = {"submitted": 0, "rejected": 0, "completed": 0, "max_pending": 0,
+                      "wait_ms_total": 0.0, "max_wait_ms": 0.0, "run_ms_total": 0.0}
+
+    def _admit(self, bounded: bool):
+        with self._lock:
+            if bounded and self._pending >= self.max_pending:
+                self.stats["rejected"] += 1
+                raise PasswordHasherBusy()
+            self._pending += 1
+            self.stats["submitted"] += 1
+            self.stats["max_pending"] = max(self.stats["max_pending"], self._pending)
+
+    def _run(self, fn, args, submitted_at: float):
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            finished = time.perf_counter()
+            wait_ms = (started - submitted_at) * 1000
+            with self._lock:
+                self._pending -= 1
+                self.stats["completed"] += 1
+                self.stats["wait_ms_total"] += wait_ms
+                self.stats["max_wait_ms"] = max(self.stats["max_wait_ms"], wait_ms)
+                self.stats["run_ms_total"] += (finished - started) * 1000
+
+    def submit(self, fn, *args, bounded: bool = False):
+        self._admit(bounded)
+        return self._executor.submit(self._run, fn, args, time.perf_counter())
+
+    async def run(self, fn, *args):
+        # Awaitable, bounded: raises PasswordHasherBusy instead of queueing past max_pending
+        return await asyncio.wrap_future(self.submit(fn, *args, bounded=True))
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["pending"] = self._pending
+        completed = stats["completed"]
+        stats["avg_wait_ms"] = round(stats["wait_ms_total"] / completed, 3) if completed else 0.0
+        stats["avg_run_ms"] = round(stats["run_ms_total"] / completed, 3) if completed else 0.0
+        stats["workers"] = self.workers
+        stats["max_pending_allowed"] = self.max_pending
+        return stats
+
+password_hasher = PasswordHasher()
+
+# Sync helpers for code already running off the event loop (crud, sync endpoints):
+# they still go through the pool so bcrypt concurrency stays capped, but wait instead of failing.
+def get_password_hash(password: str) -> str:
+    return password_hasher.submit(pwd_context.hash, password).result()
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return password_hasher.submit(pwd_context.verify, plain_password, hashed_password).result()
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await password_hasher.run(pwd_context.verify, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    return await password_hasher.run(pwd_context.hash, password)
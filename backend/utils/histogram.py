@@ -0,0 +1,50 @@
+import bisect
+from typing import Dict, List, Sequence
+
+class Histogram:
+    """Fixed-bucket histogram: constant memory, O(log buckets) per sample, percentiles to bucket resolution.
+
+    Not thread-safe; callers record under their own stats lock.
+    """
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds: List[float] = sorted(bounds) # Upper bound of each bucket; one overflow bucket past the last
+        self.counts: List[int] = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    @classmethod
+    def exponential(cls, start: float, factor: float, buckets: int) -> "Histogram":
+        return cls([start * factor ** i for i in range(buckets)])
+
+    def record(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q: float) -> float:
+        # Upper bound of the bucket holding the q-quantile (the observed max for the overflow bucket)
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self) -> Dict:
+        return {
+            "count": self.count,
+            "mean": round(self.total / self.count, 3) if self.count else 0.0,
+            "p50": round(self.percentile(0.50), 3),
+            "p90": round(self.percentile(0.90), 3),
+            "p99": round(self.percentile(0.99), 3),
+            "max": round(self.max, 3),
+            "buckets": {f"<={bound:g}": count for bound, count in zip(self.bounds, self.counts) if count}
+                       | ({f">{self.bounds[-1]:g}": self.counts[-1]} if self.counts[-1] else {}),
+        }
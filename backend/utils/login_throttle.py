@@ -0,0 +1,79 @@
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+# Failed-login throttling settings
+LOGIN_FAILURE_WINDOW_S = float(os.environ.get("LOGIN_FAILURE_WINDOW_S", 300))
+LOGIN_MAX_FAILURES_PER_USER = int(os.environ.get("LOGIN_MAX_FAILURES_PER_USER", 5))
+LOGIN_MAX_FAILURES_PER_IP = int(os.environ.get("LOGIN_MAX_FAILURES_PER_IP", 20))
+LOGIN_LOCKOUT_S = float(os.environ.get("LOGIN_LOCKOUT_S", 60)) # Doubles with every further failure, capped at the window
+LOGIN_THROTTLE_MAX_KEYS = 100000
+
+class LoginThrottle:
+    """Failed-login counters per username and per client address.
+
+    check() is a dict lookup done before any DB query or bcrypt work, so a
+    locked-out brute force costs almost nothing and never reaches the hashing pool.
+    """
+
+    def __init__(self, window_s: float = LOGIN_FAILURE_WINDOW_S, max_per_user: int = LOGIN_MAX_FAILURES_PER_USER,
+                 max_per_ip: int = LOGIN_MAX_FAILURES_PER_IP, lockout_s: float = LOGIN_LOCKOUT_S):
+        self.window_s = window_s
+        self.limits = {"user": max_per_user, "ip": max_per_ip}
+        self.lockout_s = lockout_s
+        self._failures: Dict[tuple, list] = {} # (kind, value) -> [failures, window start, locked until]
+        self._lock = threading.Lock()
+        self.stats = {"failures": 0, "rejected": 0, "lockouts": 0}
+
+    def _keys(self, username: str, client_ip: Optional[str]):
+        keys = [("user", username.lower())]
+        if client_ip:
+            keys.append(("ip", client_ip))
+        return keys
+
+    def check(self, username: str, client_ip: Optional[str] = None) -> float:
+        # Seconds the caller must wait, 0 if the attempt may proceed
+        now = time.monotonic()
+        with self._lock:
+            wait = 0.0
+            for key in self._keys(username, client_ip):
+                entry = self._failures.get(key)
+                if entry is not None and entry[2] > now:
+                    wait = max(wait, entry[2] - now)
+            if wait:
+                self.stats["rejected"] += 1
+            return wait
+
+    def record_failure(self, username: str, client_ip: Optional[str] = None):
+        now = time.monotonic()
+        with self._lock:
+            self.stats["failures"] += 1
+            if len(self._failures) >= LOGIN_THROTTLE_MAX_KEYS:
+                self._prune(now)
+            for key in self._keys(username, client_ip):
+                entry = self._failures.get(key)
+                if entry is None or now - entry[1] > self.window_s:
+                    entry = self._failures[key] = [0, now, 0.0]
+                entry[0] += 1
+                excess = entry[0] - self.limits[key[0]]
+                if excess >= 0:
+                    entry[2] = now + min(self.lockout_s * 2 ** excess, self.window_s)
+                    self.stats["lockouts"] += 1
+
+    def record_success(self, username: str, client_ip: Optional[str] = None):
+        # A correct password clears the user's counter; the address keeps its history
+        with self._lock:
+            self._failures.pop(("user", username.lower()), None)
+
+    def _prune(self, now: float):
+        for key in [key for key, entry in self._failures.items() if now - entry[1] > self.window_s and entry[2] <= now]:
+            del self._failures[key]
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["tracked_keys"] = len(self._failures)
+        return stats
+
+login_throttle = LoginThrottle()
@@ -0,0 +1,39 @@
+import base64
+import datetime
+import json
+
+from fastapi import HTTPException, Response, status
+from sqlalchemy import and_, or_
+
+# Opaque keyset cursors: base64 of the sort key of the last row on a page
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def encode_cursor(*values) -> str:
+    payload = [value.isoformat() if isinstance(value, datetime.datetime) else value for value in values]
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str, *types) -> tuple:
+    # types are the expected key types, e.g. decode_cursor(c, datetime.datetime, int)
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return tuple(
+            datetime.datetime.fromisoformat(value) if kind is datetime.datetime else kind(value)
+            for kind, value in zip(types, values, strict=True)
+        )
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+def seek_after(columns: list, values: tuple, descending: bool = False):
+    # Row-value comparison (a, b) > (x, y) spelled out so every backend can use the index
+    clauses = []
+    for i, (column, value) in enumerate(zip(columns, values)):
+        step = column < value if descending else column > value
+        clauses.append(and_(*[columns[j] == values[j] for j in range(i)], step))
+    return or_(*clauses)
+
+def set_next_cursor(response: Response, items: list, limit: int, key):
+    # A full page means there may be more; key(item) returns the sort key tuple
+    if items and len(items) >= limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(*key(items[-1]))
@@ -0,0 +1,76 @@
+import math
+from typing import Dict, Hashable, List, Set, Tuple
+
+class TimerWheel:
+    """Hashed timing wheel: O(1) arm/re-arm/cancel, expiry cost proportional to the timers due.
+
+    Deadlines are bucketed into `slots` buckets of `tick` seconds; a deadline more
+    than one revolution away simply survives its slot until the right lap.
+    Re-arming to a later deadline, which is what every packet from a live node
+    does, only updates the deadline; the timer is moved when its old slot comes
+    round. Not thread-safe; callers hold their own lock.
+    """
+
+    def __init__(self, tick: float = 1.0, slots: int = 512):
+        self.tick = tick
+        self.slots: List[Set[Hashable]] = [set() for _ in range(slots)]
+        self._deadlines: Dict[Hashable, float] = {}
+        self._filed: Dict[Hashable, int] = {} # key -> tick number of the slot it sits in
+        self._current = None # Last tick number processed
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._deadlines
+
+    def _file(self, key: Hashable, deadline: float):
+        tick = max(math.ceil(deadline / self.tick), (self._current or 0) + 1) # Never behind the hand
+        self._filed[key] = tick
+        self.slots[tick % len(self.slots)].add(key)
+
+    def schedule(self, key: Hashable, deadline: float):
+        filed = self._filed.get(key)
+        self._deadlines[key] = deadline
+        if filed is None:
+            self._file(key, deadline)
+        elif math.ceil(deadline / self.tick) < filed: # Earlier than where it is filed: move it now
+            self.slots[filed % len(self.slots)].discard(key)
+            self._file(key, deadline)
+
+    def cancel(self, key: Hashable) -> bool:
+        filed = self._filed.pop(key, None)
+        if filed is None:
+            return False
+        self.slots[filed % len(self.slots)].discard(key)
+        del self._deadlines[key]
+        return True
+
+    def deadline(self, key: Hashable) -> float:
+        return self._deadlines.get(key)
+
+    def advance(self, now: float) -> List[Tuple[Hashable, float]]:
+        # Fire everything due by `now`: [(key, deadline)], each timer at most once
+        target = math.floor(now / self.tick)
+        if self._current is None:
+            self._current = target - len(self.slots) # First call: sweep a whole lap for timers armed before it
+        expired = []
+        # A long pause only needs one lap: every slot gets visited once
+        first = max(self._current + 1, target - len(self.slots) + 1)
+        for tick in range(first, target + 1):
+            slot = self.slots[tick % len(self.slots)]
+            for key in list(slot):
+                filed = self._filed[key]
+                if filed > target:
+                    continue # A later lap
+                slot.discard(key)
+                deadline = self._deadlines[key]
+                if deadline <= now:
+                    del self._filed[key], self._deadlines[key]
+                    expired.append((key, deadline))
+                else:
+                    self._filed.pop(key)
+                    self._current = tick # Re-file relative to this slot, not one we have already passed
+                    self._file(key, deadline)
+        self._current = target
+        return expired
@@ -1,20 +1,17 @@
+import os
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import jwt
-from passlib.context import CryptContext
 
-SECRET_KEY = "your-super-secret-key" # CHANGE THIS IN PRODUCTION
+# Get SECRET_KEY from environment variable; tokens are signed and verified with the same key
+# IMPORTANT: Set this environment variable in your deployment environment!
+SECRET_KEY = os.environ.get("NOVCOMM_SECRET_KEY", "super-secret-default-key-please-change-me")
+if SECRET_KEY == "super-secret-default-key-please-change-me":
+    print("WARNING: NOVCOMM_SECRET_KEY environment variable not set. Using a default key. \n"
+          "This is INSECURE for production. Please set NOVCOMM_SECRET_KEY to a strong, random value.")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
-def get_password_hash(password):
-    return pwd_context.hash(password)
-
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
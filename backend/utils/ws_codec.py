@@ -0,0 +1,142 @@
+import datetime
+import json
+from typing import Dict, Iterable, Optional, Union
+
+try: # Optional: binary WebSocket encodings
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+# WebSocket message encodings. A client picks one at connect time with the
+# Sec-WebSocket-Protocol header ("novacomm.msgpack") or ?encoding=msgpack.
+# JSON goes out as text frames, the binary encodings as binary frames.
+
+SUBPROTOCOL_PREFIX = "novacomm."
+DEFAULT_ENCODING = "json"
+
+_json_encode = json.JSONEncoder(default=str, check_circular=False, separators=(",", ":")).encode
+
+def _as_utc(value: datetime.datetime) -> datetime.datetime:
+    # Stored timestamps are naive UTC
+    return value if value.tzinfo else value.replace(tzinfo=datetime.timezone.utc)
+
+def _msgpack_default(value):
+    if isinstance(value, datetime.datetime):
+        return msgpack.Timestamp.from_datetime(_as_utc(value)) # Timestamp extension (-1), decoded to a Date by JS clients
+    return str(value)
+
+def _cbor_default(encoder, value):
+    encoder.encode(str(value))
+
+def encode_json(message: dict) -> str:
+    return _json_encode(message)
+
+def encode_msgpack(message: dict) -> bytes:
+    return msgpack.packb(message, default=_msgpack_default, use_bin_type=True)
+
+def encode_cbor(message: dict) -> bytes:
+    return cbor2.dumps(message, default=_cbor_default, timezone=datetime.timezone.utc, datetime_as_timestamp=True)
+
+ENCODERS = {"json": encode_json, "msgpack": encode_msgpack, "cbor": encode_cbor}
+
+def decode(payload: Union[str, bytes], encoding: str = DEFAULT_ENCODING):
+    # Client control messages: text frames are always JSON, binary frames use the connection's encoding
+    if isinstance(payload, str) or encoding == "json":
+        return json.loads(payload)
+    if encoding == "msgpack":
+        return msgpack.unpackb(payload, raw=False)
+    return cbor2.loads(payload)
+
+def available_encodings() -> list:
+    return [name for name, module in (("json", json), ("msgpack", msgpack), ("cbor", cbor2)) if module is not None]
+
+def negotiate(subprotocols: Iterable[str], requested: Optional[str] = None) -> tuple:
+    # Returns (encoding, subprotocol to echo back or None); the first offered subprotocol we support wins
+    available = available_encodings()
+    for subprotocol in subprotocols:
+        if subprotocol.startswith(SUBPROTOCOL_PREFIX) and subprotocol[len(SUBPROTOCOL_PREFIX):] in available:
+            return subprotocol[len(SUBPROTOCOL_PREFIX):], subprotocol
+    if requested in available:
+        return requested, None
+    return DEFAULT_ENCODING, None
+
+class EncodedMessage:
+    """One outgoing message, encoded at most once per format however many clients receive it."""
+
+    __slots__ = ("type", "data", "node_id", "_encoded")
+
+    def __init__(self, message_type: str, data: dict, node_id: Optional[str] = None):
+        self.type = message_type
+        self.data = data
+        self.node_id = node_id
+        self._encoded: Dict[str, Union[str, bytes]] = {}
+
+    def prepare(self, encodings: Iterable[str]) -> "EncodedMessage":
+        # Called on the publishing thread so the event loop only hands out ready frames
+        for encoding in encodings:
+            self.encoded(encoding)
+        return self
+
+    def encoded(self, encoding: str) -> Union[str, bytes]:
+        frame = self._encoded.get(encoding)
+        if frame is None:
+            frame = self._encoded[encoding] = ENCODERS[encoding]({"type": self.type, "data": self.data})
+        return frame
+
+# Benchmark: bytes on the wire and encode CPU per format, raw and through permessage-deflate
+BENCHMARK_MESSAGES_PER_S = 70 # ~2k nodes at 1 packet/min: one node update plus one packet each
+
+def _sample_messages(count: int) -> list:
+    import random
+    now = datetime.datetime(2026, 1, 1)
+    messages = []
+    for i in range(count):
+        node = f"node-{i % 2000:04d}"
+        seen = now + datetime.timedelta(seconds=i * 0.5)
+        messages.append({"type": "new_packet", "data": {
+            "id": 100000 + i, "node_id": node, "timestamp": seen, "payload": f"temp={random.uniform(-10, 40):.2f};bat={random.randint(3000, 4200)}",
+            "snr": round(random.uniform(-20, 12), 2), "rssi": float(random.randint(-130, -40)), "source_addr": node,
+            "packet_id": i % 65536, "gateways": [{"gateway_id": f"gw-{i % 7}", "snr": round(random.uniform(-20, 12), 2), "rssi": float(random.randint(-130, -40))}]}})
+        messages.append({"type": "node_update", "data": {
+            "id": i % 2000, "uuid": node, "name": f"Node {node}", "status": "online", "last_seen": seen,
+            "lat": 48.1 + random.random(), "lng": 11.5 + random.random(), "mode": "normal", "tx_power": 14,
+            "freq": 868.1, "bandwidth": 125.0, "ai_model": None, "firmware": "1.4.2", "configuration": {}}})
+    return messages
+
+def run_benchmark(count: int = 5000, messages_per_s: int = BENCHMARK_MESSAGES_PER_S) -> Dict[str, dict]:
+    import time
+    import zlib
+
+    messages = _sample_messages(count // 2)
+    results = {}
+    for encoding in available_encodings():
+        encoder = ENCODERS[encoding]
+        started = time.process_time()
+        frames = [encoder(message) for message in messages]
+        encode_s = time.process_time() - started
+        raw = [frame.encode() if isinstance(frame, str) else frame for frame in frames]
+        # permessage-deflate with context takeover: one raw-deflate stream, sync-flushed per message
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        started = time.process_time()
+        deflated = sum(len(compressor.compress(frame) + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4 for frame in raw)
+        deflate_s = time.process_time() - started
+        raw_bytes = sum(len(frame) for frame in raw)
+        results[encoding] = {
+            "bytes_per_msg": round(raw_bytes / len(raw), 1),
+            "deflated_bytes_per_msg": round(deflated / len(raw), 1),
+            "bytes_per_s": round(raw_bytes / len(raw) * messages_per_s),
+            "deflated_bytes_per_s": round(deflated / len(raw) * messages_per_s),
+            "encode_us_per_msg": round(encode_s / len(raw) * 1e6, 2),
+            "deflate_us_per_msg": round(deflate_s / len(raw) * 1e6, 2),
+        }
+    return results
+
+if __name__ == "__main__":
+    results = run_benchmark()
+    baseline = results["json"]["bytes_per_s"]
+    for encoding, result in results.items():
+        print(f"{encoding:>8}: {result} ({result['deflated_bytes_per_s'] / baseline:.0%} of raw JSON bytes)")
@@ -1,27 +1,268 @@
 from fastapi import WebSocket, WebSocketDisconnect
-from typing import List
-import json
+from typing import Dict, List, Optional
+import asyncio
+import os
+
+from .utils.ws_codec import DEFAULT_ENCODING, EncodedMessage, decode, negotiate
+
+# Per-client send queue settings
+WS_SEND_QUEUE_SIZE = int(os.environ.get("WS_SEND_QUEUE_SIZE", 256))
+WS_SLOW_CLIENT_POLICY = os.environ.get("WS_SLOW_CLIENT_POLICY", "drop_oldest") # "drop_oldest" or "disconnect"
+WS_FRAME_INTERVAL_MS = int(os.environ.get("WS_FRAME_INTERVAL_MS", 250)) # Node updates are coalesced per node within one frame
+
+# Node state messages that are coalesced per frame and, for subscribed clients, sent as field deltas
+NODE_STATE_TYPES = ("new_node", "node_update")
+
+class ClientConnection:
+    def __init__(self, websocket: WebSocket, queue_size: int, encoding: str = DEFAULT_ENCODING):
+        self.websocket = websocket
+        self.encoding = encoding
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.writer = None
+        self.dropped = 0
+        self.closing = False # Set once a close is scheduled; nothing more is queued for it
+        # None means everything. Clients that never subscribe get the legacy full node_update stream.
+        self.types: Optional[set] = None
+        self.nodes: Optional[set] = None
+        self.deltas = False
+
+    def subscribe(self, types: Optional[list] = None, nodes: Optional[list] = None):
+        self.types = set(types) if types is not None else None
+        if self.types is not None and "node_update" in self.types:
+            self.types.add("node_delta")
+        self.nodes = set(nodes) if nodes is not None else None
+        self.deltas = True
+
+    def wants(self, message_type: str, node_id: Optional[str]) -> bool:
+        if self.types is not None and message_type not in self.types:
+            return False
+        # Messages not tied to a node (jobs, alerts without node_id) pass the node filter
+        return self.nodes is None or node_id is None or node_id in self.nodes
 
 class ConnectionManager:
-    def __init__(self):
+    """Broadcast hub: every message is serialized once per encoding in use and
+    pushed into bounded per-connection queues, each drained by its own writer
+    task, so a slow client only ever delays itself.
+
+    Clients may send {"action": "subscribe", "types": [...], "nodes": [...]} to
+    receive only those message types and node ids. Node state changes are merged
+    per node for one frame interval; subscribed clients then get one node_delta
+    with just the changed fields, legacy clients one full node_update.
+    """
+
+    def __init__(self, queue_size: int = WS_SEND_QUEUE_SIZE, slow_client_policy: str = WS_SLOW_CLIENT_POLICY,
+                 frame_interval_ms: int = WS_FRAME_INTERVAL_MS):
         self.active_connections: List[WebSocket] = []
+        self.clients: Dict[WebSocket, ClientConnection] = {}
+        self.queue_size = queue_size
+        self.slow_client_policy = slow_client_policy
+        self.frame_interval = frame_interval_ms / 1000.0
+        self.loop = None
+        self._node_state: Dict[str, dict] = {} # uuid -> node as last sent, the base for deltas
+        self._pending_nodes: Dict[str, list] = {} # uuid -> [message type, latest node, changed fields]
+        self._frame_scheduled = False
+        self.encodings = (DEFAULT_ENCODING,) # Encodings of connected clients, read by publishing threads
+        self.stats = {"published": 0, "dropped_messages": 0, "slow_disconnects": 0,
+                      "node_updates": 0, "coalesced_node_updates": 0, "node_deltas": 0, "filtered_messages": 0}
+
+    def bind_loop(self, loop: asyncio.AbstractEventLoop):
+        # The loop that owns the websockets; publishes from other threads are handed to it
+        self.loop = loop
 
     async def connect(self, websocket: WebSocket):
-        await websocket.accept()
+        # Encoding from the Sec-WebSocket-Protocol offer ("novacomm.msgpack") or ?encoding=
+        encoding, subprotocol = negotiate(websocket.scope.get("subprotocols", []), websocket.query_params.get("encoding"))
+        await websocket.accept(subprotocol=subprotocol)
+        self.bind_loop(asyncio.get_running_loop())
+        client = ClientConnection(websocket, self.queue_size, encoding)
+        client.writer = asyncio.create_task(self._writer(client))
+        self.clients[websocket] = client
         self.active_connections.append(websocket)
+        self._update_encodings()
+
+    def _update_encodings(self):
+        self.encodings = tuple(sorted({client.encoding for client in self.clients.values()})) or (DEFAULT_ENCODING,)
 
     def disconnect(self, websocket: WebSocket):
+        client = self.clients.pop(websocket, None)
+        if client is None:
+            return
         self.active_connections.remove(websocket)
+        self._update_encodings()
+        if not self.clients:
+            # Nothing is published while nobody listens, so the delta base would go stale
+            self._node_state.clear()
+            self._pending_nodes.clear()
+        if client.writer and client.writer is not asyncio.current_task():
+            client.writer.cancel()
 
     async def send_personal_message(self, message: str, websocket: WebSocket):
         await websocket.send_text(message)
 
-    async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            await connection.send_text(message)
+    async def _writer(self, client: ClientConnection):
+        try:
+            while True:
+                frame = (await client.queue.get()).encoded(client.encoding)
+                if isinstance(frame, str):
+                    await client.websocket.send_text(frame)
+                else:
+                    await client.websocket.send_bytes(frame)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Socket went away mid-send; the receive loop will see the disconnect too
+            self.disconnect(client.websocket)
+
+    async def _close_slow_client(self, client: ClientConnection):
+        self.disconnect(client.websocket)
+        try:
+            await client.websocket.close(code=1013) # Try again later
+        except Exception:
+            pass
+
+    def _send(self, client: ClientConnection, message: EncodedMessage):
+        if client.closing:
+            return
+        try:
+            client.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            if self.slow_client_policy == "disconnect":
+                client.closing = True # Later messages in this pass must not schedule a second close
+                self.stats["slow_disconnects"] += 1
+                asyncio.create_task(self._close_slow_client(client))
+            else:
+                client.queue.get_nowait()
+                client.queue.put_nowait(message)
+                client.dropped += 1
+                self.stats["dropped_messages"] += 1
+
+    def _enqueue(self, message: EncodedMessage):
+        # Must run on the event loop thread
+        self.stats["published"] += 1
+        for client in list(self.clients.values()):
+            if client.wants(message.type, message.node_id):
+                self._send(client, message)
+            else:
+                self.stats["filtered_messages"] += 1
+
+    def _enqueue_node(self, message_type: str, node: dict):
+        # Must run on the event loop thread. Merges into this frame's pending change for the node.
+        uuid = node.get("uuid")
+        if uuid is None:
+            return
+        self.stats["node_updates"] += 1
+        previous = self._node_state.get(uuid)
+        changes = {key: value for key, value in node.items() if key != "uuid" and (previous is None or previous.get(key) != value)}
+        self._node_state[uuid] = node
+        pending = self._pending_nodes.get(uuid)
+        if pending is None:
+            self._pending_nodes[uuid] = [message_type, node, changes]
+        else:
+            self.stats["coalesced_node_updates"] += 1
+            pending[1] = node
+            pending[2].update(changes) # A new_node stays a new_node until it is sent
+        if not self._frame_scheduled:
+            self._frame_scheduled = True
+            asyncio.get_running_loop().call_later(self.frame_interval, self._flush_nodes)
+
+    def _flush_nodes(self):
+        self._frame_scheduled = False
+        pending, self._pending_nodes = self._pending_nodes, {}
+        clients = list(self.clients.values())
+        for uuid, (message_type, node, changes) in pending.items():
+            full = None
+            delta = None
+            for client in clients:
+                if client.deltas and message_type == "node_update":
+                    if not changes or not client.wants("node_delta", uuid):
+                        continue
+                    if delta is None:
+                        delta = EncodedMessage("node_delta", {"uuid": uuid, "changes": changes}, uuid)
+                        self.stats["node_deltas"] += 1
+                    self._send(client, delta)
+                elif client.wants(message_type, uuid):
+                    if full is None:
+                        full = EncodedMessage(message_type, node, uuid)
+                    self._send(client, full)
+
+    def forget_node(self, uuid: str):
+        self._node_state.pop(uuid, None)
+        self._pending_nodes.pop(uuid, None)
+
+    def handle_message(self, websocket: WebSocket, payload):
+        # Control messages from a client; replies go through its own send queue
+        client = self.clients.get(websocket)
+        if client is None:
+            return
+        try:
+            message = decode(payload, client.encoding)
+            action = message.get("action")
+        except Exception:
+            self._send(client, EncodedMessage("error", {"detail": f"Expected a {client.encoding} object"}))
+            return
+        if action == "subscribe":
+            types, nodes = message.get("types"), message.get("nodes")
+            if not all(value is None or (isinstance(value, list) and all(isinstance(item, str) for item in value)) for value in (types, nodes)):
+                self._send(client, EncodedMessage("error", {"detail": "types and nodes must be lists of strings"}))
+                return
+            client.subscribe(types, nodes)
+            self._send(client, EncodedMessage("subscribed", {"types": sorted(client.types) if client.types is not None else None,
+                                                             "nodes": sorted(client.nodes) if client.nodes is not None else None,
+                                                             "frame_interval_ms": self.frame_interval * 1000,
+                                                             "encoding": client.encoding}))
+        else:
+            self._send(client, EncodedMessage("error", {"detail": f"Unknown action: {action}"}))
+
+    async def broadcast(self, message: EncodedMessage):
+        self._enqueue(message)
+
+    def call_on_loop(self, fn, *args):
+        # Thread-safe entry point for sync code (MQTT thread, threadpool endpoints): runs fn on the websocket loop
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            fn(*args)
+        else:
+            loop.call_soon_threadsafe(fn, *args)
+
+    def publish(self, message: EncodedMessage):
+        self.call_on_loop(self._enqueue, message)
+
+    def publish_node(self, message_type: str, node: dict):
+        self.call_on_loop(self._enqueue_node, message_type, node)
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats)
+        stats["connections"] = len(self.clients)
+        stats["max_client_queue_depth"] = max((client.queue.qsize() for client in self.clients.values()), default=0)
+        stats["slow_client_policy"] = self.slow_client_policy
+        stats["subscribed_clients"] = sum(1 for client in self.clients.values() if client.deltas)
+        stats["frame_interval_ms"] = self.frame_interval * 1000
+        stats["encodings"] = {encoding: sum(1 for client in self.clients.values() if client.encoding == encoding) for encoding in self.encodings}
+        return stats
 
 manager = ConnectionManager()
 
+def _node_of(data: dict) -> Optional[str]:
+    # Node id used for subscription filtering: packets/logs carry node_id, node objects their uuid
+    return data.get("node_id") or data.get("uuid")
+
 async def broadcast_update(message_type: str, data: dict):
-    message = {"type": message_type, "data": data}
-    await manager.broadcast(json.dumps(message))
+    await manager.broadcast(EncodedMessage(message_type, data, _node_of(data)))
+
+def publish_update(message_type: str, data: dict):
+    # Use this instead of asyncio.run(broadcast_update(...)) from sync code
+    if message_type == "node_deleted":
+        manager.call_on_loop(manager.forget_node, data["uuid"])
+    if not manager.clients:
+        return
+    if message_type in NODE_STATE_TYPES:
+        manager.publish_node(message_type, dict(data)) # Copied: registry entries keep changing on other threads
+        return
+    # Encoded here, on the publishing thread, once for each encoding a client is using
+    manager.publish(EncodedMessage(message_type, data, _node_of(data)).prepare(manager.encodings))
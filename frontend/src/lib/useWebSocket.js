@@ -1,17 +1,29 @@
 import { useEffect, useState } from 'react';
+import { decode, encode } from '@msgpack/msgpack';
 
-const useWebSocket = (url) => {
+// subscription: { types: [...], nodes: [...] } (either may be omitted for "all").
+// Subscribed clients receive node_update as coalesced node_delta messages ({ uuid, changes }).
+// Liveness arrives once per tick as node_status ({ online: [uuid], offline: [uuid], last_seen: { uuid: time } }).
+// encoding: 'json' (text frames) or 'msgpack' (binary frames, timestamps arrive as Date objects).
+const useWebSocket = (url, subscription = null, encoding = 'json') => {
   const [message, setMessage] = useState(null);
+  const subscriptionKey = subscription ? JSON.stringify(subscription) : null;
 
   useEffect(() => {
-    const ws = new WebSocket(url);
+    const binary = encoding === 'msgpack';
+    const ws = binary ? new WebSocket(url, ['novacomm.msgpack']) : new WebSocket(url);
+    ws.binaryType = 'arraybuffer';
 
     ws.onopen = () => {
       console.log('WebSocket connected');
+      if (subscriptionKey) {
+        const request = { action: 'subscribe', ...JSON.parse(subscriptionKey) };
+        ws.send(binary ? encode(request) : JSON.stringify(request));
+      }
     };
 
     ws.onmessage = (event) => {
-      setMessage(JSON.parse(event.data));
+      setMessage(typeof event.data === 'string' ? JSON.parse(event.data) : decode(new Uint8Array(event.data)));
     };
 
     ws.onclose = () => {
@@ -25,9 +37,25 @@ const useWebSocket = (url) => {
     return () => {
       ws.close();
     };
-  }, [url]);
+  }, [url, subscriptionKey, encoding]);
 
   return message;
 };
 
+export const applyNodeDelta = (nodes, delta) =>
+  nodes.map((node) => (node.uuid === delta.uuid ? { ...node, ...delta.changes } : node));
+
+export const applyNodeStatus = (nodes, update) => {
+  const online = new Set(update.online);
+  const offline = new Set(update.offline);
+  return nodes.map((node) => {
+    const lastSeen = update.last_seen[node.uuid];
+    if (!online.has(node.uuid) && !offline.has(node.uuid) && lastSeen === undefined) {
+      return node;
+    }
+    const status = online.has(node.uuid) ? 'online' : offline.has(node.uuid) ? 'offline' : node.status;
+    return { ...node, status, last_seen: lastSeen === undefined ? node.last_seen : lastSeen };
+  });
+};
+
 export default useWebSocket;
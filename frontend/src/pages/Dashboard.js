@@ -1,6 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import { getNodes, getPackets } from '../api/apiClient';
-import useWebSocket from '../lib/useWebSocket';
+import useWebSocket, { applyNodeDelta, applyNodeStatus } from '../lib/useWebSocket';
 import OverviewStats from '../components/OverviewStats';
 import NodeMap from '../components/NodeMap';
 import PacketStats from '../components/PacketStats';
@@ -9,7 +9,7 @@ const Dashboard = () => {
   const [nodes, setNodes] = useState([]);
   const [packets, setPackets] = useState([]);
 
-  const wsMessage = useWebSocket('ws://127.0.0.1:8000/ws');
+  const wsMessage = useWebSocket('ws://127.0.0.1:8000/ws', {});
 
   useEffect(() => {
     const fetchData = async () => {
@@ -43,6 +43,10 @@ const Dashboard = () => {
             node.uuid === wsMessage.data.uuid ? wsMessage.data : node
           )
         );
+      } else if (wsMessage.type === 'node_delta') {
+        setNodes((prevNodes) => applyNodeDelta(prevNodes, wsMessage.data));
+      } else if (wsMessage.type === 'node_status') {
+        setNodes((prevNodes) => applyNodeStatus(prevNodes, wsMessage.data));
       } else if (wsMessage.type === 'node_deleted') {
         setNodes((prevNodes) =>
           prevNodes.filter((node) => node.uuid !== wsMessage.data.uuid)
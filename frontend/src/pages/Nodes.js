@@ -1,13 +1,13 @@
 import React, { useState, useEffect } from 'react';
 import { Link } from 'react-router-dom';
 import { getNodes } from '../api/apiClient';
-import useWebSocket from '../lib/useWebSocket';
+import useWebSocket, { applyNodeDelta, applyNodeStatus } from '../lib/useWebSocket';
 import NodeRegistration from '../components/NodeRegistration';
 
 const Nodes = () => {
   const [nodes, setNodes] = useState([]);
 
-  const wsMessage = useWebSocket('ws://127.0.0.1:8000/ws');
+  const wsMessage = useWebSocket('ws://127.0.0.1:8000/ws', { types: ['new_node', 'node_update', 'node_status', 'node_deleted'] });
 
   useEffect(() => {
     const fetchData = async () => {
@@ -27,6 +27,10 @@ const Nodes = () => {
             node.uuid === wsMessage.data.uuid ? wsMessage.data : node
           )
         );
+      } else if (wsMessage.type === 'node_delta') {
+        setNodes((prevNodes) => applyNodeDelta(prevNodes, wsMessage.data));
+      } else if (wsMessage.type === 'node_status') {
+        setNodes((prevNodes) => applyNodeStatus(prevNodes, wsMessage.data));
       } else if (wsMessage.type === 'node_deleted') {
         setNodes((prevNodes) =>
           prevNodes.filter((node) => node.uuid !== wsMessage.data.uuid)
@@ -5,7 +5,7 @@ import useWebSocket from '../lib/useWebSocket';
 const Packets = () => {
   const [packets, setPackets] = useState([]);
 
-  const wsMessage = useWebSocket('ws://127.0.0.1:8000/ws');
+  const wsMessage = useWebSocket('ws://127.0.0.1:8000/ws', { types: ['new_packet'] });
 
   useEffect(() => {
     const fetchData = async () => {
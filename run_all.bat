@@ -16,7 +16,7 @@ SET NOVCOMM_SECRET_KEY=your_super_secret_key_here
 
 REM --- Start Backend (FastAPI) ---
 ECHO Starting NovaComm++ Backend...
-START /B cmd /c "cd backend && uvicorn main:app --host 0.0.0.0 --port 8000 --reload > backend_log.txt 2>&1"
+START /B cmd /c "cd backend && uvicorn main:app --host 0.0.0.0 --port 8000 --reload --ws-per-message-deflate true > backend_log.txt 2>&1"
 ECHO Backend started. Check backend_log.txt for output.
 
 REM --- Start Frontend (React) ---